@@ -1,3 +1,4 @@
+import argparse
 import logging
 import time
 import timeit
@@ -9,10 +10,18 @@ from sdd_code.utilities.field_definitions import derivations, exclusion_flags
 from sdd_code.utilities import logger_config
 from sdd_code.utilities import parameters as param
 from sdd_code.utilities.data_import import import_sav_values
-from sdd_code.models import model_tables
+from sdd_code.models import model_data, model_runner, model_tables
 
 
-def main():
+def main(workers=param.WORKERS):
+    """Fit the models and write their outputs to the models workbook.
+
+    Parameters
+    ----------
+    workers: int
+        The number of processes to fit the models with, each model's sheets are
+        written as soon as it finishes. Defaults to value in parameters.py
+    """
     df = import_sav_values(file_path=param.PUPIL_DATA_PATH, drop_col=param.DROP_COLUMNS)
 
     # Add derived variables from the derivations module, based on the list
@@ -30,6 +39,10 @@ def main():
     # Treat all missing values the same for models
     df = df.replace([-7, -8, -1], -9)
 
+    # Filter the data and code the factors once, for all of the models
+    logging.info("Creating the shared model data")
+    data = model_data.create_model_data(df)
+
     # Where to save models, and model functions
     output = model_tables.get_models()
 
@@ -37,14 +50,13 @@ def main():
     logging.info(f"Writing tables to {output_path}")
     wb = xw.Book(output_path)
 
-    # Populate the sheets
-    for model in output["models"]:
+    # Populate the sheets, as each model is fitted
+    for model, model_output in model_runner.run_models(
+        output["models"], data, workers=workers
+    ):
         # Write the output datasets to the relevant tabs
         logging.info(f"Writing output for {model['name']}")
 
-        # Calculate the actual model
-        model_data = model["content"](df)
-
         # Each model creates several sheets of information
         for sheet in model["sheets"]:
             sheet_name = f"{model['name']}_{sheet}"
@@ -54,7 +66,7 @@ def main():
             sht = wb.sheets[sheet_name]
             sht.select()
             sht.clear_contents()
-            content_df = model_data[sheet]
+            content_df = model_output[sheet]
             sht.range("A1").options(pd.DataFrame, index=False).value = content_df
 
             logging.debug(f"Output dataframe of size {content_df.shape}")
@@ -66,6 +78,15 @@ def main():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the SDD regression models")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=param.WORKERS,
+        help="Number of processes used to fit the models",
+    )
+    args = parser.parse_args()
+
     # Setup logging
     formatted_time = time.strftime("%Y%m%d-%H%M%S")
     logger = logger_config.setup_logger(
@@ -75,7 +96,7 @@ if __name__ == "__main__":
         ).as_posix())
 
     start_time = timeit.default_timer()
-    main()
+    main(workers=args.workers)
     total_time = timeit.default_timer() - start_time
     logging.info(
         f"Running time of create_models: {int(total_time / 60)} minutes and {round(total_time%60)} seconds.")
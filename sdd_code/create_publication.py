@@ -1,3 +1,4 @@
+import argparse
 import logging
 import time
 import timeit
@@ -9,8 +10,10 @@ import xlwings as xw
 import sdd_code.utilities.parameters as param
 from sdd_code.utilities.data_import import import_sav_values
 from sdd_code.utilities import publication
+from sdd_code.utilities import replicate_weights
 from sdd_code.utilities.field_definitions import derivations, exclusion_flags
 from sdd_code.utilities.processing import processing_exclusions, processing
+from sdd_code.utilities.processing import processing_planner
 from sdd_code.utilities import chapters
 from sdd_code.utilities import difference
 from sdd_code.utilities import logger_config
@@ -18,27 +21,16 @@ from tests.run_import_validation import run_all_import_tests
 from tests.run_unittests import run_all_unit_tests
 
 
-def main():
+def import_data():
     """
-    Main function used to run the pipeline.
-
-    Runs each element of the pipeline as determined by the run parameters in
-    parameters.py
+    Import the pupil and teacher data, add the derivations and exclusion flags, and
+    apply the exclusions.
 
+    Returns
+    -------
+    tuple[pandas.DataFrame, pandas.DataFrame]
+        The filtered pupil and teacher data
     """
-    # --- Run required import and unit tests ---
-
-    # Check that input tests are passing, set flag in params to skip
-    run_all_import_tests(
-        pupil=param.RUN_PUPIL_INPUT_TESTS,
-        teacher=param.RUN_TEACHER_INPUT_TESTS)
-
-    # Check that unit tests are passing, set flag in params to skip
-    # Currently runs the derivation and processing unit tests only
-    run_all_unit_tests(
-        derivations=param.RUN_DERIVATION_UNIT_TESTS,
-        processing=param.RUN_PROCESSING_UNIT_TESTS)
-
     # --- Import the data ---
 
     # Execute the import data function on the pupil file
@@ -78,26 +70,108 @@ def main():
     # Apply school, dummy drug and outlier filters
     df_filt = processing_exclusions.apply_exclusions(df)
 
-    # --- Write unfiltered data to external file ---
+    return df_filt, df_teacher_filt
 
-    # Write the final pupil and teacher data to csv
-    # Flag to skip can be set in parameters
-    if param.WRITE_ASSET is True:
-        publication.write_csv(df_filt, "pupildata")
-        publication.write_csv(df_teacher_filt, "teacherdata")
 
-    # --- Create and write the publication outputs using the filtered data ---
+def main(workers=param.WORKERS):
+    """
+    Main function used to run the pipeline.
+
+    Runs each element of the pipeline as determined by the run parameters in
+    parameters.py
+
+    Parameters
+    ----------
+    workers: int
+        The number of processes used to create the tables, defaults to value in
+        parameters.py
+
+    """
+    # --- Run required import and unit tests ---
+
+    # Check that input tests are passing, set flag in params to skip
+    run_all_import_tests(
+        pupil=param.RUN_PUPIL_INPUT_TESTS,
+        teacher=param.RUN_TEACHER_INPUT_TESTS)
+
+    # Check that unit tests are passing, set flag in params to skip
+    # Currently runs the derivation and processing unit tests only
+    run_all_unit_tests(
+        derivations=param.RUN_DERIVATION_UNIT_TESTS,
+        processing=param.RUN_PROCESSING_UNIT_TESTS)
 
     # Prepare the sheet content for each chapter, based on the list in all_chapters
     all_chapters = chapters.get_chapters()
 
+    # Skip a chapter if CHAPTER_ALL is False and the chapter param is False.
+    run_chapters = [
+        chapter for chapter in all_chapters
+        if param.CHAPTER_ALL | chapter["run_chapter"]
+    ]
+
+    # Load the weighted totals of each PSU that the tables can be created from, if
+    # set in parameters.py. The store must have been created from the same data
+    # and exclusion parameters
+    if param.TOTALS_STORE == "load":
+        stores = processing_planner.load_chapter_stores(
+            fingerprints=processing_planner.get_store_fingerprints()
+        )
+    else:
+        stores = None
+
+    # The data is only needed for tables that aren't in the store
+    in_stores = stores is not None and processing_planner.in_chapter_stores(
+        run_chapters, stores
+    )
+    if in_stores:
+        logging.info("All tables are in the totals store, so the data isn't imported")
+        df_filt = None
+        df_teacher_filt = None
+    else:
+        if stores is not None:
+            logging.info("Not all tables are in the totals store, importing the data")
+        df_filt, df_teacher_filt = import_data()
+
+        # --- Write unfiltered data to external file ---
+
+        # Write the final pupil and teacher data to csv
+        # Flag to skip can be set in parameters
+        if param.WRITE_ASSET is True:
+            publication.write_csv(df_filt, "pupildata")
+            publication.write_csv(df_teacher_filt, "teacherdata")
+
+        # Create the replicate weights of the survey design of the pupil and teacher
+        # data, saved with the data asset and used for the standard errors if
+        # SE_ENGINE is "replicate"
+        if param.SE_ENGINE == "replicate" or param.WRITE_ASSET is True:
+            for teacher_table, data_df in [(False, df_filt), (True, df_teacher_filt)]:
+                replicates = replicate_weights.create_replicate_factors(data_df)
+                replicate_weights.save_replicate_factors(
+                    replicates,
+                    replicate_weights.get_replicate_weights_file(teacher_table),
+                )
+
+    # --- Create and write the publication outputs using the filtered data ---
+
+    # Create and save the store, if set in parameters.py
+    if param.TOTALS_STORE == "create":
+        stores = processing_planner.create_chapter_stores(
+            run_chapters, df_filt, df_teacher_filt
+        )
+        processing_planner.save_chapter_stores(
+            stores, fingerprints=processing_planner.get_store_fingerprints()
+        )
+
+    # Create the tables for all chapters being ran, tables that share breakdowns
+    # and filters are computed together
+    table_outputs = processing_planner.create_chapter_tables(
+        run_chapters, df_filt, df_teacher_filt, workers=workers, stores=stores
+    )
+
     # Open Excel application
     xw.App()
 
-    for chapter in all_chapters:
-        # Skip this chapter if CHAPTER_ALL is False or this chapter param is False.
-        if not (param.CHAPTER_ALL | chapter["run_chapter"]):
-            continue
+    for chapter in run_chapters:
         output_path = chapter["output_path"]
         table_path = chapter["table_path"]
         chapter_number = chapter["chapter_number"]
@@ -118,11 +192,9 @@ def main():
             # does and the value is True then use teacher data. If it does
             # but the value is False then use pupil, if it has no key
             # then also use pupil
-            if sheet.get("teacher_table", False):
-                content_df = pd.concat([table(df_teacher_filt) for table in
-                                        sheet["content"]])
-            else:
-                content_df = pd.concat([table(df_filt) for table in sheet["content"]])
+            teacher_table = sheet.get("teacher_table", False)
+            content_df = pd.concat([table_outputs[(teacher_table, table)]
+                                    for table in sheet["content"]])
 
             # Find the same table in the previous year (if it exists) and attempt to
             # compare the percentage column
@@ -176,6 +248,15 @@ def main():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the SDD publication outputs")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=param.WORKERS,
+        help="Number of processes used to create the tables",
+    )
+    args = parser.parse_args()
+
     # Setup logging
     formatted_time = time.strftime("%Y%m%d-%H%M%S")
     logger = logger_config.setup_logger(
@@ -185,7 +266,7 @@ if __name__ == "__main__":
         ).as_posix())
 
     start_time = timeit.default_timer()
-    main()
+    main(workers=args.workers)
     total_time = timeit.default_timer() - start_time
     logging.info(
         f"Running time of create_publication: {int(total_time / 60)} minutes and {round(total_time%60)} seconds.")
@@ -1,16 +1,138 @@
+"""
+Runs the R logistic regression model from Python through a persistent R process,
+the model server (sdd_model_server.R).
+
+The server is started the first time a model is fitted, and loads the R libraries
+and custom functions once. Each model is then sent to it as a line of JSON over
+stdin, with the data passed as Feather files, and the server replies on stdout when
+the outputs have been written. The server is stopped when Python exits.
+"""
+import atexit
+import json
+import logging
 import re
-
+import shutil
 import subprocess
+import tempfile
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
+import pyarrow.feather as feather
 # Currently rpy2 used to get R HOME, relevant portion could be extracted to
 # remove extra dependencies
 from rpy2.situation import get_r_home
 
 import sdd_code.utilities.parameters as param
 
+# Start of the line the server writes to stdout in reply to each request
+RESPONSE_PREFIX = "SDD_RESPONSE "
+
+
+class RModelServer:
+    """A persistent R process that fits models, see sdd_model_server.R.
+
+    Parameters
+    ----------
+        r_server: str|Path
+            The path to the R server script
+    """
+
+    def __init__(
+        self,
+        r_server=param.LOCAL_ROOT / "sdd_code" / "sddR" / "scripts" / "sdd_model_server.R",
+    ):
+        self.r_server = Path(r_server)
+        self.process = None
+
+    def start(self):
+        """Start the R process, and wait for it to load the libraries"""
+        # Set path to Rscript, how the R code is ran
+        r_script = Path(get_r_home()) / "bin" / "Rscript"
+
+        logging.info(f"Starting R model server {self.r_server}")
+        self.process = subprocess.Popen(
+            [str(r_script), "--vanilla", str(self.r_server)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            # Merge the console output from R, so it can't fill an unread pipe
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+        )
+
+        status = self._read_response()
+        if status != "READY":
+            raise RuntimeError(f"R model server failed to start: {status}")
+
+    def request(self, **kwargs):
+        """Send a request to the server, starting it if it isn't running, and wait
+        for the reply.
+
+        Parameters
+        ----------
+            kwargs are sent to the server as the JSON request
+
+        Raises
+        ------
+            RuntimeError
+                If the model fails in R, with the error from R
+        """
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+
+        self.process.stdin.write(json.dumps(kwargs) + "\n")
+        self.process.stdin.flush()
+
+        status = self._read_response()
+        if status != "OK":
+            raise RuntimeError(status)
+
+    def _read_response(self):
+        """Read the console output of R up to the server's reply, returning the
+        reply"""
+        console = []
+        for line in self.process.stdout:
+            if line.startswith(RESPONSE_PREFIX):
+                return line[len(RESPONSE_PREFIX):].strip()
+            console.append(line)
+            logging.debug(f"R: {line.rstrip()}")
+
+        raise RuntimeError("R model server stopped unexpectedly", "".join(console))
+
+    def stop(self):
+        """Ask the server to stop, and wait for it to exit"""
+        if self.process is None or self.process.poll() is not None:
+            return
+
+        logging.info("Stopping R model server")
+        try:
+            self.process.stdin.write(json.dumps({"command": "quit"}) + "\n")
+            self.process.stdin.close()
+            self.process.wait(timeout=60)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+
+
+# The server shared by every model in this process, started when first used
+_SERVER = None
+
+
+def get_server():
+    """Get the model server of this process, which is stopped when Python exits.
+
+    Returns
+    -------
+        RModelServer
+    """
+    global _SERVER
+
+    if _SERVER is None:
+        _SERVER = RModelServer()
+        atexit.register(_SERVER.stop)
+
+    return _SERVER
+
 
 def logit_model(
     df,
@@ -21,12 +143,13 @@ def logit_model(
     weight=param.WEIGHTING_VAR,
     strata=param.STRATA,
     psu=param.PSU,
-    r_model=param.LOCAL_ROOT / "sdd_code" / "sddR" / "scripts" / "sdd_logistic.R",
+    server=None,
     temp_data_loc=param.OUTPUT_DIR / "MasterFiles" / "intermediate_csvs",
-    clean_up=True
+    clean_up=True,
+    workers=param.MODEL_WORKERS,
 ):
-    """This calls the R logistic regression model via the command line, with arguments
-    specified via variables that are inserted into the call to Rscript.
+    """This calls the R logistic regression model via the R model server, with the
+    data and outputs passed as Feather files.
 
     Parameters
     ----------
@@ -47,13 +170,19 @@ def logit_model(
             The weighting variable in the dataset, defaults to value in parameters.py
         psu:
             The PSU (cluster) variable in the dataset, defaults to value in parameters.py
-        r_model: str|Path
-            The path to the R file containing the model code to run, default to sdd_logistic.R
-            in local R folder.
+        server: RModelServer
+            The server to fit the model with, defaults to the server of this process
+            from get_server
         temp_data_loc: str|Path
-            The folder to output the temporary CSVs in, default to intermediate_csvs
+            The folder to output the temporary Feather files in, default to
+            intermediate_csvs. Each call uses its own new subfolder, so models
+            can be fitted concurrently by several processes
         clean_up: bool
-            Whether to delete temporary files, default to True
+            Whether to delete the temporary files and their subfolder, default
+            to True
+        workers: int
+            The number of R processes used to refit the model without each effect,
+            defaults to value in parameters.py
 
     Returns
     -------
@@ -75,71 +204,49 @@ def logit_model(
     # Select just the variables we are interested in
     df = df[[model_response, *effects_list, strata, psu, weight]]
 
-    # Set root for model data
-    root = Path(temp_data_loc)
+    # Set a folder for this model's data, so concurrent models don't share files
+    Path(temp_data_loc).mkdir(parents=True, exist_ok=True)
+    root = Path(tempfile.mkdtemp(prefix="sdd_model_", dir=temp_data_loc))
 
     # Set files for input/output
-    model_data_file = root / "sdd_model_data.csv"
-    factor_ref_file = root / "factors_to_refs.csv"
-    output_model_file = root / "sdd_model.csv"
-    output_c_file = root / "sdd_model_effects.csv"
-
-    # Save input dataframes
-    df.to_csv(model_data_file, index=False)
-    factor_ref.to_csv(factor_ref_file, index=False)
-
-    # Set model details
-    formula = f"{model_response} ~" + "+".join(model_effects)
-
-    # Set path to Rscript, how the R code is ran
-    r_script = Path(get_r_home()) / "bin" / "Rscript"
-
-    result = subprocess.run(
-        [
-            str(r_script),
-            "--vanilla",
-            str(r_model),
-            "--model_data_file",
-            str(model_data_file),
-            "--output_model_file",
-            str(output_model_file),
-            "--output_c_file",
-            str(output_c_file),
-            "--factor_ref",
-            str(factor_ref_file),
-            "--formula",
-            formula,
-            "--strata",
-            strata,
-            "--psu",
-            psu,
-            "--weight",
-            weight,
-            "--bubble_factor",
-            str(bubble_factor)
-        ],
-        # Capture console output from R
-        capture_output=True,
-        # Raises an error if the process fails
-        # check=True
-    )
-
-    if result.returncode:
-        raise RuntimeError(
-            result.stdout.decode("utf-8"),
-            result.stderr.decode("utf-8")
+    model_data_file = root / "sdd_model_data.feather"
+    factor_ref_file = root / "factors_to_refs.feather"
+    output_model_file = root / "sdd_model.feather"
+    output_c_file = root / "sdd_model_effects.feather"
+
+    try:
+        # Save input dataframes, Feather needs a default index
+        feather.write_feather(df.reset_index(drop=True), model_data_file)
+        feather.write_feather(
+            factor_ref.astype(str).reset_index(drop=True), factor_ref_file
         )
-    # Get output data from where R saved it
 
-    model = pd.read_csv(output_model_file)
-    c_stats = pd.read_csv(output_c_file)
+        # Set model details
+        formula = f"{model_response} ~" + "+".join(model_effects)
+
+        if server is None:
+            server = get_server()
+
+        server.request(
+            model_data_file=str(model_data_file),
+            factor_ref_file=str(factor_ref_file),
+            output_model_file=str(output_model_file),
+            output_c_file=str(output_c_file),
+            formula=formula,
+            strata=strata,
+            psu=psu,
+            weight=weight,
+            bubble_factor=bubble_factor,
+            workers=workers,
+        )
 
-    if clean_up:
-        # Delete temp files
-        model_data_file.unlink()
-        factor_ref_file.unlink()
-        output_model_file.unlink()
-        output_c_file.unlink()
+        # Get output data from where R saved it
+        model = feather.read_feather(output_model_file)
+        c_stats = feather.read_feather(output_c_file)
+    finally:
+        if clean_up:
+            # Delete temp files
+            shutil.rmtree(root, ignore_errors=True)
 
     model["Year"] = param.YEAR
 
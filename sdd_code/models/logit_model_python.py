@@ -0,0 +1,792 @@
+"""
+Survey weighted logistic regression in Python, giving the same output as the R
+models in logit_model_rpy2 and logit_model_R without needing an R process.
+
+The model is fitted in the same way as survey::svyglm with a quasibinomial family.
+The coefficients are found by iteratively reweighted least squares using the
+survey weights, and their covariance is the linearisation (sandwich) estimator,
+with the variance of the scores taken between the PSUs of each stratum.
+"""
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy import special
+from scipy import stats as scipy_stats
+
+import sdd_code.utilities.parameters as param
+from sdd_code.utilities import stats
+
+INTERCEPT = "(Intercept)"
+
+
+def get_effect_variables(model_effects):
+    """Get every variable used in the effects, in order of first use.
+
+    Parameters
+    ----------
+        model_effects: list[str]
+            The effect variables, interactions entered as "effect1*effect2" or
+            "effect1:effect2"
+
+    Returns
+    -------
+        list[str]
+    """
+    return list(dict.fromkeys(
+        var for eff in model_effects for var in re.split(r"\*|\||\:", eff)
+    ))
+
+
+def get_model_terms(model_effects):
+    """Expand the effects into the terms of the model, in the same order as R.
+    An effect "effect1*effect2" gives both main effects and their interaction,
+    while "effect1:effect2" only gives the interaction.
+
+    Parameters
+    ----------
+        model_effects: list[str]
+
+    Returns
+    -------
+        list[tuple[str]]
+            The variables in each term, main effects before interactions
+    """
+    terms = {}
+    for eff in model_effects:
+        if "*" in eff:
+            variables = eff.split("*")
+            for order in range(1, len(variables) + 1):
+                terms.update(
+                    {term: None for term in _ordered_combinations(variables, order)}
+                )
+        else:
+            terms[tuple(re.split(r"\||\:", eff))] = None
+
+    # R puts the terms in order of how many variables are in them
+    return sorted(terms, key=len)
+
+
+def _ordered_combinations(variables, order):
+    """Combinations of the variables of a given size, in the order they are listed"""
+    if order == 0:
+        return [()]
+    return [
+        (var, *rest)
+        for i, var in enumerate(variables)
+        for rest in _ordered_combinations(variables[i + 1:], order - 1)
+    ]
+
+
+def _level_label(value):
+    """Label of a factor level as R would print it, e.g. 1.0 is "1" """
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def encode_factor(values, ref=None):
+    """Code a column as a factor, with the levels in ascending order as in R.
+
+    Parameters
+    ----------
+        values: pd.Series
+        ref: str
+            Optional label of the reference level, which is moved to the start of
+            the levels
+
+    Returns
+    -------
+        np.ndarray, list[str]
+            The level code of each row, and the label of each level
+    """
+    codes, uniques = pd.factorize(values, sort=True)
+    labels = [_level_label(value) for value in uniques]
+
+    if ref is not None:
+        if str(ref) not in labels:
+            raise ValueError(f"Reference level {ref} not found in {values.name}")
+        # Move the reference level to the front, keeping the order of the rest
+        order = [labels.index(str(ref))] + [
+            i for i, label in enumerate(labels) if label != str(ref)
+        ]
+        codes = np.argsort(order)[codes]
+        labels = [labels[i] for i in order]
+
+    return codes, labels
+
+
+def encode_variables(df, variables, factor_ref):
+    """Code each variable as the columns it has in a design matrix, with treatment
+    contrasts for the factors so each coefficient compares a level to the reference
+    level.
+
+    Columns listed in factor_ref, and any non numeric columns, are factors. Their
+    columns are named as in R, e.g. "dgender2".
+
+    Parameters
+    ----------
+        df: pd.DataFrame
+            A dataframe containing the data to model, without missing values
+        variables: list[str]
+        factor_ref: pd.DataFrame
+            A dataframe with rows of variables and the reference level to use for
+            this variable
+
+    Returns
+    -------
+        dict, dict
+            The design columns of each variable, by column name, and the level
+            labels and codes of each factor
+    """
+    refs = dict(zip(factor_ref["factors"], factor_ref["refs"]))
+
+    factors = {}
+    columns = {}
+    for var in variables:
+        if var in refs or not pd.api.types.is_numeric_dtype(df[var]):
+            codes, labels = encode_factor(df[var], refs.get(var))
+            factors[var] = {"codes": codes, "labels": labels}
+            # Treatment contrasts, a column for each level except the reference
+            columns[var] = {
+                f"{var}{label}": (codes == i).astype(float)
+                for i, label in enumerate(labels) if i > 0
+            }
+        else:
+            columns[var] = {var: df[var].to_numpy(dtype=float)}
+
+    return columns, factors
+
+
+def build_design_matrix(columns, model_effects, n_rows):
+    """Create the design matrix of a model from the design columns of its variables,
+    with interactions named as in R, e.g. "dgender2:region3".
+
+    Parameters
+    ----------
+        columns: dict
+            The design columns of each variable, from encode_variables
+        model_effects: list[str]
+        n_rows: int
+
+    Returns
+    -------
+        np.ndarray, list[str], dict
+            The design matrix, the name of each column, and the columns of each term
+            (e.g. "dgender" or "dgender:age1315")
+    """
+    names = [INTERCEPT]
+    design = [np.ones(n_rows)]
+    terms = {}
+    for term in get_model_terms(model_effects):
+        term_columns = {"": np.ones(n_rows)}
+        # The first variable's levels change fastest, as in R
+        for var in term:
+            term_columns = {
+                f"{name}:{var_name}" if name else var_name: values * var_values
+                for var_name, var_values in columns[var].items()
+                for name, values in term_columns.items()
+            }
+        terms[":".join(term)] = list(range(len(names), len(names) + len(term_columns)))
+        names.extend(term_columns)
+        design.extend(term_columns.values())
+
+    return np.column_stack(design), names, terms
+
+
+def create_design_matrix(df, model_effects, factor_ref):
+    """Create the design matrix of the model, see encode_variables and
+    build_design_matrix.
+
+    Parameters
+    ----------
+        df: pd.DataFrame
+            A dataframe containing the data to model, without missing values
+        model_effects: list[str]
+        factor_ref: pd.DataFrame
+            A dataframe with rows of variables and the reference level to use for
+            this variable
+
+    Returns
+    -------
+        np.ndarray, list[str], dict, dict
+            The design matrix, the name of each column, the columns of each term,
+            and the level labels and codes of each factor
+    """
+    columns, factors = encode_variables(
+        df, get_effect_variables(model_effects), factor_ref
+    )
+    design, names, terms = build_design_matrix(columns, model_effects, len(df))
+
+    return design, names, terms, factors
+
+
+def get_response(df, model_response, factor_ref):
+    """Code the response as 1 for the outcome being modelled, and 0 for the
+    reference level set in factor_ref (or 0 if the response isn't in factor_ref).
+
+    Parameters
+    ----------
+        df: pd.DataFrame
+        model_response: str
+        factor_ref: pd.DataFrame
+
+    Returns
+    -------
+        np.ndarray
+    """
+    refs = dict(zip(factor_ref["factors"], factor_ref["refs"]))
+
+    if model_response in refs:
+        codes, _ = encode_factor(df[model_response], refs[model_response])
+        return (codes > 0).astype(float)
+
+    return df[model_response].to_numpy(dtype=float)
+
+
+def fit_logit(design, response, weights, start=None, tol=1e-8, max_iter=25):
+    """Fit a weighted logistic regression by iteratively reweighted least squares,
+    with the same starting values and convergence criterion as R's glm.
+
+    Parameters
+    ----------
+        design: np.ndarray
+        response: np.ndarray
+            1 for the modelled outcome, else 0
+        weights: np.ndarray
+            The survey weights of each row
+        start: np.ndarray
+            Optional starting coefficients, e.g. from a similar model
+        tol: float
+            Convergence tolerance on the relative change in deviance
+        max_iter: int
+
+    Returns
+    -------
+        dict
+            With keys 'coefficients', 'fitted' (the fitted probabilities),
+            'deviance', 'dispersion' (the quasibinomial dispersion, as given by
+            summary.svyglm) and 'iterations'
+    """
+    # svyglm rescales the weights to a mean of 1, this doesn't change the
+    # coefficients but gives the same deviance as R
+    weights = weights / weights.mean()
+
+    if start is None:
+        eta = special.logit((weights * response + 0.5) / (weights + 1))
+    else:
+        eta = design @ start
+    fitted = special.expit(eta)
+    deviance = _deviance(response, fitted, weights)
+
+    for iteration in range(1, max_iter + 1):
+        variance = fitted * (1 - fitted)
+        working_weights = weights * variance
+        working_response = eta + (response - fitted) / variance
+
+        information = design.T @ (design * working_weights[:, None])
+        coefficients = np.linalg.solve(
+            information, design.T @ (working_weights * working_response)
+        )
+
+        eta = design @ coefficients
+        fitted = special.expit(eta)
+        deviance_old, deviance = deviance, _deviance(response, fitted, weights)
+
+        if abs(deviance - deviance_old) / (abs(deviance) + 0.1) < tol:
+            break
+
+    pearson_residuals = (response - fitted) / np.sqrt(fitted * (1 - fitted))
+
+    return {
+        "coefficients": coefficients,
+        "fitted": fitted,
+        "deviance": deviance,
+        "dispersion": np.sum(weights * pearson_residuals ** 2) / np.sum(weights),
+        "iterations": iteration,
+    }
+
+
+def _deviance(response, fitted, weights):
+    """Binomial deviance of the fitted probabilities"""
+    return 2 * np.sum(
+        weights * (special.xlogy(response, response / fitted)
+                   + special.xlogy(1 - response, (1 - response) / (1 - fitted)))
+    )
+
+
+def design_covariance(design, response, fitted, weights, strata, psu):
+    """Linearisation (sandwich) covariance of the coefficients of a survey
+    logistic regression, as used by survey::svyglm.
+
+    The scores of each row are totalled within PSUs, and the variance is taken
+    between the PSUs of each stratum, scaled by n / (n - 1) for n PSUs. PSUs are
+    nested in strata, and single PSU strata are treated as certainty units.
+
+    Parameters
+    ----------
+        design: np.ndarray
+        response: np.ndarray
+        fitted: np.ndarray
+            The fitted probabilities of the model
+        weights: np.ndarray
+        strata: np.ndarray
+        psu: np.ndarray
+
+    Returns
+    -------
+        np.ndarray, int
+            The covariance matrix, and the design degrees of freedom (the number
+            of PSUs less the number of strata)
+    """
+    n_rows = len(response)
+
+    information = design.T @ (design * (weights * fitted * (1 - fitted))[:, None])
+    scores = (design * (weights * (response - fitted))[:, None]) @ np.linalg.inv(
+        information
+    )
+
+    # Total the scores in each PSU, then centre them on their stratum mean
+    row_strata, _ = pd.factorize(strata)
+    row_psus, psu_labels = pd.factorize(psu)
+    # PSUs are nested in strata, so each PSU is a pair of codes
+    psu_values, psu_codes = np.unique(
+        row_strata * len(psu_labels) + row_psus, return_inverse=True
+    )
+    strata_codes = psu_values // len(psu_labels)
+    n_psus = len(psu_values)
+
+    psu_membership = sparse.csr_matrix(
+        (np.ones(n_rows), (psu_codes, np.arange(n_rows))), shape=(n_psus, n_rows)
+    )
+    psu_totals = psu_membership @ scores
+
+    strata_psus = np.bincount(strata_codes)
+    strata_means = np.zeros((len(strata_psus), scores.shape[1]))
+    np.add.at(strata_means, strata_codes, psu_totals)
+    strata_means /= strata_psus[:, None]
+    centred = psu_totals - strata_means[strata_codes]
+
+    with np.errstate(divide="ignore"):
+        scale = np.where(strata_psus > 1, strata_psus / (strata_psus - 1), 0)
+    covariance = centred.T @ (centred * scale[strata_codes][:, None])
+
+    return covariance, n_psus - len(strata_psus)
+
+
+def design_aic(design, fitted, weights, covariance, deviance):
+    """The design based AIC of a survey logistic regression, as given by AIC() of a
+    svyglm model in R (Lumley and Scott, 2015).
+
+    The number of parameters is replaced by the sum of the design effects of the
+    coefficients (excluding the intercept), the eigenvalues of the model based
+    covariance inverted and multiplied by the design based covariance.
+
+    Parameters
+    ----------
+        design: np.ndarray
+        fitted: np.ndarray
+            The fitted probabilities of the model
+        weights: np.ndarray
+        covariance: np.ndarray
+            The design based covariance, from design_covariance
+        deviance: float
+            The deviance of the model, from fit_logit
+
+    Returns
+    -------
+        dict
+            With keys 'eff_p', the effective number of parameters, and 'AIC'
+    """
+    # The model based covariance uses the weights rescaled to a mean of 1, as svyglm
+    weights = weights / weights.mean()
+    information = design.T @ (design * (weights * fitted * (1 - fitted))[:, None])
+    naive_covariance = np.linalg.inv(information)[1:, 1:]
+
+    design_effects = np.linalg.eigvals(
+        np.linalg.solve(naive_covariance, covariance[1:, 1:])
+    )
+    eff_p = float(np.sum(design_effects.real))
+
+    return {"eff_p": eff_p, "AIC": deviance + 2 * eff_p}
+
+
+def wald_term_tests(coefficients, covariance, terms, variables, df):
+    """Wald F test of each variable's main effect, i.e. whether all of its
+    coefficients are 0, as in survey::regTermTest with method="Wald".
+
+    Parameters
+    ----------
+        coefficients: np.ndarray
+        covariance: np.ndarray
+        terms: dict
+            The columns of each term, from create_design_matrix
+        variables: list[str]
+        df: int
+            Denominator degrees of freedom
+
+    Returns
+    -------
+        pd.DataFrame
+            With columns Variable and ProbF
+    """
+    prob_f = []
+    for var in variables:
+        # Only the main effect is tested, as in sas_anova
+        columns = terms.get(var)
+        if not columns:
+            prob_f.append(np.nan)
+            continue
+
+        beta = coefficients[columns]
+        statistic = beta @ np.linalg.solve(covariance[np.ix_(columns, columns)], beta)
+        prob_f.append(scipy_stats.f.sf(statistic / len(columns), len(columns), df))
+
+    return pd.DataFrame({"Variable": variables, "ProbF": prob_f})
+
+
+def format_model_output(coefficients, covariance, names, factors, df, anova_stats):
+    """Format the model in the same way as the R function format_model_output,
+    with a row for each level of each factor (the reference level having no
+    coefficient) and each other coefficient.
+
+    Parameters
+    ----------
+        coefficients: np.ndarray
+        covariance: np.ndarray
+        names: list[str]
+        factors: dict
+            The labels and codes of each factor, from create_design_matrix
+        df: int
+            Residual degrees of freedom, used for the p-values and confidence
+            intervals
+        anova_stats: pd.DataFrame
+            From wald_term_tests
+
+    Returns
+    -------
+        pd.DataFrame
+    """
+    stderror = np.sqrt(np.diag(covariance))
+    t_value = coefficients / stderror
+
+    # R's confint.svyglm gives a t based interval by adjusting the level of a
+    # normal interval, which is reproduced so that the outputs match
+    level = 1 - 2 * scipy_stats.norm.cdf(scipy_stats.t.ppf(0.025, df))
+    z_value = scipy_stats.norm.ppf((1 + level) / 2)
+
+    output = pd.DataFrame(
+        {
+            "Measure": names,
+            "coefficient": coefficients,
+            "odds_ratio": np.exp(coefficients),
+            "prob_gt_t": 2 * scipy_stats.t.sf(np.abs(t_value), df),
+            "stderror": stderror,
+            "lower_ci": np.exp(coefficients - z_value * stderror),
+            "upper_ci": np.exp(coefficients + z_value * stderror),
+        }
+    )
+
+    # Each level of the factors, with the number of rows at that level
+    levels = pd.DataFrame(
+        [
+            {"Variable": var, "Measure": f"{var}{label}", "N": float(count)}
+            for var in sorted(factors)
+            for label, count in zip(
+                factors[var]["labels"],
+                np.bincount(
+                    factors[var]["codes"], minlength=len(factors[var]["labels"])
+                ),
+            )
+        ],
+        columns=["Variable", "Measure", "N"],
+    )
+
+    # Other coefficients only have a Variable if they are a continuous effect
+    others = output.loc[~output["Measure"].isin(levels["Measure"]), ["Measure"]]
+    others.insert(
+        0,
+        "Variable",
+        others["Measure"].where(others["Measure"].isin(anova_stats["Variable"]), None),
+    )
+    others["N"] = np.nan
+
+    output = pd.concat([levels, others], ignore_index=True).merge(
+        output, how="left", on="Measure"
+    )
+    output = output.merge(anova_stats, how="left", on="Variable")
+
+    column_order = [
+        "Variable",
+        "Measure",
+        "N",
+        "coefficient",
+        "odds_ratio",
+        "prob_gt_t",
+        "stderror",
+        "lower_ci",
+        "upper_ci",
+        "ProbF",
+    ]
+
+    return output[column_order]
+
+
+def refit_without_effects(design, terms, names, effects, response, weights,
+                          full_fit, full_names, workers=param.MODEL_WORKERS):
+    """Refit a main effects model once without each effect, starting each refit from
+    the coefficients of the full model.
+
+    The design of each refit is a slice of the main effects design, so the factors
+    are only coded once. The refits are independent, so are ran concurrently in a
+    pool of threads, as numpy releases the GIL for the matrix products that take
+    most of the time.
+
+    Parameters
+    ----------
+        design: np.ndarray
+            The design matrix of the main effects of all the effects
+        terms: dict
+            The columns of each term of design, from create_design_matrix
+        names: list[str]
+            The name of each column of design
+        effects: list[str]
+        response: np.ndarray
+        weights: np.ndarray
+        full_fit: dict
+            The fit of the full model, from fit_logit
+        full_names: list[str]
+            The name of each coefficient of the full model
+        workers: int
+            The number of refits to run at once, 1 runs them one after another
+
+    Returns
+    -------
+        list[dict]
+            The fit without each effect, from fit_logit
+    """
+    full_coefficients = dict(zip(full_names, full_fit["coefficients"]))
+
+    def refit(effect):
+        columns = [0] + [
+            column for eff in effects if eff != effect for column in terms[eff]
+        ]
+        # Coefficients that aren't in the full model start at 0
+        start = np.array([full_coefficients.get(names[i], 0) for i in columns])
+
+        return fit_logit(design[:, columns], response, weights, start=start)
+
+    if workers <= 1:
+        return [refit(effect) for effect in effects]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(refit, effects))
+
+
+def effect_c_stats(df, model_response, model_effects, bubble_factor, factor_ref,
+                   weight, full_fit, full_design, full_names, full_terms,
+                   workers=param.MODEL_WORKERS):
+    """Calculate the impact of each effect on the model, from the c statistic of the
+    model refitted without that effect. Gives the same output as the R function
+    effect_c_stats, sorted by the strength of the effect.
+
+    Parameters
+    ----------
+        df: pd.DataFrame
+        model_response: str
+        model_effects: list[str]
+        bubble_factor: int
+        factor_ref: pd.DataFrame
+        weight: str
+        full_fit: dict
+            The fit of the full model, from fit_logit
+        full_design: np.ndarray
+            The design matrix of the full model
+        full_names: list[str]
+            The name of each coefficient of the full model
+        full_terms: dict
+            The columns of each term of the full model
+        workers: int
+            The number of refits to run at once, defaults to value in parameters.py
+
+    Returns
+    -------
+        pd.DataFrame
+    """
+    response = get_response(df, model_response, factor_ref)
+    weights = df[weight].to_numpy(dtype=float)
+    effects = get_effect_variables(model_effects)
+
+    # As in R, the refitted models only have the main effects of the other
+    # variables, which are columns of the full model unless it has an interaction
+    # without its main effects
+    if all(effect in full_terms for effect in effects):
+        design, names, terms = full_design, full_names, full_terms
+    else:
+        design, names, terms, _ = create_design_matrix(df, effects, factor_ref)
+    fits = refit_without_effects(
+        design, terms, names, effects, response, weights, full_fit, full_names,
+        workers
+    )
+
+    # The c statistics of the full model and every refit in one call
+    c_stats = stats.c_statistics(
+        response,
+        np.column_stack([full_fit["fitted"], *(fit["fitted"] for fit in fits)]),
+    )
+    pair_no = int((response == 1).sum() * (response == 0).sum())
+
+    return format_effect_contributions(c_stats, effects, pair_no, bubble_factor)
+
+
+def format_effect_contributions(c_stats, effects, pairs, bubble_factor):
+    """Format the c statistics of a model in the same way as the R function
+    effect_c_stats, with the number of incorrectly ordered pairs of rows each effect
+    prevents, sorted by the strength of the effect.
+
+    Parameters
+    ----------
+        c_stats: np.ndarray
+            The c statistic of the full model, then of the model without each
+            effect
+        effects: list[str]
+        pairs: int
+            The number of pairs of rows with different responses
+        bubble_factor: int
+
+    Returns
+    -------
+        pd.DataFrame
+    """
+    combined_c = c_stats[0]
+    incorrect = pairs - combined_c * pairs
+
+    c_stat_df = pd.DataFrame(
+        {
+            "pairs": pairs,
+            "bubble_factor": bubble_factor,
+            "effect": effects,
+            "c_statistic": c_stats[1:],
+        }
+    )
+    c_stat_df["incorrect_guesses"] = pairs * (1 - c_stat_df["c_statistic"])
+    c_stat_df["add_incorrect_guesses"] = c_stat_df["incorrect_guesses"] - incorrect
+    c_stat_df["guess_reduction"] = (
+        c_stat_df["add_incorrect_guesses"] / c_stat_df["incorrect_guesses"]
+    )
+    c_stat_df["bubble_diam"] = (
+        np.sqrt(c_stat_df["guess_reduction"] / np.pi) * 2 * bubble_factor
+    )
+
+    # The overall model row has a guess reduction of 1, so it stays at the top
+    overall = pd.DataFrame(
+        {
+            "pairs": [pairs],
+            "bubble_factor": [bubble_factor],
+            "effect": [""],
+            "c_statistic": [combined_c],
+            "incorrect_guesses": [incorrect],
+            "add_incorrect_guesses": [np.nan],
+            "guess_reduction": [1.0],
+            "bubble_diam": [np.nan],
+        }
+    )
+
+    output = pd.concat([overall, c_stat_df], ignore_index=True)
+    output = output.sort_values(by="guess_reduction", ascending=False)
+
+    return output.reset_index(drop=True)
+
+
+def logit_model(
+    df,
+    model_response,
+    model_effects,
+    bubble_factor,
+    factor_ref=pd.DataFrame(**param.FACTOR_REF),
+    weight=param.WEIGHTING_VAR,
+    strata=param.STRATA,
+    psu=param.PSU,
+    workers=param.MODEL_WORKERS,
+    encoded=None,
+):
+    """
+    Create a survey logistic regression model of model response against effect,
+    without using R. Gives the same output as logit_model_rpy2.logit_model.
+
+    Parameters
+    ----------
+        df: pd.DataFrame
+            A dataframe containing the data to model
+        model_response: str
+            The response variable that is being modelled
+        model_effects: list[str]
+            The effect variables. To test for an interaction, enter
+            the variables as "effect1*effect2".
+        bubble_factor: int
+            Multiplying factor for bubble visualisation of model effects
+        factor_ref: pd.DataFrame
+            A dataframe with rows of variables and the reference level to use for this
+            variable, defaults to value in parameters.py
+        weight: str
+            The weighting variable in the dataset, defaults to value in parameters.py
+        strata: str
+            The strata variable in the dataset, defaults to value in parameters.py
+        psu: str
+            The PSU (cluster) variable in the dataset, defaults to value in parameters.py
+        workers: int
+            The number of threads used to refit the model without each effect,
+            defaults to value in parameters.py
+        encoded: tuple
+            Optional design matrix, column names, term columns and factors of the
+            effects for the rows of df, as returned by create_design_matrix, e.g. from
+            model_data.select_model_data. If given the factors aren't coded again
+
+    Returns
+    -------
+        Dict[str, pd.DataFrame]
+        Dataframes of model information stored in a dictionary
+    """
+    effects_list = get_effect_variables(model_effects)
+
+    # Select just the variables we are interested in, and fill in missing data
+    df = df[[model_response, *effects_list, strata, psu, weight]].fillna(-9)
+
+    if encoded is None:
+        encoded = create_design_matrix(df, model_effects, factor_ref)
+    design, names, terms, factors = encoded
+    response = get_response(df, model_response, factor_ref)
+    weights = df[weight].to_numpy(dtype=float)
+
+    fit = fit_logit(design, response, weights)
+    covariance, degrees_freedom = design_covariance(
+        design,
+        response,
+        fit["fitted"],
+        weights,
+        df[strata].to_numpy(),
+        df[psu].to_numpy(),
+    )
+    # Residual degrees of freedom, as used by svyglm
+    residual_df = degrees_freedom + 1 - len(names)
+
+    # Calculate the overall significance of each effect
+    anova_stats = wald_term_tests(
+        fit["coefficients"], covariance, terms, effects_list, residual_df
+    )
+
+    output = format_model_output(
+        fit["coefficients"], covariance, names, factors, residual_df, anova_stats
+    )
+    output["Year"] = param.YEAR
+
+    # Calculate the impact of each effect on the model
+    c_stats = effect_c_stats(
+        df, model_response, model_effects, bubble_factor, factor_ref, weight, fit,
+        design, names, terms, workers
+    )
+
+    # Use a dict for accessing each part of the output in create_models
+    return {"Model": output, "Effect_Contributions": c_stats}
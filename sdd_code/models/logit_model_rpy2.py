@@ -1,3 +1,4 @@
+import atexit
 import re
 
 import numpy as np
@@ -8,6 +9,30 @@ import rpy2.robjects as robjects
 import sdd_code.utilities.parameters as param
 from sdd_code.models.r_integration import r_to_py, py_to_r
 
+# Clusters used to refit the models in this R session, by number of workers
+_CLUSTERS = {}
+
+
+def get_cluster(workers):
+    """Get the cluster of R processes used to refit the models, creating it the
+    first time it is used in this R session, as starting the processes is slow.
+
+    Parameters
+    ----------
+        workers: int
+            The number of R processes
+
+    Returns
+    -------
+        The cluster, or R's NULL if workers is 1 or less
+    """
+    if workers not in _CLUSTERS:
+        _CLUSTERS[workers] = robjects.r.model_cluster(workers)
+        if workers > 1:
+            atexit.register(robjects.r("parallel::stopCluster"), _CLUSTERS[workers])
+
+    return _CLUSTERS[workers]
+
 
 def logit_model(
     df,
@@ -18,6 +43,7 @@ def logit_model(
     weight=param.WEIGHTING_VAR,
     strata=param.STRATA,
     psu=param.PSU,
+    workers=param.MODEL_WORKERS,
 ):
     """
     Use R (via rpy2) to create a logistic regression model of model response
@@ -43,6 +69,9 @@ def logit_model(
             The strata variable in the dataset, defaults to value in parameters.py
         psu: str
             The PSU (cluster) variable in the dataset, defaults to value in parameters.py
+        workers: int
+            The number of R processes used to refit the model without each effect,
+            defaults to value in parameters.py
 
     Returns
     -------
@@ -90,13 +119,15 @@ def logit_model(
         weight=weight,
     )
 
-    # Calculate the overall significance of each effect
+    # Calculate the overall significance of each effect, all effects are tested
+    # from a single extraction of the model's covariance matrix
     anova_stats = r.sas_anova(model)
 
     # Calculate the impact of each effect on the model
     c_stats = r.effect_c_stats(
         model,
-        bubble_factor
+        bubble_factor,
+        cluster=get_cluster(workers)
     )
 
     # Converts list of output stats and model info into a dataframe
@@ -0,0 +1,249 @@
+"""
+Caches the outputs of the models on disk, so unchanged models aren't refitted.
+
+The outputs of a model only depend on the data it is fitted to, its formula, the
+reference levels in FACTOR_REF, the bubble factor, the code of the engine that
+fits it, and the YEAR added to the model sheet. The key of each model is a hash of
+these, and its outputs are saved to a Parquet file for each sheet. Rerunning
+create_models after a change to the tables or to derivations the models don't use
+loads the outputs rather than refitting.
+
+Changing the installed R packages doesn't change the key, so the cache folder
+should be cleared after updating them.
+"""
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import sdd_code.utilities.parameters as param
+from sdd_code.models import logit_model_python, model_sweep
+
+# Key of the cache metadata in the schema of each Parquet file
+METADATA_KEY = b"sdd_model"
+
+# The source files of each engine, relative to the root of the repo, whose
+# contents set the version of the engine
+ENGINE_SOURCES = {
+    "rpy2": [
+        "sdd_code/models/logit_model_rpy2.py",
+        "sdd_code/models/r_integration.py",
+        "sdd_code/sddR/R/model_functions.R",
+    ],
+    "R": [
+        "sdd_code/models/logit_model_R.py",
+        "sdd_code/sddR/scripts/sdd_model_server.R",
+        "sdd_code/sddR/R/model_functions.R",
+    ],
+    "python": [
+        "sdd_code/models/logit_model_python.py",
+        "sdd_code/models/model_data.py",
+        "sdd_code/utilities/stats.py",
+    ],
+}
+
+
+def get_engine_version(engine):
+    """Get the version of a model engine, as the hash of its source files.
+
+    Parameters
+    ----------
+    engine: str
+        As set by MODEL_ENGINE in parameters.py
+
+    Returns
+    -------
+    str
+    """
+    engine_hash = hashlib.sha1(engine.encode())
+    for source in ENGINE_SOURCES[engine]:
+        engine_hash.update((param.LOCAL_ROOT / source).read_bytes())
+
+    return engine_hash.hexdigest()
+
+
+def get_data_hash(df):
+    """Get the hash of the content of a dataframe, including its column names and
+    types but not its index.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+
+    Returns
+    -------
+    str
+    """
+    data_hash = hashlib.sha1(
+        json.dumps([[str(col), str(dtype)] for col, dtype in df.dtypes.items()]).encode()
+    )
+    data_hash.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+
+    return data_hash.hexdigest()
+
+
+def get_model_key(
+    df,
+    engine,
+    model_response,
+    model_effects,
+    bubble_factor,
+    factor_ref=pd.DataFrame(**param.FACTOR_REF),
+    weight=param.WEIGHTING_VAR,
+    strata=param.STRATA,
+    psu=param.PSU,
+    **engine_kwargs,
+):
+    """Get the key of a model's outputs in the cache.
+
+    Other arguments of the engine's logit_model, such as the number of workers,
+    don't change the outputs so aren't part of the key.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        The data passed to logit_model
+    engine: str
+        As set by MODEL_ENGINE in parameters.py
+    model_response, model_effects, bubble_factor, factor_ref, weight, strata, psu
+        As passed to logit_model
+
+    Returns
+    -------
+    dict
+        The hash of the model's input columns, its formula, reference levels,
+        bubble factor, engine version and year, and a 'key' of the hash of all of
+        these
+    """
+    columns = [
+        model_response,
+        *logit_model_python.get_effect_variables(model_effects),
+        strata,
+        psu,
+        weight,
+    ]
+    key = {
+        "data": get_data_hash(df[columns]),
+        "formula": model_sweep.get_formula(model_response, model_effects),
+        "factor_ref": factor_ref.astype(str).values.tolist(),
+        "bubble_factor": bubble_factor,
+        "engine": engine,
+        "engine_version": get_engine_version(engine),
+        "year": param.YEAR,
+    }
+    key["key"] = hashlib.sha1(json.dumps(key).encode()).hexdigest()[:16]
+
+    return key
+
+
+def get_cache_path(directory, key, sheet):
+    """Get the Parquet file used to save a sheet of a model's outputs.
+
+    Parameters
+    ----------
+    directory: Path
+    key: dict
+        As returned by get_model_key
+    sheet: str
+
+    Returns
+    -------
+    Path
+    """
+    return Path(directory) / f"model_{key['key']}_{sheet}.parquet"
+
+
+def save_model(model_data, directory, key):
+    """Save the outputs of a model to a Parquet file for each sheet, with the key
+    saved in the file's metadata.
+
+    Parameters
+    ----------
+    model_data: dict[str, pandas.DataFrame]
+        As returned by logit_model
+    directory: Path
+        Folder to save the files to, which is created if needed
+    key: dict
+        As returned by get_model_key
+    """
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    metadata = {**key, "sheets": list(model_data)}
+
+    for sheet, sheet_df in model_data.items():
+        table = pa.Table.from_pandas(sheet_df, preserve_index=False)
+        table = table.replace_schema_metadata({
+            **table.schema.metadata,
+            METADATA_KEY: json.dumps(metadata).encode(),
+        })
+        # Write to a temporary file first, so a run that is stopped while saving
+        # doesn't leave a partial file in the cache
+        path = get_cache_path(directory, key, sheet)
+        temp_path = path.with_suffix(".tmp")
+        pq.write_table(table, temp_path)
+        temp_path.replace(path)
+
+
+def load_model(directory, key):
+    """Load the outputs of a model saved by save_model.
+
+    Parameters
+    ----------
+    directory: Path
+    key: dict
+        As returned by get_model_key
+
+    Returns
+    -------
+    dict[str, pandas.DataFrame] or None
+        The outputs of the model, or None if they aren't all in the cache
+    """
+    paths = list(Path(directory).glob(f"model_{key['key']}_*.parquet"))
+    if not paths:
+        return None
+
+    metadata = json.loads(pq.read_schema(paths[0]).metadata[METADATA_KEY])
+    sheet_paths = [get_cache_path(directory, key, sheet) for sheet in metadata["sheets"]]
+    if not all(path.exists() for path in sheet_paths):
+        return None
+
+    return {
+        sheet: pq.read_table(path).to_pandas()
+        for sheet, path in zip(metadata["sheets"], sheet_paths)
+    }
+
+
+def cached_logit_model(engine_model, df, engine, directory, **kwargs):
+    """Load the outputs of a model from the cache, or fit the model and save its
+    outputs to the cache.
+
+    Parameters
+    ----------
+    engine_model: function
+        The logit_model function of the engine
+    df: pandas.DataFrame
+    engine: str
+        As set by MODEL_ENGINE in parameters.py
+    directory: Path
+        The cache folder
+    Additional kwargs are passed to engine_model
+
+    Returns
+    -------
+    dict[str, pandas.DataFrame]
+    """
+    key = get_model_key(df, engine, **kwargs)
+
+    model_data = load_model(directory, key)
+    if model_data is not None:
+        logging.info(f"Loaded model {key['formula']} from the cache ({key['key']})")
+        return model_data
+
+    logging.info(f"Model {key['formula']} not in the cache ({key['key']}), fitting")
+    model_data = engine_model(df, **kwargs)
+    save_model(model_data, directory, key)
+
+    return model_data
@@ -0,0 +1,173 @@
+"""
+Prepares the pupil data shared by the models in model_tables.
+
+The exclusions common to every model are applied once, and every variable in
+FACTOR_REF is coded once into a compact one-hot matrix. Each model then takes the
+rows with a valid response, and the columns of its effects, from this shared data
+with select_model_data, rather than filtering and coding the factors itself.
+
+The design matrices match those of logit_model_python.create_design_matrix, so
+the shared coding is used by the python engine. The R engines code the factors in
+R from the selected rows.
+"""
+import numpy as np
+import pandas as pd
+
+import sdd_code.utilities.parameters as param
+from sdd_code.models import logit_model_python
+
+
+def filter_model_data(df):
+    """Apply the exclusions used by every model: pupils aged 13 to 15, from schools
+    that weren't volunteers, and without a dummy drug or outlier flag.
+
+    Parameters
+    ----------
+        df: pd.DataFrame
+
+    Returns
+    -------
+        pd.DataFrame
+    """
+    return df.loc[
+        df['age1315'].isin([13, 14, 15])
+        & df["volunsch"].eq(0)
+        & df['dflagdummydrug'].eq(0)
+        & df['dflagalcoutlier'].eq(0)
+        & df['dflagcigoutlier'].eq(0)
+    ]
+
+
+def create_model_data(df, factor_ref=pd.DataFrame(**param.FACTOR_REF)):
+    """Filter the data for the models, and code every factor in factor_ref as one
+    column per level in a single uint8 matrix.
+
+    Parameters
+    ----------
+        df: pd.DataFrame
+            The pupil data
+        factor_ref: pd.DataFrame
+            A dataframe with rows of variables and the reference level to use for this
+            variable, defaults to value in parameters.py
+
+    Returns
+    -------
+        dict
+            The filtered data ('df'), the one-hot matrix of the factors ('matrix'),
+            and for each factor its columns in the matrix, the label of each level
+            in ascending order, and its reference level ('factors')
+    """
+    variables = [var for var in factor_ref["factors"] if var in df.columns]
+    refs = dict(zip(factor_ref["factors"], factor_ref["refs"]))
+
+    df = filter_model_data(df)
+
+    factors = {}
+    codes = []
+    n_columns = 0
+    for var in variables:
+        # Missing data is a level of the factors, as in logit_model
+        var_codes, labels = logit_model_python.encode_factor(df[var].fillna(-9))
+        factors[var] = {
+            "columns": np.arange(n_columns, n_columns + len(labels)),
+            "labels": labels,
+            "ref": str(refs[var]),
+        }
+        codes.append(var_codes + n_columns)
+        n_columns += len(labels)
+
+    matrix = np.zeros((len(df), n_columns), dtype=np.uint8)
+    rows = np.arange(len(df))
+    for var_codes in codes:
+        matrix[rows, var_codes] = 1
+
+    return {"df": df, "matrix": matrix, "factors": factors}
+
+
+def select_model_data(
+    model_data,
+    model_response,
+    model_effects,
+    factor_ref=pd.DataFrame(**param.FACTOR_REF),
+    weight=param.WEIGHTING_VAR,
+    strata=param.STRATA,
+    psu=param.PSU,
+):
+    """Select the data of a model from the shared model data: the rows where the
+    response is 0 or 1, and the design matrix of its effects.
+
+    Levels without any of these rows are dropped, as when the factors are coded
+    from the selected rows. Effects that aren't in the shared data are coded from
+    the selected rows.
+
+    Parameters
+    ----------
+        model_data: dict
+            The shared model data, from create_model_data
+        model_response: str
+            The response variable that is being modelled
+        model_effects: list[str]
+            The effect variables. To test for an interaction, enter
+            the variables as "effect1*effect2".
+        factor_ref: pd.DataFrame
+            Used to code effects that aren't in the shared data, defaults to value in
+            parameters.py
+        weight: str
+            The weighting variable in the dataset, defaults to value in parameters.py
+        strata: str
+            The strata variable in the dataset, defaults to value in parameters.py
+        psu: str
+            The PSU (cluster) variable in the dataset, defaults to value in parameters.py
+
+    Returns
+    -------
+        pd.DataFrame, tuple
+            The data of the model, and its design matrix, column names, term columns
+            and factors, as returned by logit_model_python.create_design_matrix
+    """
+    effects_list = logit_model_python.get_effect_variables(model_effects)
+
+    df = model_data["df"]
+    rows = np.flatnonzero(df[model_response].isin([0, 1]).to_numpy())
+    df = df.iloc[rows][[model_response, *effects_list, strata, psu, weight]].fillna(-9)
+
+    columns = {}
+    factors = {}
+    for var in effects_list:
+        if var not in model_data["factors"]:
+            continue
+        factor = model_data["factors"][var]
+        one_hot = model_data["matrix"][np.ix_(rows, factor["columns"])]
+
+        # Keep the levels with rows, with the reference level first
+        counts = one_hot.sum(axis=0, dtype=np.int64)
+        levels = [i for i, count in enumerate(counts) if count > 0]
+        labels = [factor["labels"][i] for i in levels]
+        if factor["ref"] not in labels:
+            raise ValueError(f"Reference level {factor['ref']} not found in {var}")
+        ref = levels[labels.index(factor["ref"])]
+        levels = [ref] + [i for i in levels if i != ref]
+
+        factors[var] = {
+            "codes": np.argmax(one_hot[:, levels], axis=1),
+            "labels": [factor["labels"][i] for i in levels],
+        }
+        # Treatment contrasts, a column for each level except the reference
+        columns[var] = {
+            f"{var}{factor['labels'][i]}": one_hot[:, i].astype(float)
+            for i in levels[1:]
+        }
+
+    other_effects = [var for var in effects_list if var not in columns]
+    if other_effects:
+        other_columns, other_factors = logit_model_python.encode_variables(
+            df, other_effects, factor_ref
+        )
+        columns.update(other_columns)
+        factors.update(other_factors)
+
+    design, names, terms = logit_model_python.build_design_matrix(
+        columns, model_effects, len(df)
+    )
+
+    return df, (design, names, terms, factors)
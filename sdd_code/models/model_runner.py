@@ -0,0 +1,104 @@
+"""
+Fits the models defined in model_tables.get_models.
+
+The models are independent, so can be fitted concurrently in a pool of worker
+processes. Each process has its own R interpreter when an R engine is used, as R
+can't run more than one model at a time in a single process. The results are
+returned as each model finishes, so they can be written while the other models
+are still being fitted.
+"""
+import logging
+import pickle
+import tempfile
+import timeit
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import sdd_code.utilities.parameters as param
+
+# The model data of a worker process, loaded once by _init_worker
+_WORKER_DATA = {}
+
+
+def _init_worker(data_path):
+    """Load the shared model data in a worker process.
+
+    Parameters
+    ----------
+    data_path: Path
+        Path of the pickle file of the data
+    """
+    with open(data_path, "rb") as data_file:
+        _WORKER_DATA["data"] = pickle.load(data_file)
+
+
+def _run_timed_model(content, data):
+    """Fit a model, returning its outputs and the seconds it took"""
+    start_time = timeit.default_timer()
+    model_data = content(data)
+
+    return model_data, timeit.default_timer() - start_time
+
+
+def _run_worker_model(content):
+    """Fit a model in a worker process, using the data loaded by _init_worker"""
+    return _run_timed_model(content, _WORKER_DATA["data"])
+
+
+def run_models(models, data, workers=param.WORKERS):
+    """Fit every model, yielding each model's outputs when it finishes.
+
+    If workers is more than 1, the models are fitted concurrently in a pool of
+    processes, so the total time is set by the slowest model rather than the sum
+    of all of them. The data is shared with the processes by writing it once to a
+    pickle file that each process loads when it starts, so each process holds its
+    own copy of the data.
+
+    Parameters
+    ----------
+    models: list[dict]
+        Models as defined in model_tables.get_models, each with a 'name' and
+        'content' function
+    data: dict
+        The data passed to each model's content function, e.g. from
+        model_data.create_model_data
+    workers: int
+        The number of processes to fit the models with, defaults to value in
+        parameters.py
+
+    Yields
+    ------
+    tuple[dict, dict]
+        The model, and the output dataframes returned by its content function, in
+        the order the models finish
+    """
+    if workers <= 1 or len(models) <= 1:
+        for model in models:
+            logging.info(f"Fitting model {model['name']}")
+            model_data, seconds = _run_timed_model(model["content"], data)
+            logging.info(f"Fitted model {model['name']} in {seconds:.1f} seconds")
+            yield model, model_data
+        return
+
+    logging.info(f"Fitting {len(models)} models with {workers} workers")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_path = Path(temp_dir) / "model_data.pkl"
+        with open(data_path, "wb") as data_file:
+            pickle.dump(data, data_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(models)),
+            initializer=_init_worker,
+            initargs=(data_path,),
+        ) as executor:
+            futures = {
+                executor.submit(_run_worker_model, model["content"]): model
+                for model in models
+            }
+
+            for future in as_completed(futures):
+                model = futures[future]
+                model_data, seconds = future.result()
+                logging.info(f"Fitted model {model['name']} in {seconds:.1f} seconds")
+                yield model, model_data
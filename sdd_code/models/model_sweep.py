@@ -0,0 +1,232 @@
+"""
+Fits many specifications of a survey logistic regression model, to compare which
+effects to include in the models in model_tables.
+
+The design matrix of every candidate effect is created once, with the reference
+levels in FACTOR_REF, and each specification fits a slice of its columns using the
+python engine (logit_model_python). The specifications are independent, so are
+fitted concurrently. Each fit is cached by the hash of its formula, so a cache can
+be passed to later sweeps of the same data to only fit new specifications.
+
+For example, to compare every model with 4 to 6 of the drinking model effects:
+
+    sweep = model_sweep.sweep_models(
+        df_filt,
+        model_response="dallastwk",
+        candidate_effects=["dgender", "age1315", "dlifsat", "truant", "region", ...],
+        min_effects=4,
+        max_effects=6,
+    )
+"""
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from itertools import combinations
+
+import pandas as pd
+
+import sdd_code.utilities.parameters as param
+from sdd_code.models import logit_model_python
+from sdd_code.utilities import stats
+
+
+def get_formula(model_response, model_effects):
+    """Get the formula of a model, as passed to R.
+
+    Parameters
+    ----------
+        model_response: str
+        model_effects: list[str]
+
+    Returns
+    -------
+        str
+    """
+    return f"{model_response} ~" + "+".join(model_effects)
+
+
+def get_formula_hash(formula):
+    """Get the key of a formula in the sweep cache.
+
+    Parameters
+    ----------
+        formula: str
+
+    Returns
+    -------
+        str
+    """
+    return hashlib.sha1(formula.encode()).hexdigest()
+
+
+def get_specifications(candidate_effects, min_effects=1, max_effects=None,
+                       required_effects=()):
+    """Get every subset of the candidate effects with between min_effects and
+    max_effects effects, each including all of the required effects.
+
+    Parameters
+    ----------
+        candidate_effects: list[str]
+        min_effects: int
+        max_effects: int
+            Defaults to all of the candidate effects
+        required_effects: list[str]
+            Effects included in every specification, which count towards the number
+            of effects
+
+    Returns
+    -------
+        list[list[str]]
+            The effects of each specification, in the order of candidate_effects
+    """
+    required_effects = list(required_effects)
+    optional_effects = [eff for eff in candidate_effects if eff not in required_effects]
+    if max_effects is None:
+        max_effects = len(candidate_effects)
+
+    specifications = []
+    for n_effects in range(max(min_effects, len(required_effects), 1), max_effects + 1):
+        for optional in combinations(optional_effects, n_effects - len(required_effects)):
+            specifications.append(
+                [eff for eff in candidate_effects if eff in required_effects + list(optional)]
+            )
+
+    return specifications
+
+
+def sweep_models(
+    df,
+    model_response,
+    candidate_effects,
+    min_effects=1,
+    max_effects=None,
+    required_effects=(),
+    specifications=None,
+    factor_ref=pd.DataFrame(**param.FACTOR_REF),
+    weight=param.WEIGHTING_VAR,
+    strata=param.STRATA,
+    psu=param.PSU,
+    workers=param.MODEL_WORKERS,
+    cache=None,
+):
+    """Fit a survey logistic regression for many specifications of the effects, and
+    compare how well each fits.
+
+    Parameters
+    ----------
+        df: pd.DataFrame
+            A dataframe containing the data to model
+        model_response: str
+            The response variable that is being modelled
+        candidate_effects: list[str]
+            The effects that can be included in the models. To include an
+            interaction, enter the variables as "effect1*effect2".
+        min_effects: int
+            The fewest effects in a specification, see get_specifications
+        max_effects: int
+            The most effects in a specification, defaults to all of them
+        required_effects: list[str]
+            Effects that are in every specification
+        specifications: list[list[str]]
+            Optional effects of each specification to fit, instead of the subsets
+            from get_specifications. Each effect must be one of candidate_effects
+        factor_ref: pd.DataFrame
+            A dataframe with rows of variables and the reference level to use for this
+            variable, defaults to value in parameters.py
+        weight: str
+            The weighting variable in the dataset, defaults to value in parameters.py
+        strata: str
+            The strata variable in the dataset, defaults to value in parameters.py
+        psu: str
+            The PSU (cluster) variable in the dataset, defaults to value in parameters.py
+        workers: int
+            The number of specifications to fit at once, defaults to value in
+            parameters.py
+        cache: dict
+            Optional results of earlier sweeps of the same data, by the hash of
+            their formula, which is updated with the new results
+
+    Returns
+    -------
+        pd.DataFrame
+            A row for each specification, sorted by AIC, with the formula, number
+            of effects and coefficients, deviance, design based AIC (see
+            logit_model_python.design_aic), the c statistic, and the largest ProbF
+            of its effects
+    """
+    if specifications is None:
+        specifications = get_specifications(
+            candidate_effects, min_effects, max_effects, required_effects
+        )
+    cache = {} if cache is None else cache
+
+    effects_list = logit_model_python.get_effect_variables(candidate_effects)
+
+    # Select just the variables we are interested in, and fill in missing data
+    df = df[[model_response, *effects_list, strata, psu, weight]].fillna(-9)
+
+    # The design of every candidate effect is only created once
+    design, _, terms, _ = logit_model_python.create_design_matrix(
+        df, candidate_effects, factor_ref
+    )
+    response = logit_model_python.get_response(df, model_response, factor_ref)
+    weights = df[weight].to_numpy(dtype=float)
+    strata_values = df[strata].to_numpy()
+    psu_values = df[psu].to_numpy()
+
+    def fit_specification(effects):
+        effect_terms = [
+            ":".join(term) for term in logit_model_python.get_model_terms(effects)
+        ]
+        columns = [0] + [column for term in effect_terms for column in terms[term]]
+        spec_design = design[:, columns]
+
+        fit = logit_model_python.fit_logit(spec_design, response, weights)
+        covariance, degrees_freedom = logit_model_python.design_covariance(
+            spec_design, response, fit["fitted"], weights, strata_values, psu_values
+        )
+        aic = logit_model_python.design_aic(
+            spec_design, fit["fitted"], weights, covariance, fit["deviance"]
+        )
+        anova_stats = logit_model_python.wald_term_tests(
+            fit["coefficients"],
+            covariance,
+            {term: [columns.index(i) for i in terms[term]] for term in effect_terms},
+            logit_model_python.get_effect_variables(effects),
+            degrees_freedom + 1 - len(columns),
+        )
+
+        return {
+            "n_effects": len(effects),
+            "n_coefficients": len(columns),
+            "deviance": fit["deviance"],
+            "eff_p": aic["eff_p"],
+            "AIC": aic["AIC"],
+            "c_statistic": stats.c_statistics(response, fit["fitted"]),
+            "max_ProbF": anova_stats["ProbF"].max(),
+        }
+
+    formulas = [get_formula(model_response, effects) for effects in specifications]
+    keys = [get_formula_hash(formula) for formula in formulas]
+    new_specifications = {
+        key: effects
+        for key, effects in zip(keys, specifications)
+        if key not in cache
+    }
+    logging.info(
+        f"Fitting {len(new_specifications)} model specifications for "
+        f"{model_response}, {len(specifications) - len(new_specifications)} cached"
+    )
+
+    if workers <= 1:
+        results = [fit_specification(effects) for effects in new_specifications.values()]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(fit_specification, new_specifications.values()))
+    cache.update(zip(new_specifications, results))
+
+    output = pd.DataFrame([cache[key] for key in keys])
+    output.insert(0, "formula", formulas)
+    output = output.sort_values(by="AIC", kind="stable")
+
+    return output.reset_index(drop=True)
@@ -2,18 +2,54 @@
 This file contains the functions that define each model & it's parameters, as
 well as the function that collects each model and specifies where it is to be saved
 """
+from sdd_code.models import model_cache, model_data
 from sdd_code.utilities import parameters as param
-from sdd_code.models.logit_model_rpy2 import logit_model
-# R subprocess version currently unused, but can be switched to by simply uncommenting
-# the below line
-# from sdd_code.models.logit_model_R import logit_model
+
+
+def logit_model(df, encoded=None, **kwargs):
+    """Create a logistic regression model using the engine set by MODEL_ENGINE in
+    parameters.py. Every engine gives the same output, see
+    logit_model_rpy2.logit_model.
+
+    The engine modules are only imported when used, so the python engine can be
+    used without rpy2 or R installed. If MODEL_CACHE_DIR is set, the outputs are
+    loaded from the cache when the model is unchanged, see model_cache.py.
+
+    Parameters
+    ----------
+        df: pd.DataFrame
+        encoded: tuple
+            Optional design matrix of the model from model_data.select_model_data,
+            used by the python engine. The R engines code the factors in R
+        Additional kwargs are passed to the engine's logit_model
+
+    Returns
+    -------
+        Dict[str, pd.DataFrame]
+    """
+    if param.MODEL_ENGINE == "rpy2":
+        from sdd_code.models import logit_model_rpy2 as engine
+    elif param.MODEL_ENGINE == "R":
+        from sdd_code.models import logit_model_R as engine
+    elif param.MODEL_ENGINE == "python":
+        from sdd_code.models import logit_model_python as engine
+        kwargs["encoded"] = encoded
+    else:
+        raise ValueError(f"Unknown MODEL_ENGINE: {param.MODEL_ENGINE}")
+
+    if param.MODEL_CACHE_DIR is None:
+        return engine.logit_model(df, **kwargs)
+
+    return model_cache.cached_logit_model(
+        engine.logit_model, df, param.MODEL_ENGINE, param.MODEL_CACHE_DIR, **kwargs
+    )
 
 
 def get_models():
     """Define the output workbooks and sheets for the model tables.
 
     Each element of sheets should be a key in the dictionary returned by the related
-    model function.
+    model function, which is passed the shared data from model_data.create_model_data.
     """
     output = {
         "output_path": param.OUTPUT_DIR / "MasterFiles" / "sdd_regression_models_source.xlsx",
@@ -39,28 +75,20 @@ def get_models():
     return output
 
 
-def create_model_drank_lastwk(df):
+def create_model_drank_lastwk(data):
     """Creates the logistic regression model for the variable dallastwk,
     whether a pupil has drank in the last week.
 
     Parameters:
     -----------
-        df: pd.DataFrame
+        data: dict
+            The shared model data, from model_data.create_model_data
 
     Returns:
     --------
         Dict[str, pd.DataFrame]
         Dataframes of model information stored in a dictionary
     """
-    df_filt = df.loc[
-        df['age1315'].isin([13, 14, 15])
-        & df['dallastwk'].isin([0, 1])
-        & df["volunsch"].eq(0)
-        & df['dflagdummydrug'].eq(0)
-        & df['dflagalcoutlier'].eq(0)
-        & df['dflagcigoutlier'].eq(0)
-    ]
-
     model_response = "dallastwk"
     model_effects = [
         "dgender",
@@ -84,38 +112,33 @@ def create_model_drank_lastwk(df):
         # "lonlonely",
     ]
 
+    df_filt, encoded = model_data.select_model_data(data, model_response, model_effects)
+
     dranklastwk = logit_model(
         df_filt,
         model_response=model_response,
         model_effects=model_effects,
-        bubble_factor=8
+        bubble_factor=8,
+        encoded=encoded,
     )
 
     return dranklastwk
 
 
-def create_model_smoker_current(df):
+def create_model_smoker_current(data):
     """Creates the logistic regression model for the variable dcgsmk,
     whether a pupil is a current smoker.
 
     Parameters:
     -----------
-        df: pd.DataFrame
+        data: dict
+            The shared model data, from model_data.create_model_data
 
     Returns:
     --------
         Dict[str, pd.DataFrame]
         Dataframes of model information stored in a dictionary
     """
-    df_filt = df.loc[
-        df['age1315'].isin([13, 14, 15])
-        & df['dcgsmk'].isin([0, 1])
-        & df["volunsch"].eq(0)
-        & df['dflagdummydrug'].eq(0)
-        & df['dflagalcoutlier'].eq(0)
-        & df['dflagcigoutlier'].eq(0)
-    ]
-
     model_response = "dcgsmk"
     model_effects = [
         "dgender",
@@ -140,38 +163,33 @@ def create_model_smoker_current(df):
         # "lonlonely",
     ]
 
+    df_filt, encoded = model_data.select_model_data(data, model_response, model_effects)
+
     currentsmoke = logit_model(
         df_filt,
         model_response=model_response,
         model_effects=model_effects,
-        bubble_factor=8
+        bubble_factor=8,
+        encoded=encoded,
     )
 
     return currentsmoke
 
 
-def create_model_drugs(df):
+def create_model_drugs(data):
     """Creates the logistic regression model for the variable ddgmonany,
     whether a pupil has taken drugs in the last month
 
     Parameters:
     -----------
-        df: pd.DataFrame
+        data: dict
+            The shared model data, from model_data.create_model_data
 
     Returns:
     --------
         Dict[str, pd.DataFrame]
         Dataframes of model information stored in a dictionary
     """
-    df_filt = df.loc[
-        df['age1315'].isin([13, 14, 15])
-        & df['ddgmonany'].isin([0, 1])
-        & df["volunsch"].eq(0)
-        & df['dflagdummydrug'].eq(0)
-        & df['dflagalcoutlier'].eq(0)
-        & df['dflagcigoutlier'].eq(0)
-    ]
-
     model_response = "ddgmonany"
     model_effects = [
         # "dgender",
@@ -193,11 +211,14 @@ def create_model_drugs(df):
         # "lonlonely",
     ]
 
+    df_filt, encoded = model_data.select_model_data(data, model_response, model_effects)
+
     drugsmonth = logit_model(
         df_filt,
         model_response=model_response,
         model_effects=model_effects,
-        bubble_factor=8
+        bubble_factor=8,
+        encoded=encoded,
     )
 
     return drugsmonth
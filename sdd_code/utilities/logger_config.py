@@ -69,6 +69,39 @@ def setup_logger(
     return logger
 
 
+def log_progress(
+    done: int,
+    total: int,
+    eta_seconds: Optional[float] = None,
+    width: int = 30,
+    level: int = logging.INFO,
+) -> None:
+    """Log a text progress bar, with an estimated time remaining, to the root logger
+
+    Parameters:
+    -------
+        done: int
+            Number of items completed
+        total: int
+            Total number of items
+        eta_seconds: float
+            Optional, estimated seconds until all items are complete
+        width: int
+            Number of characters in the bar
+        level: int
+            The level to log the progress at, defaults to INFO so it is shown on
+            the console
+    """
+    filled = int(width * done / total) if total else width
+    bar = "#" * filled + "." * (width - filled)
+
+    message = f"[{bar}] {done}/{total}"
+    if eta_seconds is not None:
+        message += f", ETA {int(eta_seconds / 60)}m {round(eta_seconds % 60)}s"
+
+    logging.getLogger().log(level, message)
+
+
 def handle_exception(
     exc_type: Type[BaseException],
     exc_value: BaseException,
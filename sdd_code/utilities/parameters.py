@@ -102,6 +102,52 @@ CHAPTER_WELLBEING = False
 # False to default to not creating standard errors
 CREATE_SE = True
 
+# Set the engine used to calculate the standard errors of percentages, "R" to use
+# the R survey package, "python" to use the Taylor linearisation in stats.py,
+# which gives the same results without R, or "replicate" to use the replicate
+# weights in replicate_weights.py. Other standard errors always use R
+SE_ENGINE = "R"
+
+# Set the replicate weights used when SE_ENGINE is "replicate", "JKn" for a
+# stratified delete one PSU jackknife, or "bootstrap" for a rescaled bootstrap
+# with REPLICATES replicates. The replicate factors of each PSU are created from
+# the filtered pupil data and saved with the data asset in REPLICATE_WEIGHTS_FILE,
+# and from the teacher data in TEACHER_REPLICATE_WEIGHTS_FILE
+REPLICATE_METHOD = "JKn"
+REPLICATES = 500
+REPLICATE_SEED = 2023
+REPLICATE_WEIGHTS_FILE = ASSET_DIR / f"sdd_replicate_weights_{YEAR}.parquet"
+TEACHER_REPLICATE_WEIGHTS_FILE = (
+    ASSET_DIR / f"sdd_teacher_replicate_weights_{YEAR}.parquet"
+)
+
+# Set to True to compute tables that share the same breakdowns and filter together
+# in a single aggregation pass, False to compute every table separately.
+# The outputs are the same either way
+FUSE_TABLES = True
+
+# Set the number of processes used to create the tables, and to fit the models, 1
+# creates them one after another in the main process. Can be overridden with
+# --workers on the command line. The outputs are the same however many workers are
+# used
+WORKERS = 1
+
+# Set the file used to store the time taken to create each table, used to start the
+# longest tables first and estimate the time remaining in later runs
+TIMINGS_FILE = OUTPUT_DIR / "Logs" / "sdd_table_timings.json"
+
+# Set the totals store option, used to create the tables from the weighted totals of
+# each PSU rather than the pupil data (only for tables using create_breakdown_single,
+# with the same outputs). "create" computes and saves the store after the exclusions
+# are applied, "load" reuses the saved store, so those tables can be rebuilt after a
+# formatting or layout change without recomputing them, and None doesn't use a store.
+# If every table being ran is in the loaded store the data isn't imported. The store
+# must have been created from the same data files, parameters (including YEAR, the
+# exclusions and SE_ENGINE) and derivation and processing code. Tables with standard
+# errors aren't created from the store when SE_ENGINE is "R"
+TOTALS_STORE = None
+TOTALS_STORE_DIR = ASSET_DIR / "Totals"
+
 # Set to True to check the difference between this year and the last, else leave blank
 CHECK_PREV_YEAR = False
 # For the year on year checks set the breach level at which a change will be flagged
@@ -192,6 +238,22 @@ DRUGS_CLASSA = [
     "mth",  # Methadone
 ]
 
+# Set the engine used to create the logistic regression models, "rpy2" to run the R
+# survey package through rpy2, "R" to run it through Rscript, or "python" to use
+# logit_model_python.py, which gives the same results without R
+MODEL_ENGINE = "rpy2"
+
+# Set the number of workers used to refit each model without each of its effects,
+# for the Effect_Contributions sheet, 1 refits them one after another. Uses threads
+# for the python engine and a cluster of R processes for the R engines
+MODEL_WORKERS = 4
+
+# Set the folder used to cache the outputs of each model, keyed on the model's data,
+# formula, FACTOR_REF, bubble factor and engine, so unchanged models are loaded
+# rather than refitted. Clear the folder after updating the R packages, or set to
+# None to always refit the models
+MODEL_CACHE_DIR = ASSET_DIR / "Models"
+
 # Mapping of each factor, or class variable in SAS, to the
 # reference level to use in the logistic model.
 # If adding a new categorical effect to the variable then need
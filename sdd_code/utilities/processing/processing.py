@@ -1,10 +1,13 @@
 import logging
+import math
+from functools import partial
 from itertools import chain, combinations
 
 import pandas as pd
 import numpy as np
 
 import sdd_code.utilities.parameters as param
+from sdd_code.utilities import replicate_weights
 from sdd_code.utilities import stats
 from sdd_code.utilities import stats_R
 
@@ -35,6 +38,141 @@ def teacher_drop_lesson_prefix(df_teacher):
     return df_teacher
 
 
+# Integer columns with a range of values up to this size are factorised with a
+# lookup table, rather than hashing
+FACTORIZE_RANGE_LIMIT = 1 << 16
+
+
+def factorize_sorted(column):
+    """Encodes a column as codes of its sorted unique values, as
+    pd.factorize(column, sort=True, use_na_sentinel=False).
+
+    Integer columns with a small range of values, such as survey responses and
+    breakdowns, are counted into a lookup table instead of hashing each value.
+
+    Parameters
+    ----------
+    column : pd.Series
+
+    Returns
+    -------
+    np.ndarray
+        The code of each value
+    pd.Index
+        The sorted unique values
+    """
+    values = column.to_numpy()
+
+    if pd.api.types.is_integer_dtype(values) and len(values):
+        minimum = values.min()
+        if values.max() - minimum < FACTORIZE_RANGE_LIMIT:
+            offsets = values - minimum
+            present = np.bincount(offsets) > 0
+            lookup = np.cumsum(present) - 1
+            uniques = (np.flatnonzero(present) + minimum).astype(values.dtype)
+            return lookup[offsets], pd.Index(uniques)
+
+    return pd.factorize(column, sort=True, use_na_sentinel=False)
+
+
+def encode_domain(df, domains):
+    """Encodes the combination of a list of domain columns as a single integer key.
+
+    Each column is factorised into codes of its sorted values, and the codes are
+    combined as the digits of a mixed radix number. The keys therefore sort in the
+    same order as the domain columns, and can be decoded with decode_domain.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    domains: list[str]
+        Columns to use as domains
+
+    Returns
+    -------
+    np.ndarray
+        The int64 domain key of each row
+    list[pd.Index]
+        The sorted values of each domain column, needed to decode the keys
+
+    Raises
+    ------
+    ValueError
+        If there are too many combinations of the domains to fit in an int64
+    """
+    keys = np.zeros(len(df), dtype=np.int64)
+    levels = []
+    n_keys = 1
+
+    for domain in domains:
+        codes, domain_levels = factorize_sorted(df[domain])
+
+        n_keys *= len(domain_levels)
+        if n_keys > np.iinfo(np.int64).max:
+            raise ValueError(f"Too many combinations of {domains} to encode")
+
+        keys = keys * len(domain_levels) + codes
+        levels.append(domain_levels)
+
+    return keys, levels
+
+
+def decode_domain(keys, domains, levels):
+    """Decodes integer domain keys back into the values of the domain columns.
+
+    Parameters
+    ----------
+    keys : np.ndarray
+        Domain keys created by encode_domain
+    domains: list[str]
+        Columns used as domains
+    levels: list[pd.Index]
+        The levels returned by encode_domain
+
+    Returns
+    -------
+    pandas.DataFrame
+        A column for each domain
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    columns = {}
+
+    # The last domain is the lowest digit of the key
+    for domain, domain_levels in zip(reversed(domains), reversed(levels)):
+        keys, codes = np.divmod(keys, len(domain_levels))
+        columns[domain] = domain_levels.take(codes)
+
+    return pd.DataFrame({domain: columns[domain] for domain in domains})
+
+
+def domain_labels(keys, domains, levels):
+    """Gets the labels of integer domain keys, as the domain values joined by "_".
+    Each label is only created once, for the unique keys.
+
+    Parameters
+    ----------
+    keys : np.ndarray
+        Domain keys created by encode_domain
+    domains: list[str]
+        Columns used as domains
+    levels: list[pd.Index]
+        The levels returned by encode_domain
+
+    Returns
+    -------
+    pd.Categorical
+        The label of each key
+    """
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    labels = (
+        decode_domain(unique_keys, domains, levels)
+        .astype("string")
+        .agg("_".join, axis=1)
+    )
+
+    return pd.Categorical.from_codes(inverse, categories=pd.Index(labels))
+
+
 def create_domain(df, domains):
     """Creates a single domain column from a list of domains.
 
@@ -49,12 +187,183 @@ def create_domain(df, domains):
     pd.Series
         The new domain column
     """
-    domain = df[domains].astype("string").agg("_".join, axis=1)
+    keys, levels = encode_domain(df, domains)
+    domain = pd.Series(domain_labels(keys, domains, levels), index=df.index)
 
-    # Need second conversion to stop being object and fix np.unique() in samplics
+    # Need string dtype rather than object or category to fix np.unique() in samplics
     return domain.astype(pd.StringDtype())
 
 
+def group_index(df, by):
+    """Gets the group number of each row, for the groups of df.groupby(by) in
+    sorted order. The groups are encoded as integer keys with encode_domain, then
+    numbered in order, only keeping groups that have rows.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Data with no missing values in the by columns
+    by: list[str]
+        Columns to group by
+
+    Returns
+    -------
+    np.ndarray
+        The group number of each row, from 0 to the number of groups
+    pandas.DataFrame
+        The values of the by columns for each group
+    """
+    keys, levels = encode_domain(df, by)
+
+    # Count the rows in every possible group if there are few, otherwise sort the
+    # keys
+    n_keys = math.prod(len(domain_levels) for domain_levels in levels)
+    if n_keys <= len(keys):
+        occupied = np.bincount(keys, minlength=n_keys) > 0
+        present = np.flatnonzero(occupied)
+        groups = (np.cumsum(occupied) - 1)[keys]
+    else:
+        present, groups = np.unique(keys, return_inverse=True)
+
+    return groups, decode_domain(present, by, levels)
+
+
+def drop_missing_groups(df, by):
+    """Drops rows with missing values in the by columns, as groupby does.
+    Integer columns can't be missing, so don't need checking.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    by: list[str]
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    nullable = [col for col in by if not pd.api.types.is_integer_dtype(df[col])]
+    if nullable:
+        valid = df[nullable].notna().all(axis=1)
+        if not valid.all():
+            df = df[valid]
+
+    return df
+
+
+def bincount_agg(df, by, **aggregations):
+    """Sums and counts columns for each group, equivalent to
+    df.groupby(by).agg(**aggregations).reset_index() for "sum" and "count"
+    aggregations of numeric columns.
+
+    The groups are numbered with group_index, then every aggregation is a single
+    np.bincount over the group numbers, rather than a hash based groupby for each
+    aggregation.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    by: list[str]
+        Columns to group by
+    aggregations:
+        Named aggregations of (column, "sum" or "count"), as used by groupby.agg
+
+    Returns
+    -------
+    pandas.DataFrame
+        A row for each group in sorted order, with the by and aggregated columns
+    """
+    df = drop_missing_groups(df, by)
+
+    if df.empty:
+        return df.groupby(by).agg(**aggregations).reset_index()
+
+    groups, output = group_index(df, by)
+    n_groups = len(output)
+
+    for name, (column, function) in aggregations.items():
+        values = df[column].to_numpy()
+        is_value = pd.notna(values)
+
+        if function == "count":
+            output[name] = np.bincount(
+                groups, weights=is_value, minlength=n_groups
+            ).astype(np.int64)
+        elif function == "sum":
+            total = np.bincount(
+                groups, weights=np.where(is_value, values, 0), minlength=n_groups
+            )
+            if pd.api.types.is_integer_dtype(values):
+                total = total.astype(np.int64)
+            output[name] = total
+        else:
+            raise ValueError(f"Aggregation {function} is not supported")
+
+    return output
+
+
+def weighted_stats_by_group(df, by, question, weighting=param.WEIGHTING_VAR):
+    """Calculates the weighted mean and median of a question for every group,
+    equivalent to df.groupby(by).apply(stats.create_weighted_stats, question)
+    .reset_index().
+
+    Rather than sorting each group separately, all rows are sorted once by group
+    then value. The median of each group is the first value where the cumulative
+    weight within the group reaches half of the group's total weight.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    by: list[str]
+        Columns to group by
+    question: str
+        Column to calculate the statistics of
+    weighting: str
+        Column to use as weighting
+
+    Returns
+    -------
+    pandas.DataFrame
+        A row for each group in sorted order, with the by columns, Mean and Median
+    """
+    df = drop_missing_groups(df, by)
+    groups, output = group_index(df, by)
+    n_groups = len(output)
+
+    values = df[question].to_numpy(dtype=float)
+    weights = df[weighting].to_numpy(dtype=float)
+
+    # Missing values are left out of the weighted total, but not the total weight
+    weighted_values = values * weights
+    weighted_values[np.isnan(weighted_values)] = 0
+    output["Mean"] = (
+        np.bincount(groups, weights=weighted_values, minlength=n_groups)
+        / np.bincount(groups, weights=weights, minlength=n_groups)
+    )
+
+    # Sort by group then value, missing values are sorted last in each group
+    order = np.lexsort((values, groups))
+    sorted_groups = groups[order]
+    sorted_values = values[order]
+
+    # Cumulative weight within each group, summed in the same order as cumsum()
+    cumulative = (
+        pd.Series(weights[order]).groupby(sorted_groups).cumsum().to_numpy()
+    )
+
+    group_sizes = np.bincount(groups, minlength=n_groups)
+    group_ends = np.cumsum(group_sizes)
+    group_starts = group_ends - group_sizes
+    cutoff = cumulative[group_ends - 1] / 2.0
+
+    # Weights aren't negative, so cumulative weights only increase within a group
+    # and the rows below the cutoff are the first rows of the group
+    below_cutoff = cumulative < cutoff[sorted_groups]
+    n_below = np.bincount(sorted_groups, weights=below_cutoff, minlength=n_groups)
+    output["Median"] = sorted_values[group_starts + n_below.astype(np.int64)]
+
+    return output
+
+
 def safe_check_columns_eq(df, col1, col2):
     """Checks that two numeric columns are equal.
     First coerces to numeric and drops resulting nan rows, to compensate for suppression
@@ -109,13 +418,69 @@ def add_response_subgroup(df, breakdowns, question, subgroup):
     pandas.DataFrame with new response subgroup
 
     """
-    for subgroup_code, subgroup_values in subgroup.items():
-        subgroup = df[df[question].isin(subgroup_values)]
-        subgroup = subgroup.groupby([*breakdowns]).sum().reset_index()
-        subgroup[question] = subgroup_code
-        df = pd.concat([df, subgroup], ignore_index=True)
+    if not subgroup:
+        return df.reset_index(drop=True)
+
+    # Rows in each subgroup, a row can be in several subgroups if they are nested
+    subgroup_rows = [
+        np.flatnonzero(df[question].isin(subgroup_values))
+        for subgroup_values in subgroup.values()
+    ]
+
+    # Sum the rows of every subgroup in one pass, grouping by the position of
+    # the subgroup then the breakdowns so the subgroups stay in order
+    sum_cols = [
+        col for col in df.columns
+        if col not in [*breakdowns, question]
+        and pd.api.types.is_numeric_dtype(df[col])
+    ]
+    grouped = df[[*breakdowns, *sum_cols]].iloc[np.concatenate(subgroup_rows)]
+    grouped.insert(
+        0,
+        "subgroup",
+        np.repeat(np.arange(len(subgroup)), [len(rows) for rows in subgroup_rows])
+    )
+    subgroups = bincount_agg(grouped, ["subgroup", *breakdowns],
+                             **{col: (col, "sum") for col in sum_cols})
+
+    # Set the new response code of each subgroup
+    subgroup_codes = pd.Series(list(subgroup))
+    subgroups[question] = subgroup_codes.iloc[subgroups.pop("subgroup")].to_numpy()
+
+    return pd.concat([df, subgroups], ignore_index=True)
+
+
+def select_filtered(df, columns, filter_condition=None, valid_col=None):
+    """Selects the columns needed for a table, for the rows that pass the optional
+    table filter and have a valid (not negative) response to valid_col.
+
+    The filter is evaluated as a mask over df, so that only the selected columns
+    are copied, rather than every column as df.query() would.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    columns: list[str]
+        Columns to select, should be unique
+    filter_condition: str
+        Optional filter as a string, as used by df.query()
+    valid_col: str
+        Optional column that must have a valid response
+
+    Returns
+    -------
+    pandas.DataFrame
+        A copy of the selected rows and columns
+    """
+    mask = np.ones(len(df), dtype=bool)
+
+    if filter_condition is not None:
+        mask &= df.eval(filter_condition).to_numpy(dtype=bool)
 
-    return df.reset_index(drop=True)
+    if valid_col is not None:
+        mask &= (df[valid_col] >= 0).to_numpy()
+
+    return df[columns].loc[mask]
 
 
 def add_breakdown_groups(df, breakdowns, question):
@@ -148,9 +513,6 @@ def add_breakdown_groups(df, breakdowns, question):
 
     """
 
-    # List to store the different breakdown groups
-    total_dfs = []
-
     # Combinations of columns to be replaced with params.TOT_CODE
     # Firstly don't replace any, then replace a single column, then 2 columns, etc
     # E.g. [[], ["gender"], ["age"], ["gender", "age"], ...]
@@ -158,19 +520,64 @@ def add_breakdown_groups(df, breakdowns, question):
     replace_combinations = [combinations(breakdowns, n) for n in range(n_replacements)]
     replace_combinations = chain.from_iterable(replace_combinations)
 
-    for columns_to_replace in replace_combinations:
-        # Make a copy of df with default values for non-grouped columns
-        # inserted (e.g. replace values in 'gender' with 99)
-        default_df = df.copy()
+    replace_combinations = list(replace_combinations)
+    total_col = pd.Series(param.TOT_CODE, index=df.index)
 
-        for col in columns_to_replace:
-            default_df[col] = param.TOT_CODE
+    # Build each column of the groups in one go, rather than copying df for each
+    # combination and then again to concatenate them
+    total_cols = {}
+    for col in df.columns:
+        # Use the default value for non-grouped columns (e.g. replace values in
+        # 'gender' with 9999)
+        total_cols[col] = pd.concat(
+            [
+                total_col if col in columns_to_replace else df[col]
+                for columns_to_replace in replace_combinations
+            ],
+            ignore_index=True,
+        )
 
-        # Join the breakdown groupings
-        total_dfs.append(default_df)
+    return pd.DataFrame(total_cols)
 
-    # Concatenate the totals into a single DataFrame
-    return pd.concat(total_dfs, axis=0).reset_index(drop=True)
+
+def breakdown_group_index(df, breakdowns):
+    """
+    Numbers the breakdown groups that add_breakdown_groups would add to df,
+    without copying the other columns of df for each group.
+
+    Row i of each combination of breakdown groups is row i of df, so the other
+    columns for the groups are np.tile(df[col].to_numpy(), n_combinations).
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Record-level data to breakdown
+    breakdowns: list[str]
+        Columns to use in the breakdowns (e.g. age, gender, etc), or ["grouping"]
+        if there are no breakdowns
+
+    Returns
+    -------
+    np.ndarray
+        The group number of each row of the breakdown groups, in the order
+        of add_breakdown_groups, or -1 if a breakdown is missing
+    pandas.DataFrame
+        The values of the breakdowns for each group, in sorted order
+    """
+    if breakdowns == ["grouping"]:
+        grouped = df[breakdowns].reset_index(drop=True)
+    else:
+        grouped = add_breakdown_groups(df[breakdowns], breakdowns, None)
+
+    # Only number the rows with no missing breakdowns, as groupby does
+    present = drop_missing_groups(grouped, breakdowns)
+    groups = np.full(len(grouped), -1)
+    group_values = present.reset_index(drop=True)
+
+    if not present.empty:
+        groups[present.index], group_values = group_index(present, breakdowns)
+
+    return groups, group_values
 
 
 def transpose_multi(df, breakdowns, question):
@@ -195,13 +602,131 @@ def transpose_multi(df, breakdowns, question):
         per the 'question' input
 
     """
-    # Set the index on all columns except those that are to be transposed to
-    # a single column
-    df.set_index([*breakdowns, param.WEIGHTING_VAR], inplace=True)
-    # Transpose the non-index columns into a single new column
-    df = df.stack().rename_axis(index={None: question}).rename("Value").reset_index()
+    # Transpose all columns except the breakdowns and weighting to a single column
+    id_cols = [*breakdowns, param.WEIGHTING_VAR]
+    response_cols = [col for col in df.columns if col not in id_cols]
 
-    return df
+    return melt_columns(df, id_cols, response_cols, question)
+
+
+def melt_columns(
+    df,
+    id_cols,
+    value_cols,
+    var_name,
+    valid=None,
+    by_column=False,
+    value_name="Value",
+    categorical=False,
+):
+    """
+    Melts a block of columns into a long dataframe with NumPy, with a row for each
+    row of df and each column in value_cols. The id columns are repeated for each
+    value column, and the block of values is flattened, rather than stacking the
+    columns through the index. Missing values are dropped, as with
+    DataFrame.stack().
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    id_cols : list[str]
+        Columns to keep for every value column (e.g. breakdowns, weighting)
+    value_cols : list[str]
+        Columns to melt into a single column
+    var_name : str
+        Name of the new column containing the names of the value columns
+    valid : np.ndarray
+        Optional boolean array with the same shape as the value columns, only
+        the values where this is True are kept
+    by_column : bool
+        Whether to order the rows by value column then row, otherwise by row then
+        value column (as DataFrame.stack())
+    value_name : str
+        Name of the new column containing the values
+    categorical : bool
+        Whether to give the column names as a categorical, which is quicker to
+        group by, value_cols must then be unique
+
+    Returns
+    -------
+    pandas.DataFrame
+        id_cols, plus var_name with the column name and value_name with the value
+    """
+    values = df[value_cols].to_numpy()
+    n_rows, n_cols = values.shape
+    order = "F" if by_column else "C"
+
+    keep = pd.notna(values)
+    if valid is not None:
+        keep &= valid
+    keep = keep.ravel(order=order)
+
+    if categorical:
+        names = np.arange(n_cols)
+    else:
+        names = np.array(value_cols, dtype=object)
+    if by_column:
+        repeat_ids = partial(np.tile, reps=n_cols)
+        names = np.repeat(names, n_rows)
+    else:
+        repeat_ids = partial(np.repeat, repeats=n_cols)
+        names = np.tile(names, n_rows)
+
+    melted = {col: repeat_ids(df[col].to_numpy()) for col in id_cols}
+    melted[var_name] = names
+    melted[value_name] = values.ravel(order=order)
+
+    if not keep.all():
+        melted = {col: melted_col[keep] for col, melted_col in melted.items()}
+
+    if categorical:
+        melted[var_name] = pd.Categorical.from_codes(melted[var_name], value_cols)
+    else:
+        # Give the names as an object Series, so pandas doesn't try to infer a type
+        melted[var_name] = pd.Series(melted[var_name], dtype=object)
+
+    # The melted arrays are all new, so don't need copying into the dataframe
+    return pd.DataFrame(melted, copy=False)
+
+
+def format_rounded(values, round_to_dp=None):
+    """Round an array of values and surround them with square brackets, formatting
+    all values at once. For values below 1e16 this is equal to
+    f"[{round(value, round_to_dp)}]" for each value.
+
+    Parameters
+    ----------
+        values: np.ndarray
+            Numeric values to round
+        round_to_dp: int
+            Number of decimal places for rounding - default is None (integer)
+
+    Returns
+    -------
+        np.ndarray
+            Array of strings
+    """
+    if round_to_dp is None:
+        # np.round rounds half to even, like round() without ndigits
+        rounded = np.round(values)
+        finite = np.isfinite(rounded)
+        strings = values.astype(str)
+        strings[finite] = rounded[finite].astype(np.int64).astype(str)
+    else:
+        # printf style formatting is correctly rounded, like round() with ndigits
+        strings = np.char.mod(f"%.{round_to_dp}f", values).astype(str)
+        if round_to_dp > 0:
+            # Drop trailing zeros as the repr of a float does, keeping 1 decimal
+            strings = np.char.rstrip(strings, "0")
+            strings = np.where(
+                np.char.endswith(strings, "."), np.char.add(strings, "0"), strings
+            )
+        else:
+            strings = np.where(
+                np.isfinite(values), np.char.add(strings, ".0"), strings
+            )
+
+    return np.char.add(np.char.add("[", strings), "]")
 
 
 def suppress_column(col_to_suppress, base, lower=30, upper=50, round_to_dp=None):
@@ -212,6 +737,9 @@ def suppress_column(col_to_suppress, base, lower=30, upper=50, round_to_dp=None)
     it with square brackets
     If it is 0 and should be rounded, then replace with "[-]"
 
+    The suppression and rounding is worked out for the whole column at once, and
+    the rounded values are formatted with format_rounded.
+
     Parameters
     ----------
         col_to_suppress: pd.Series
@@ -231,27 +759,66 @@ def suppress_column(col_to_suppress, base, lower=30, upper=50, round_to_dp=None)
         pd.Series
 
     """
-    suppression = col_to_suppress.copy(deep=True)
+    values = col_to_suppress.to_numpy(dtype=float)
+    base_values = base.to_numpy(dtype=float)
+
+    should_suppress = base_values < lower
+    should_round = (base_values >= lower) & (base_values < upper)
+    should_zero = np.isclose(values, np.zeros_like(values))
 
-    should_suppress = base < lower
-    should_round = base.between(lower, upper, inclusive="left")
-    should_zero = np.isclose(suppression, np.zeros_like(suppression))
+    # Nothing to suppress or round, so keep the numeric type of the column
+    if not (should_suppress | should_round).any():
+        return col_to_suppress.copy()
 
-    suppression.loc[should_suppress] = "u"
+    # Mixed numeric and string values, so an object column
+    suppression = col_to_suppress.to_numpy(dtype=object, copy=True)
+
+    suppression[should_suppress] = "u"
 
     # Round to specified dp (default of None = integer) and add warning symbols
     # to column values where suppression base between 30 and 50
-    suppression.loc[should_round & ~should_zero] = (
-        suppression[should_round & ~should_zero]
-        .apply(
-            lambda p: f"[{round(p, round_to_dp)}]"
-            )
-        )
+    should_format = should_round & ~should_zero
+    suppression[should_format] = format_rounded(
+        values[should_format], round_to_dp
+    ).tolist()
 
     # Set to [-] for values where col = 0 and denom between 30 and 50
-    suppression.loc[should_round & should_zero] = "[-]"
+    suppression[should_round & should_zero] = "[-]"
+
+    return pd.Series(
+        suppression, index=col_to_suppress.index, name=col_to_suppress.name
+    )
 
-    return suppression
+
+def published_domains(denom_df, breakdowns, keys=(), lower=30):
+    """
+    Gets the domains that will have published standard errors, so the standard
+    errors of the other domains don't need estimating. These are the domains
+    with a weighted base that won't be suppressed by suppress_column, and with
+    no unknown (negative) breakdowns, which are removed by
+    format_breakdown_output.
+
+    Parameters
+    ----------
+    denom_df : pandas.DataFrame
+        The weighted base (DenomW) of each domain, with the keys and breakdowns
+    breakdowns: list[str]
+        Columns used in the breakdowns (e.g. age, gender, etc)
+    keys: list[str]
+        Other columns that define the domains (e.g. the question)
+    lower: int
+        Lower bound for suppression, as in suppress_column - default is 30
+
+    Returns
+    -------
+    pandas.DataFrame
+        The keys and breakdowns of each published domain
+    """
+    published = ~(denom_df["DenomW"].to_numpy(dtype=float) < lower)
+    for breakdown in breakdowns:
+        published &= (denom_df[breakdown] >= 0).to_numpy()
+
+    return denom_df.loc[published, [*keys, *breakdowns]]
 
 
 def add_percentage(
@@ -341,6 +908,33 @@ def format_breakdown_output(df, breakdowns, question, column_order, year=param.Y
     return df
 
 
+def survey_perc_proportions(df, question, by, **kwargs):
+    """Calculate the weighted percentages and standard errors of a question, using
+    the engine set by SE_ENGINE in parameters.py. Every engine gives the same
+    output, see stats_R.survey_perc_proportions, with the standard errors from
+    the R survey package, Taylor linearisation in python, or replicate weights.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+    question: str
+    by: list[str]
+    Additional kwargs are passed to the engine's survey_perc_proportions
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+    if param.SE_ENGINE == "R":
+        return stats_R.survey_perc_proportions(df, question, by, **kwargs)
+    elif param.SE_ENGINE == "python":
+        return stats.survey_perc_proportions(df, question, by, **kwargs)
+    elif param.SE_ENGINE == "replicate":
+        return replicate_weights.survey_perc_proportions(df, question, by, **kwargs)
+    else:
+        raise ValueError(f"Unknown SE_ENGINE: {param.SE_ENGINE}")
+
+
 def percentage_by_domain(df, breakdowns, question, **kwargs):
     """Calculate the percentage, standard error, and confidence interval
     for each by group specified in breakdowns. Includes a check for single PSU
@@ -361,8 +955,9 @@ def percentage_by_domain(df, breakdowns, question, **kwargs):
         f"{breakdowns} and additional arguments {kwargs}"
     )
 
-    # Create a single domain column for samplics estimator to use
-    df["domain"] = create_domain(df, breakdowns)
+    # Create a single integer domain column for samplics estimator to use
+    keys, levels = encode_domain(df, breakdowns)
+    df["domain"] = keys
 
     # Remove missing breakdowns, due to low no. these lead to
     # issues with the variance (e.g. zero division etc) and
@@ -376,6 +971,11 @@ def percentage_by_domain(df, breakdowns, question, **kwargs):
         df, question, domain="domain", **kwargs
     )
 
+    # Label the domains with their breakdown values
+    standard_errors_df["domain"] = np.asarray(
+        domain_labels(standard_errors_df["domain"], breakdowns, levels)
+    )
+
     return standard_errors_df
 
 
@@ -423,45 +1023,84 @@ def create_breakdown_single(
         f" subgroup: {subgroup} and filter: {filter_condition}"
     )
 
-    # Apply the optional table filter that is needed for some tables
-    if filter_condition is None:
-        filtered = df
-    else:
-        filtered = df.query(filter_condition)
+    # No breakdowns uses the default grouping, added in summarise_single
+    breakdowns = list(breakdowns or [])
+
+    # Get required columns
+    # Use set() in case param.STRATA is in breakdowns, ensure uniqueness
+    select_cols = list(set((
+        *breakdowns,
+        question,
+        param.WEIGHTING_VAR,
+        param.STRATA,
+        param.PSU,
+    )))
+
+    # Apply the optional table filter that is needed for some tables, and filter
+    # to pupils with a valid response to the question (not negative)
+    select = select_filtered(df, select_cols, filter_condition, question)
+
+    return summarise_single(select, breakdowns, question, subgroup, create_SE)
+
 
-    # Filter to pupils with a valid response to the question (not negative)
-    filtered = filtered[filtered[question] >= 0].copy(deep=True)
+def summarise_single(
+    select,
+    breakdowns,
+    question,
+    subgroup,
+    create_SE=param.CREATE_SE,
+    counts=None,
+):
+    """
+    Creates the output of create_breakdown_single from the selected rows, which
+    are either a row for each pupil, or totals of several pupils (e.g. the PSU
+    totals in the totals store) with the number of pupils in each row given by
+    counts.
+
+    Parameters
+    ----------
+    select : pandas.DataFrame
+        The rows that pass the table filter, with a valid response to the question
+    breakdowns : list[str]
+        these are the pupil breakdowns from the table e.g. gender and age1115
+        if None, default value of 9999 will be used under heading 'grouping'
+    question: str
+        Single variable name that defines the question to be analysed
+        (e.g. dallast5, alevr)
+    subgroup: dictionary
+        Optional new response code(s), and the response values that form each
+        group, as in create_breakdown_single
+    create_SE: bool
+        Whether to create standard errors and CIs for the percentage
+    counts: str
+        Optional column with the number of pupils in each row, if the rows are
+        totals of several pupils. The standard errors then can't use the R
+        engine, as the R survey designs need a row for each pupil
 
+    Returns
+    -------
+    df : pandas.DataFrame
+        As returned by create_breakdown_single
+    """
     # Add breakdown groups if needed
     if not breakdowns:
-        filtered["grouping"] = param.TOT_CODE
+        select["grouping"] = param.TOT_CODE
         breakdowns = ["grouping"]
 
-    # Get required columns
-    # Use set() in case param.STRATA is in breakdowns, ensure uniqueness
-    select_cols = list(set((
-        *breakdowns,
-        question,
-        param.WEIGHTING_VAR,
-        param.STRATA,
-        param.PSU,
-    )))
-
-    select = filtered[select_cols].copy(deep=True)
-
     if breakdowns != ["grouping"]:
         # Create the breakdown groups
         select = add_breakdown_groups(select, breakdowns, question)
 
     # Group the data to create the weighted and unweighted counts.
-    numer_df = (select.groupby([*breakdowns, question])
-                .agg(NumerW=(param.WEIGHTING_VAR, "sum"),
-                     NumerU=(param.WEIGHTING_VAR, "count")).reset_index())
+    numer_df = bincount_agg(select, [*breakdowns, question],
+                            NumerW=(param.WEIGHTING_VAR, "sum"),
+                            NumerU=((param.WEIGHTING_VAR, "count") if counts is None
+                                    else (counts, "sum")))
 
     # Create the weighted and unweighted bases for each pupil group
-    denom_df = (numer_df.groupby(by=breakdowns)
-                .agg(DenomW=("NumerW", "sum"),
-                     DenomU=("NumerU", "sum")).reset_index())
+    denom_df = bincount_agg(numer_df, breakdowns,
+                            DenomW=("NumerW", "sum"),
+                            DenomU=("NumerU", "sum"))
 
     # Add any required response subgroups
     if subgroup is not None:
@@ -484,42 +1123,34 @@ def create_breakdown_single(
         # of new data changes the survey design, so get rid of totals
         # and let python stats functions do the totalling
         breakdowns = [] if breakdowns == ["grouping"] else breakdowns
-        select_se = select.copy()
-        select_se = select_se[(select_se[breakdowns] != param.TOT_CODE).all(axis=1)]
+        select_se = select[(select[breakdowns] != param.TOT_CODE).all(axis=1)]
 
-        # Get standard errors of percentages
-        standard_errors = stats_R.survey_perc_proportions(
-            select_se,
-            question,
-            by=breakdowns
-        )
-
-        # If calculating subgroups, recode all subgroups to new values
-        if subgroup:
-            # Will calculate new SE for each subgroup in order
-            # as subgroups may be nested
-            se_subgroup_list = []
-            for new_value, value_list in subgroup.items():
-                select_subgroups = select_se.copy()
-                select_subgroups.loc[
-                    select_subgroups[question].isin(value_list), question
-                ] = new_value
-
-                # Get standard errors of percentages
-                standard_errors_subgroups = stats_R.survey_perc_proportions(
-                    select_subgroups, question, by=breakdowns
-                )
-
-                # Add only the new values (for the current subgroup)
-                se_subgroup_list.append(
-                    standard_errors_subgroups[
-                        standard_errors_subgroups[question] == new_value
-                    ]
+        # Get standard errors of percentages, including any subgroups as extra
+        # responses, skipping the domains that won't be published
+        if counts is None:
+            standard_errors = survey_perc_proportions(
+                select_se,
+                question,
+                by=breakdowns,
+                subgroup=subgroup,
+                domains=published_domains(denom_df, breakdowns)
+            )
+        else:
+            # R can't use the pupil counts, so totals need the python engines
+            if param.SE_ENGINE == "R":
+                raise ValueError(
+                    f"Standard errors of {question} can't be created from totals "
+                    "with the R engine"
                 )
-
-            # Append the subgroups to the original standard errors
-            standard_errors = pd.concat([standard_errors, *se_subgroup_list],
-                                        ignore_index=True)
+            engine = replicate_weights if param.SE_ENGINE == "replicate" else stats
+            standard_errors = engine.survey_perc_proportions(
+                select_se,
+                question,
+                by=breakdowns,
+                subgroup=subgroup,
+                domains=published_domains(denom_df, breakdowns),
+                counts=counts,
+            )
 
         # Join the variance calculations to both
         output = output.merge(standard_errors, how="left", on=[*breakdowns, question])
@@ -550,6 +1181,300 @@ def create_breakdown_single(
     return output
 
 
+def stack_questions(df, id_cols, questions, masks=None):
+    """
+    Stacks the valid (not negative) responses to several questions into a
+    single long dataframe, with one row for each pupil and question.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    id_cols : list[str]
+        Columns to keep for every question (e.g. breakdowns, weighting, strata)
+    questions: list[str]
+        Variable names of the questions to stack (e.g. ["alevr", "dallast5"])
+    masks : np.ndarray
+        Optional boolean array with a column for each question, only the rows
+        where this is True are kept for that question (e.g. a filter that
+        differs for each question)
+
+    Returns
+    -------
+    pandas.DataFrame
+        id_cols, plus a categorical 'Question' column with the question name and
+        a 'Response' column with the response to that question
+    """
+    valid = df[questions].to_numpy() >= 0
+    if masks is not None:
+        valid &= masks
+
+    return melt_columns(df, id_cols, questions, "Question", valid, by_column=True,
+                        value_name="Response", categorical=True)
+
+
+def stack_responses(df, id_cols, responses, bases, question):
+    """
+    Stacks several multi-response columns into a single long dataframe, with one
+    row for each pupil and response. Each response only includes the pupils with
+    a valid (not negative) response to its base, and missing responses are
+    dropped.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    id_cols : list[str]
+        Columns to keep for every response (e.g. breakdowns, weighting, strata)
+    responses : list[str]
+        Variable names of the response columns
+    bases : list[str]
+        The base variable of each response
+    question: str
+        Name of the new column containing the response names
+
+    Returns
+    -------
+    pandas.DataFrame
+        id_cols, plus the question column with the response name and a 'Value'
+        column with the response
+    """
+    # Valid bases for each response, bases can be repeated
+    valid = df[bases].to_numpy() >= 0
+
+    return melt_columns(df, id_cols, responses, question, valid, by_column=True)
+
+
+def create_breakdown_single_batch(
+    df,
+    breakdowns,
+    questions,
+    filter_condition,
+    create_SE=param.CREATE_SE,
+    subgroup=None
+):
+    """
+    Creates the create_breakdown_single outputs for several questions that share
+    the same breakdowns, in a single pass.
+
+    The filter and breakdown groups are applied once for all questions, and
+    each question is counted over the shared breakdown groups. For the standard
+    errors, the valid responses to every question are stacked into one long
+    dataframe and passed to R once, with each question calculated separately.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    breakdowns : list[str]
+        these are the pupil breakdowns from the table e.g. gender and age1115
+        if None, default value of 9999 will be used under heading 'grouping'
+    questions: list[str]
+        Variable names of the questions to be analysed (e.g. ["alevr", "dallast5"])
+    filter_condition : str
+        this is a non-standard, optional dataframe filter as a string, applied
+        to all questions
+        if filtering on each question then use {question} instead
+        e.g. "{question} != 6"
+    create_SE: bool
+        Whether to create standard errors and CIs for the percentage
+    subgroup: dictionary
+        Optional input where a grouped response is reported, generated for all
+        questions e.g. {"UsedTotal": [1, 2, 3]}
+
+    Returns
+    -------
+    dict[str, pandas.DataFrame]
+        The output for each question, equal to the output of
+        create_breakdown_single for that question
+    """
+    logging.debug(
+        f"Creating batched tables for questions: {questions}, with breakdowns: "
+        f"{breakdowns}, subgroup: {subgroup} and filter: {filter_condition}"
+    )
+
+    # No breakdowns uses the default grouping, added after filtering
+    breakdowns = list(breakdowns or [])
+
+    # Each question is only calculated once, even if repeated
+    questions = list(dict.fromkeys(questions))
+
+    # Get the filter for each question, which is the same for all questions
+    # unless the filter contains {question}
+    filters = [
+        None if filter_condition is None else filter_condition.format(question=question)
+        for question in questions
+    ]
+    shared_filter = filters[0] if len(set(filters)) == 1 else None
+
+    # Apply the optional table filter that is needed for some tables, only
+    # keeping the fields needed for the tables
+    filtered = select_filtered(
+        df,
+        list(dict.fromkeys([
+            *breakdowns,
+            *questions,
+            param.WEIGHTING_VAR,
+            param.STRATA,
+            param.PSU,
+        ])),
+        shared_filter,
+    )
+
+    # Otherwise evaluate the filter of each question as a mask over the rows
+    masks = None
+    if len(set(filters)) > 1:
+        masks = np.column_stack([
+            df.eval(question_filter).to_numpy(dtype=bool)
+            for question_filter in filters
+        ])
+
+    # Add breakdown groups if needed
+    if not breakdowns:
+        filtered["grouping"] = param.TOT_CODE
+        breakdowns = ["grouping"]
+
+    # Number the breakdown groups once for all questions. The other columns of
+    # the groups repeat the filtered rows for each combination of groups
+    groups, group_values = breakdown_group_index(filtered, breakdowns)
+    n_combinations = len(groups) // len(filtered) if len(filtered) else 1
+    weights = np.tile(filtered[param.WEIGHTING_VAR].to_numpy(), n_combinations)
+
+    # As in create_breakdown_single, the default breakdown is not used for the
+    # standard errors
+    se_breakdowns = [] if breakdowns == ["grouping"] else breakdowns
+
+    counts = {}
+    for i, question in enumerate(questions):
+        # Keep the groups of pupils with a valid response to the question (not
+        # negative), in the same order as in create_breakdown_single
+        responses = filtered[question].to_numpy()
+        valid = responses >= 0
+        if masks is not None:
+            valid &= masks[:, i]
+        valid = np.tile(valid, n_combinations) & (groups >= 0)
+
+        question_df = pd.DataFrame({
+            "group": groups[valid],
+            question: np.tile(responses, n_combinations)[valid],
+            param.WEIGHTING_VAR: weights[valid],
+        })
+
+        # Group the data to create the weighted and unweighted counts
+        numer_q = bincount_agg(question_df, ["group", question],
+                               NumerW=(param.WEIGHTING_VAR, "sum"),
+                               NumerU=(param.WEIGHTING_VAR, "count"))
+        numer_q = pd.concat(
+            [
+                group_values.iloc[numer_q["group"]].reset_index(drop=True),
+                numer_q.drop(columns="group"),
+            ],
+            axis=1
+        )
+
+        # Create the weighted and unweighted bases for each pupil group
+        denom_q = bincount_agg(numer_q, breakdowns,
+                               DenomW=("NumerW", "sum"),
+                               DenomU=("NumerU", "sum"))
+
+        # Add any required response subgroups
+        if subgroup is not None:
+            numer_q = add_response_subgroup(numer_q, breakdowns, question, subgroup)
+
+        counts[question] = numer_q, denom_q
+
+    if create_SE:
+        # Use set() in case param.STRATA is in breakdowns, ensure uniqueness
+        id_cols = list(set((
+            *se_breakdowns,
+            param.WEIGHTING_VAR,
+            param.STRATA,
+            param.PSU,
+        )))
+
+        # Stack the valid responses to all questions into a single Response
+        # column. These are the records before adding the breakdown groups, so
+        # as in create_breakdown_single there are no totals and the stats
+        # functions do the totalling
+        select = stack_questions(filtered, id_cols, questions, masks)
+        select_se = select[(select[se_breakdowns] != param.TOT_CODE).all(axis=1)]
+
+        # Get standard errors of percentages, including any subgroups as extra
+        # responses, keeping each question separate and skipping the domains
+        # that won't be published
+        standard_errors = survey_perc_proportions(
+            select_se,
+            "Response",
+            by=se_breakdowns,
+            keys=["Question"],
+            subgroup=subgroup,
+            domains=pd.concat(
+                [
+                    published_domains(denom_q, se_breakdowns).assign(
+                        Question=question
+                    )
+                    for question, (_, denom_q) in counts.items()
+                ],
+                ignore_index=True
+            )
+        )
+
+    outputs = {}
+    for question in questions:
+        numer_q, denom_q = counts[question]
+
+        # Join the bases to the weighted counts
+        output = numer_q.merge(denom_q, how="left", on=breakdowns)
+
+        # Add the percentages including suppression/warnings
+        output = add_percentage(output)
+
+        if create_SE:
+            # Join the variance calculations to the counts
+            output = output.merge(
+                _split_question(standard_errors, question),
+                how="left",
+                on=[*se_breakdowns, question]
+            )
+
+            # Internal check that methods are equivalent
+            safe_check_columns_eq(output, "Percentage", "R_Percentage")
+
+            # Suppress column based on similar rules as percentages
+            for col in ["std_err", "lower_ci", "upper_ci", "deff"]:
+                output[col] = suppress_column(output[col], output["DenomW"],
+                                              round_to_dp=1)
+        else:
+            for col in ["std_err", "lower_ci", "upper_ci", "deff"]:
+                output[col] = np.nan
+
+        # Applies final output formatting removing default breakdowns
+        # column if added earlier
+        if breakdowns != ["grouping"]:
+            column_order = ["Year", "Breakdown_type", *breakdowns, question,
+                            "NumerW", "DenomW", "DenomU", "Percentage", "std_err",
+                            "lower_ci", "upper_ci", "deff"]
+        else:
+            column_order = ["Year", "Breakdown_type", question, "NumerW",
+                            "DenomW", "DenomU", "Percentage", "std_err", "lower_ci",
+                            "upper_ci", "deff"]
+
+        outputs[question] = format_breakdown_output(
+            output, se_breakdowns if create_SE else breakdowns, question,
+            column_order
+        )
+
+    return outputs
+
+
+def _split_question(df, question):
+    """Select the rows of a stacked dataframe for one question, renaming the
+    Response column to the question"""
+    return (
+        df.loc[df["Question"] == question]
+        .drop(columns="Question")
+        .rename(columns={"Response": question})
+        .reset_index(drop=True)
+    )
+
+
 def create_breakdown_single_combine(
     df,
     breakdowns,
@@ -560,7 +1485,7 @@ def create_breakdown_single_combine(
 ):
     """
     Creates and combines outputs for multiple questions using
-    create_breakdown_single function
+    create_breakdown_single_batch function
 
     Parameters
     ----------
@@ -600,20 +1525,19 @@ def create_breakdown_single_combine(
         f"{'None' if filter_condition is None else filter_condition}"
     )
 
-    total_dfs = []
+    # No breakdowns uses the default grouping
+    breakdowns = list(breakdowns or [])
 
-    if filter_condition is None:
-        filter_condition = [None] * len(questions)
+    total_dfs = []
 
-    else:
-        filter_condition = [filter_condition.format(question=question)
-                            for question in questions]
+    # create the outputs of create_breakdown_single for all questions at once
+    outputs = create_breakdown_single_batch(df, breakdowns, questions,
+                                            filter_condition, create_SE, subgroup)
 
-    for filter_condition, question in zip(filter_condition, questions):
+    for question in questions:
 
-        # create initial output from create_breakdown_single
-        dfq = create_breakdown_single(df, breakdowns, question,
-                                      filter_condition, subgroup, create_SE)
+        # copy, as a question can be repeated
+        dfq = outputs[question].copy()
 
         # rename the question column to be a generic response column and insert
         # the question as a new column
@@ -669,6 +1593,8 @@ def create_breakdown_multiple_discrete(
         Weighted Count, Weighted Base, Unweighted Base and Prevalence (percent)
         year and breakdown type also added to start of dataframe
     """
+    breakdowns = list(breakdowns or [])
+
     logging.debug(
         f"Creating table for question: {question}, with breakdowns: {breakdowns}"
         f", responses: {responses}, bases: {bases}, and filter {filter_condition}"
@@ -679,122 +1605,105 @@ def create_breakdown_multiple_discrete(
     elif len(bases) != len(responses):
         raise ValueError("Either need 1 base or an equal number of bases and responses")
 
-    total_dfs = []
-    for response, base in zip(responses, bases):
-
-        if filter_condition is None:
-            filtered = df
-        else:
-            filtered = df.query(filter_condition)
-
-        # Filter to pupils with a valid response to the question used as the
-        # base (not negative).
-        filtered = filtered[filtered[base] >= 0].copy(deep=True)
-
-        # Rename the base variable
-        # This is to allow for tables where each response variable is also it's own base
-        # i.e. so df doesn't have the same variable name twice (response and base)
-        base_adj = "base_" + base
-        filtered[base_adj] = filtered[base]
-
-        # Use set() in case param.STRATA is in breakdowns, ensure uniqueness
-        select_cols = list(set([
-            *breakdowns,
-            response,
-            base_adj,
-            param.WEIGHTING_VAR,
-            param.STRATA,
-            param.PSU,
-        ]))
+    # Use set() in case param.STRATA is in breakdowns, ensure uniqueness
+    id_cols = list(set([
+        *breakdowns,
+        param.WEIGHTING_VAR,
+        param.STRATA,
+        param.PSU,
+    ]))
 
-        select = filtered[select_cols].copy(deep=True)
+    # Apply the optional table filter, only keeping the fields needed
+    filtered = select_filtered(
+        df, list(dict.fromkeys([*id_cols, *responses, *bases])), filter_condition
+    )
 
-        # Transpose the individual response columns into a single question column
-        select = transpose_multi(
-            df=select,
-            breakdowns=[col for col in select_cols if col not in [response,
-                                                                  param.WEIGHTING_VAR]],
-            question=question,
-        )
+    # Stack the responses into a single question column, each for the pupils with
+    # a valid response to the question used as its base (not negative)
+    select = stack_responses(filtered, id_cols, responses, bases, question)
 
-        # Add a weighted count of yes (1) responses
-        select["weighted_num"] = np.where(
-            select["Value"] == 1, select[param.WEIGHTING_VAR], 0
-        )
+    # Add a weighted count of yes (1) responses
+    select["weighted_num"] = np.where(
+        select["Value"] == 1, select[param.WEIGHTING_VAR], 0
+    )
 
-        # Create the breakdown groups
-        select = add_breakdown_groups(select, breakdowns, question)
+    # Create the breakdown groups
+    select = add_breakdown_groups(select, breakdowns, question)
 
-        # Base aggregations done for all Qs
-        aggregations = {
-            "NumerW": ("weighted_num", "sum"),
-            "DenomW": (param.WEIGHTING_VAR, "sum"),
-            "DenomU": (param.WEIGHTING_VAR, "count")
-        }
+    # Group the data to create the weighted counts, for all responses at once
+    output = bincount_agg(select, [*breakdowns, question],
+                          NumerW=("weighted_num", "sum"),
+                          DenomW=(param.WEIGHTING_VAR, "sum"),
+                          DenomU=(param.WEIGHTING_VAR, "count"))
 
-        # Group the data to create the weighted counts.
-        output = select.groupby([*breakdowns, question]).agg(**aggregations).reset_index()
+    # Add_percentage
+    output = add_percentage(df=output)
 
-        # Add_percentage
-        output = add_percentage(df=output)
+    if create_SE:
+        # Standard errors will be off if using the standard
+        # breakdown method, as if the STRATA is a breakdown the appending
+        # of new data changes the survey design, so get rid of totals
+        # and let python stats functions do the totalling
+        select_se = select[(select[breakdowns] != param.TOT_CODE).all(axis=1)]
 
-        if create_SE:
-            # Standard errors will be off if using the standard
-            # breakdown method, as if the STRATA is a breakdown the appending
-            # of new data changes the survey design, so get rid of totals
-            # and let python stats functions do the totalling
-            select_se = select.copy()
-            select_se = select_se[(select_se[breakdowns] != param.TOT_CODE).all(axis=1)]
-
-            # Get standard errors of percentages
-            standard_errors_df = stats_R.survey_perc_proportions(
-                select_se,
-                question="Value",
-                by=breakdowns
-            )
-            # Retrieve only the levels we are interested in
-            standard_errors_df = standard_errors_df.loc[
-                standard_errors_df["Value"] == 1
-            ]
+        # Get standard errors of percentages, for each response separately,
+        # skipping the domains that won't be published
+        standard_errors_df = survey_perc_proportions(
+            select_se,
+            question="Value",
+            by=breakdowns,
+            keys=[question],
+            domains=published_domains(output, breakdowns, keys=[question]),
+        )
+        # Retrieve only the levels we are interested in
+        standard_errors_df = standard_errors_df.loc[
+            standard_errors_df["Value"] == 1
+        ].drop(columns="Value")
+
+        # Join the variance calculations to previous grouping
+        output = output.merge(
+            standard_errors_df,
+            how="left",
+            on=[*breakdowns, question]
+        )
 
-            # Join the variance calculations to previous grouping
-            # Insert question here in case breakdowns is empty
-            standard_errors_df.insert(0, question, response)
-            output = output.merge(
-                standard_errors_df,
-                how="left",
-                on=[*breakdowns, question]
-            )
+        # Internal check that methods are equivalent
+        safe_check_columns_eq(output, "Percentage", "R_Percentage")
 
-            # Internal check that methods are equivalent
-            safe_check_columns_eq(output, "Percentage", "R_Percentage")
+        # Suppress column based on similar rules as percentages
+        for col in ["std_err", "lower_ci", "upper_ci", "deff"]:
+            output.loc[:, col] = suppress_column(output[col], output["DenomW"],
+                                                 round_to_dp=1)
+    else:
+        for col in ["std_err", "lower_ci", "upper_ci", "deff"]:
+            output[col] = np.nan
 
-            # Suppress column based on similar rules as percentages
-            for col in ["std_err", "lower_ci", "upper_ci", "deff"]:
-                output.loc[:, col] = suppress_column(output[col], output["DenomW"],
-                                                     round_to_dp=1)
-        else:
-            for col in ["std_err", "lower_ci", "upper_ci", "deff"]:
-                output[col] = np.nan
+    # Applies final output formatting
+    column_order = [
+        "Year",
+        "Breakdown_type",
+        *breakdowns,
+        question,
+        "NumerW",
+        "DenomW",
+        "DenomU",
+        "Percentage",
+        "std_err",
+        "lower_ci",
+        "upper_ci",
+        "deff"
+    ]
 
-        # Applies final output formatting
-        column_order = [
-            "Year",
-            "Breakdown_type",
-            *breakdowns,
+    # Format each response separately, keeping the responses in the order given
+    total_dfs = [
+        format_breakdown_output(
+            output.loc[output[question] == response].reset_index(drop=True),
+            breakdowns,
             question,
-            "NumerW",
-            "DenomW",
-            "DenomU",
-            "Percentage",
-            "std_err",
-            "lower_ci",
-            "upper_ci",
-            "deff"
-        ]
-        output = format_breakdown_output(output, breakdowns, question, column_order)
-
-        total_dfs.append(output)
+            column_order,
+        )
+        for response in dict.fromkeys(responses)
+    ]
 
     return pd.concat(total_dfs, axis=0).reset_index(drop=True)
 
@@ -840,21 +1749,13 @@ def create_breakdown_multiple_cont(
         Weighted Count, Weighted Base, Unweighted Base and Prevalence (percent)
         year and breakdown type also added to start of dataframe
     """
+    breakdowns = list(breakdowns or [])
+
     logging.debug(
         f"Creating table for question: {question}, with breakdowns: {breakdowns}"
         f" ,responses: {responses}, base: {base}, and filter {filter_condition}"
     )
 
-    # Apply the optional table filter that is needed for some tables
-    if filter_condition is None:
-        filtered = df
-    else:
-        filtered = df.query(filter_condition)
-
-    # Filter to pupils with a valid response to the question used as the base
-    # (not negative).
-    filtered = filtered[filtered[base] >= 0].copy(deep=True)
-
     # Use set() in case param.STRATA is in breakdowns, ensure uniqueness
     select_cols = list(set([
         *breakdowns,
@@ -865,8 +1766,10 @@ def create_breakdown_multiple_cont(
         param.PSU,
     ]))
 
-    # Select the fields needed for the table
-    select = filtered[select_cols].copy(deep=True)
+    # Select the fields needed for the table, applying the optional table filter
+    # and filtering to pupils with a valid response to the question used as the
+    # base (not negative).
+    select = select_filtered(df, select_cols, filter_condition, base)
 
     # Transpose the individual response columns into a single column
     select = transpose_multi(
@@ -910,14 +1813,16 @@ def create_breakdown_multiple_cont(
         # breakdown method, as if the STRATA is a breakdown the appending
         # of new data changes the survey design, so get rid of totals
         # and let python stats functions do the totalling
-        select_se = select.copy()
-        select_se = select_se[(select_se[breakdowns] != param.TOT_CODE).all(axis=1)]
+        select_se = select[(select[breakdowns] != param.TOT_CODE).all(axis=1)]
 
+        # Skip the domains that won't be published, which includes the totals
+        # across all responses
         standard_errors_df = stats_R.survey_perc_ratios(
             df=select_se,
             question="Value",
             base=base,
-            by=[*breakdowns, question]
+            by=[*breakdowns, question],
+            domains=published_domains(grouped, breakdowns, keys=[question]),
         )
 
         # Join the variance calculations to both
@@ -982,20 +1887,29 @@ def create_breakdown_statistics(df, breakdowns, questions, base, filter_conditio
         year and breakdown type also added to start of dataframe
         Bases are also added for each breakdown
     """
+    breakdowns = list(breakdowns or [])
+
     logging.debug(
         f"Creating table for question: {questions}, with breakdowns: {breakdowns}"
         f", base: {base}, and filter {filter_condition}"
     )
     # Statistics will be created for each question
 
-    # Apply the optional table filter that is needed for some tables
-    if filter_condition is None:
-        filtered = df
-    else:
-        filtered = df.query(filter_condition)
-
-    # Filter to pupils with a valid response to the base question
-    filtered = filtered.loc[filtered[base] >= 0]
+    # Apply the optional table filter that is needed for some tables, and filter
+    # to pupils with a valid response to the base question. Only keep the fields
+    # needed for the tables
+    filtered = select_filtered(
+        df,
+        list(dict.fromkeys([
+            *breakdowns,
+            *questions,
+            param.WEIGHTING_VAR,
+            param.STRATA,
+            param.PSU,
+        ])),
+        filter_condition,
+        base,
+    )
 
     # List to store outputs for each inputted question in questions
     total_dfs = []
@@ -1010,7 +1924,7 @@ def create_breakdown_statistics(df, breakdowns, questions, base, filter_conditio
                 param.STRATA,
                 param.PSU,
             ]
-        ].copy(deep=True)
+        ]
 
         # Create the breakdown groups
         groups = add_breakdown_groups(select, breakdowns, question)
@@ -1019,20 +1933,15 @@ def create_breakdown_statistics(df, breakdowns, questions, base, filter_conditio
         for breakdown in breakdowns:
             groups = groups.loc[groups[breakdown] >= 0]
 
-        # Group the data by the breakdowns, applying the weighted stats fct
-        output = (
-            groups
-            .groupby(breakdowns)
-            .apply(stats.create_weighted_stats, question)
-        ).reset_index()
+        # Calculate the weighted mean and median for each breakdown group
+        output = weighted_stats_by_group(groups, breakdowns, question)
 
         # Pass to R to calculate survey statistics SE and CIs
         # Standard errors will be off if using the standard
         # breakdown method, as if the STRATA is a breakdown the appending
         # of new data changes the survey design, so get rid of totals
         # and let python stats functions do the totalling
-        select_se = select.copy()
-        select_se = select_se[(select_se[breakdowns] != param.TOT_CODE).all(axis=1)]
+        select_se = select[(select[breakdowns] != param.TOT_CODE).all(axis=1)]
         standard_errors_df = stats_R.survey_stats(
             select_se,
             question,
@@ -1041,9 +1950,9 @@ def create_breakdown_statistics(df, breakdowns, questions, base, filter_conditio
 
         # Create the weighted and unweighted bases for each breakdown
         # (created from earlier step before stats grouping)
-        denom_df = (groups.groupby(by=breakdowns)
-                    .agg(DenomW=(param.WEIGHTING_VAR, "sum"),
-                         DenomU=(param.WEIGHTING_VAR, "count")).reset_index())
+        denom_df = bincount_agg(groups, breakdowns,
+                                DenomW=(param.WEIGHTING_VAR, "sum"),
+                                DenomU=(param.WEIGHTING_VAR, "count"))
 
         # Join the bases to the stats output
         output = output.merge(denom_df, how="left", on=breakdowns)
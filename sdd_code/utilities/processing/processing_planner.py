@@ -0,0 +1,726 @@
+"""
+Plans the computation of the tables in a set of chapters.
+
+Each table function in tables.py calls one of the create_breakdown_* functions
+with fixed arguments. The planner records those arguments without running the
+table, so that tables using create_breakdown_single with the same breakdowns and
+filter can be computed together in one aggregation pass, using
+create_breakdown_single_batch. All other tables are ran as normal.
+
+The planned tasks can be ran one after another, or concurrently in a pool of
+worker processes. The time taken by each task is saved, and used in later runs to
+start the longest tasks first, and to estimate the time remaining.
+
+Tables can also be created from a totals store (see processing_store), in which
+case they don't use the pupil data.
+"""
+import inspect
+import json
+import logging
+import re
+import tempfile
+import timeit
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from pathlib import Path
+
+import pyarrow.feather as feather
+
+import sdd_code.utilities.parameters as param
+from sdd_code.utilities import logger_config
+from sdd_code.utilities import replicate_weights
+from sdd_code.utilities import tables
+from sdd_code.utilities.processing import processing, processing_store
+
+# The functions that table functions use to create their outputs
+ENGINES = [
+    "create_breakdown_single",
+    "create_breakdown_single_combine",
+    "create_breakdown_multiple_discrete",
+    "create_breakdown_multiple_cont",
+    "create_breakdown_statistics",
+]
+
+
+def _make_recorder(engine_name):
+    """Creates a function with the same signature as the engine, that returns the
+    arguments it was called with instead of creating the table.
+
+    Parameters
+    ----------
+    engine_name: str
+        Name of the engine function in the processing module
+
+    Returns
+    -------
+    function
+    """
+    signature = inspect.signature(getattr(processing, engine_name))
+
+    def recorder(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        spec = dict(bound.arguments)
+        spec.pop("df")
+        spec["engine"] = engine_name
+        return spec
+
+    return recorder
+
+
+@contextmanager
+def recording_engines():
+    """Context manager that replaces the engines used by the table functions with
+    recorders, so calling a table function returns its arguments.
+    """
+    original = {name: getattr(tables, name) for name in ENGINES}
+    try:
+        for name in ENGINES:
+            setattr(tables, name, _make_recorder(name))
+        yield
+    finally:
+        for name, engine in original.items():
+            setattr(tables, name, engine)
+
+
+def get_table_spec(table):
+    """Get the engine and arguments used by a table function, without creating
+    the table.
+
+    Parameters
+    ----------
+    table: function
+        A table function from tables.py
+
+    Returns
+    -------
+    dict
+        The arguments passed to the engine, plus the name of the engine under
+        the key 'engine'
+    """
+    with recording_engines():
+        return table(None)
+
+
+def get_fuse_key(spec):
+    """Get the key used to group tables that can be computed together, or None
+    if the table can't be batched.
+
+    Parameters
+    ----------
+    spec: dict
+        A table spec, as returned by get_table_spec
+
+    Returns
+    -------
+    tuple or None
+    """
+    if spec["engine"] != "create_breakdown_single" or spec["subgroup"] is not None:
+        return None
+
+    breakdowns = spec["breakdowns"] or []
+
+    # The question must not be one of the columns kept alongside it
+    id_cols = {*breakdowns, param.WEIGHTING_VAR, param.STRATA, param.PSU}
+    if spec["question"] in id_cols:
+        return None
+
+    return (tuple(breakdowns), spec["filter_condition"], spec["create_SE"])
+
+
+def plan_tables(all_tables):
+    """Group the tables into tasks, where each task is either a single table or
+    a batch of tables computed in one pass.
+
+    Parameters
+    ----------
+    all_tables: list[function]
+        Table functions from tables.py, duplicates are only planned once
+
+    Returns
+    -------
+    list[dict]
+        Tasks with the keys 'tables', the table functions in the task, and
+        'questions', the question of each table if the task is a batch else None
+    """
+    tasks = []
+    batches = {}
+    for table in dict.fromkeys(all_tables):
+        spec = get_table_spec(table)
+        key = get_fuse_key(spec)
+
+        if key is None:
+            tasks.append({"tables": [table], "questions": None})
+        elif key in batches:
+            batches[key]["tables"].append(table)
+            batches[key]["questions"].append(spec["question"])
+        else:
+            batches[key] = {"tables": [table], "questions": [spec["question"]],
+                            "key": key}
+            tasks.append(batches[key])
+
+    # A batch of a single table is just a table
+    for task in tasks:
+        if task["questions"] is not None and len(task["tables"]) == 1:
+            task["questions"] = None
+
+    return tasks
+
+
+def in_store(task, store):
+    """Whether every table in a task can be created from a totals store.
+
+    Parameters
+    ----------
+    task: dict
+        A task from plan_tables
+    store: dict
+        A totals store from processing_store, or None if there is no store
+
+    Returns
+    -------
+    bool
+    """
+    return store is not None and all(
+        processing_store.in_store(store, get_table_spec(table))
+        for table in task["tables"]
+    )
+
+
+def run_task(task, df, store=None, teacher_table=False):
+    """Create the outputs of every table in a task.
+
+    Parameters
+    ----------
+    task: dict
+        A task from plan_tables
+    df: pandas.DataFrame
+        The data to create the tables from
+    store: dict
+        Optional totals store from processing_store, if it has the totals of
+        every table in the task they are created from the store instead of df
+    teacher_table: bool
+        Whether the tables use the teacher data, which sets the replicate factors
+        used for their standard errors
+
+    Returns
+    -------
+    dict
+        Output dataframe for each table function in the task
+    """
+    with replicate_weights.teacher_data(teacher_table):
+        if in_store(task, store):
+            return {
+                table: processing_store.create_table_from_store(
+                    store, get_table_spec(table)
+                )
+                for table in task["tables"]
+            }
+
+        if task["questions"] is None:
+            table = task["tables"][0]
+            return {table: table(df)}
+
+        breakdowns, filter_condition, create_SE = task["key"]
+        logging.info(
+            f"Creating {len(task['tables'])} tables in one pass, for questions "
+            f"{task['questions']}"
+        )
+        outputs = processing.create_breakdown_single_batch(
+            df,
+            list(breakdowns),
+            task["questions"],
+            filter_condition,
+            create_SE=create_SE,
+        )
+
+    return {
+        table: outputs[question]
+        for table, question in zip(task["tables"], task["questions"])
+    }
+
+
+def get_chapter_tasks(chapters, teacher_table):
+    """Get the planned tasks for every table in a set of chapters, that use
+    either the pupil or teacher data.
+
+    Parameters
+    ----------
+    chapters: list[dict]
+        Chapters as defined in chapters.get_chapters
+    teacher_table: bool
+        Whether to get the tasks for the teacher tables or the pupil tables
+
+    Returns
+    -------
+    list[dict]
+        Tasks, in the order they first appear in the chapters
+    """
+    all_tables = [
+        table
+        for chapter in chapters
+        for sheet in chapter["sheets"]
+        if sheet.get("teacher_table", False) == teacher_table
+        for table in sheet["content"]
+    ]
+
+    if param.FUSE_TABLES:
+        return plan_tables(all_tables)
+    else:
+        return [{"tables": [table], "questions": None}
+                for table in dict.fromkeys(all_tables)]
+
+
+def get_data_name(teacher_table):
+    """Get the name of the data used by the pupil or teacher tables.
+
+    Parameters
+    ----------
+    teacher_table: bool
+        Whether the tables use the teacher data
+
+    Returns
+    -------
+    str
+    """
+    return "teacher" if teacher_table else "pupil"
+
+
+def get_task_name(task, teacher_table):
+    """Get the name used to record the timing of a task.
+
+    Parameters
+    ----------
+    task: dict
+        A task from plan_tables
+    teacher_table: bool
+        Whether the task uses the teacher data
+
+    Returns
+    -------
+    str
+    """
+    data_name = get_data_name(teacher_table)
+    return f"{data_name}:" + "+".join(table.__name__ for table in task["tables"])
+
+
+def load_timings(timings_path):
+    """Load the time taken by each task in previous runs.
+
+    Parameters
+    ----------
+    timings_path: Path
+        Location of the json file of timings
+
+    Returns
+    -------
+    dict
+        Seconds taken for each task name, empty if there is no history
+    """
+    try:
+        with open(timings_path) as timings_file:
+            return json.load(timings_file)
+    except (OSError, ValueError):
+        logging.info(f"No table timings found at {timings_path}")
+        return {}
+
+
+def save_timings(timings, timings_path):
+    """Save the time taken by each task, for use in later runs.
+
+    Parameters
+    ----------
+    timings: dict
+        Seconds taken for each task name
+    timings_path: Path
+        Location of the json file of timings
+    """
+    try:
+        with open(timings_path, "w") as timings_file:
+            json.dump(timings, timings_file, indent=4, sort_keys=True)
+    except OSError:
+        logging.warning(f"Unable to save table timings to {timings_path}")
+
+
+def estimate_costs(task_names, timings):
+    """Estimate the seconds each task will take, from the timings of previous runs.
+    Tasks with no history are given the mean of the known timings.
+
+    Parameters
+    ----------
+    task_names: list[str]
+    timings: dict
+        Seconds taken for each task name
+
+    Returns
+    -------
+    list[float]
+    """
+    known = [timings[name] for name in task_names if name in timings]
+    default = sum(known) / len(known) if known else 1.0
+
+    return [timings.get(name, default) for name in task_names]
+
+
+def _log_progress(costs, done, start_time):
+    """Log the progress through the tasks, estimating the time remaining from the
+    time taken so far and the estimated cost of the remaining tasks.
+
+    Parameters
+    ----------
+    costs: list[float]
+        Estimated cost of every task
+    done: list[int]
+        Indexes of the tasks that are complete
+    start_time: float
+        Time the tasks were started, from timeit.default_timer
+    """
+    done_cost = sum(costs[i] for i in done)
+    remaining_cost = sum(costs) - done_cost
+    elapsed = timeit.default_timer() - start_time
+
+    eta = elapsed * remaining_cost / done_cost if done_cost else None
+    logger_config.log_progress(len(done), len(costs), eta)
+
+
+def _spec_names(value):
+    """Get every name in the arguments of a table spec, including the words in
+    strings such as filter conditions"""
+    if isinstance(value, str):
+        return re.findall(r"\w+", value)
+    if isinstance(value, dict):
+        return [name for item in value.items() for name in _spec_names(item)]
+    if isinstance(value, (list, tuple)):
+        return [name for item in value for name in _spec_names(item)]
+    return []
+
+
+def get_task_columns(task, columns):
+    """Get the columns of the data used by a task, which are the columns named in
+    the arguments of its tables (including in their filters), and the weighting,
+    strata and PSU columns.
+
+    Parameters
+    ----------
+    task: dict
+        A task from plan_tables
+    columns: list[str]
+        The columns of the data
+
+    Returns
+    -------
+    list[str] or None
+        The columns used, in the order of the data, or None if the arguments of a
+        table can't be recorded, as it isn't a table function from tables.py
+    """
+    names = {param.WEIGHTING_VAR, param.STRATA, param.PSU}
+    for table in task["tables"]:
+        if getattr(table, "__module__", None) != tables.__name__:
+            return None
+        names.update(_spec_names(get_table_spec(table)))
+
+    return [column for column in columns if column in names]
+
+
+# Data used by each worker process, loaded once when the worker starts
+_WORKER_DATA = {}
+
+
+def _init_worker(data_paths):
+    """Memory map the shared pupil and teacher data in a worker process. The data
+    is kept as Arrow tables backed by the files, so isn't copied into each worker.
+
+    Parameters
+    ----------
+    data_paths: dict
+        Path of the feather file for each teacher_table flag
+    """
+    for teacher_table, path in data_paths.items():
+        _WORKER_DATA[teacher_table] = feather.read_table(path, memory_map=True)
+
+
+def _run_timed_task(task, df, store=None, teacher_table=False):
+    """Run a task, returning its outputs and the seconds it took"""
+    start_time = timeit.default_timer()
+    outputs = run_task(task, df, store, teacher_table)
+
+    return outputs, timeit.default_timer() - start_time
+
+
+def _run_worker_task(task, teacher_table):
+    """Run a task in a worker process, using the data loaded by _init_worker. Only
+    the columns the task uses are converted to a dataframe"""
+    data = _WORKER_DATA[teacher_table]
+    columns = get_task_columns(task, data.column_names)
+    if columns is not None:
+        data = data.select(columns)
+
+    return _run_timed_task(task, data.to_pandas(), teacher_table=teacher_table)
+
+
+def create_chapter_tables(
+    chapters,
+    df,
+    df_teacher,
+    workers=param.WORKERS,
+    timings_path=param.TIMINGS_FILE,
+    stores=None,
+):
+    """Plan and create the outputs of every table in a set of chapters.
+
+    If workers is more than 1, the tasks are ran concurrently in a pool of
+    processes. The data is shared with the processes by writing it once to a
+    feather file that each process memory maps, and each task only converts the
+    columns it uses to a dataframe. The tasks expected to take the longest, based
+    on previous runs, are started first so that workers are not left idle at the
+    end. The outputs are collected in the planned order, so are the same however
+    many workers are used.
+
+    If totals stores are given, the tasks with every table in the store are
+    created from the store in this process, without using the data. The data can
+    then be None if every task is in the stores.
+
+    Parameters
+    ----------
+    chapters: list[dict]
+        Chapters as defined in chapters.get_chapters
+    df: pandas.DataFrame
+        Pupil data, used for all sheets unless the sheet is a teacher table, or
+        None if every pupil table is in the stores
+    df_teacher: pandas.DataFrame
+        Teacher data, or None if every teacher table is in the stores
+    workers: int
+        The number of processes to create the tables with, defaults to value in
+        parameters.py
+    timings_path: Path
+        Location of the json file used to store the time taken by each task,
+        defaults to value in parameters.py
+    stores: dict
+        Optional totals store for each teacher_table flag, as returned by
+        create_chapter_stores
+
+    Returns
+    -------
+    dict
+        Output dataframe for each (teacher_table, table function) pair, where
+        teacher_table is the flag set for the sheet in chapters
+    """
+    data = {False: df, True: df_teacher}
+    all_tasks = [
+        (task, teacher_table)
+        for teacher_table in data
+        for task in get_chapter_tasks(chapters, teacher_table)
+    ]
+
+    timings = load_timings(timings_path)
+    task_names = [get_task_name(*task) for task in all_tasks]
+    costs = estimate_costs(task_names, timings)
+
+    results = [None] * len(all_tasks)
+    done = []
+    start_time = timeit.default_timer()
+
+    # Tasks that can be created from the totals stores don't need the data. Their
+    # timings aren't saved, as they would be used for tasks that use the data
+    stores = stores or {}
+    data_tasks = []
+    for i, (task, teacher_table) in enumerate(all_tasks):
+        store = stores.get(teacher_table)
+        if in_store(task, store):
+            results[i] = run_task(task, None, store, teacher_table)
+            done.append(i)
+            _log_progress(costs, done, start_time)
+        else:
+            data_tasks.append(i)
+
+    missing = [task_names[i] for i in data_tasks if data[all_tasks[i][1]] is None]
+    if missing:
+        raise ValueError(
+            f"Tasks {missing} aren't in the totals store, and the data to create "
+            "them from wasn't given"
+        )
+
+    if workers <= 1 or not data_tasks:
+        for i in data_tasks:
+            task, teacher_table = all_tasks[i]
+            results[i], timings[task_names[i]] = _run_timed_task(
+                task, data[teacher_table], teacher_table=teacher_table
+            )
+            done.append(i)
+            _log_progress(costs, done, start_time)
+    else:
+        logging.info(f"Creating {len(data_tasks)} table tasks with {workers} workers")
+
+        # Start the longest tasks first
+        schedule = sorted(data_tasks, key=lambda i: costs[i], reverse=True)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            data_paths = {}
+            for teacher_table, data_df in data.items():
+                # The data isn't needed, so may not be given, without teacher sheets
+                # or when all of its tables are in the stores
+                if data_df is None:
+                    continue
+                data_paths[teacher_table] = (
+                    Path(temp_dir) / f"data_{teacher_table}.feather"
+                )
+                # Feather needs a default index, which the tables don't use
+                feather.write_feather(
+                    data_df.reset_index(drop=True),
+                    data_paths[teacher_table],
+                    compression="uncompressed",
+                )
+
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(data_paths,),
+            ) as executor:
+                futures = {
+                    executor.submit(_run_worker_task, *all_tasks[i]): i
+                    for i in schedule
+                }
+
+                for future in as_completed(futures):
+                    i = futures[future]
+                    results[i], timings[task_names[i]] = future.result()
+                    done.append(i)
+                    _log_progress(costs, done, start_time)
+
+    save_timings(timings, timings_path)
+
+    # Collect in the planned order, so the output order is deterministic
+    outputs = {}
+    for (task, teacher_table), task_outputs in zip(all_tasks, results):
+        for table, output in task_outputs.items():
+            outputs[(teacher_table, table)] = output
+
+    return outputs
+
+
+def create_chapter_stores(chapters, df, df_teacher):
+    """Create the totals store of the pupil tables and the teacher tables in a set
+    of chapters, see processing_store.
+
+    Parameters
+    ----------
+    chapters: list[dict]
+        Chapters as defined in chapters.get_chapters
+    df: pandas.DataFrame
+        Pupil data
+    df_teacher: pandas.DataFrame
+        Teacher data
+
+    Returns
+    -------
+    dict
+        Totals store for each teacher_table flag
+    """
+    data = {False: df, True: df_teacher}
+
+    return {
+        teacher_table: processing_store.create_store(
+            [
+                get_table_spec(table)
+                for task in get_chapter_tasks(chapters, teacher_table)
+                for table in task["tables"]
+            ],
+            data_df,
+        )
+        for teacher_table, data_df in data.items()
+    }
+
+
+def get_store_fingerprints(
+    pupil_path=param.PUPIL_DATA_PATH, teacher_path=param.TEACHER_DATA_PATH
+):
+    """Get the fingerprint of the data and parameters of the pupil and teacher
+    stores, see processing_store.get_fingerprint.
+
+    Parameters
+    ----------
+    pupil_path: Path
+        Defaults to value in parameters.py
+    teacher_path: Path
+        Defaults to value in parameters.py
+
+    Returns
+    -------
+    dict
+        Fingerprint for each teacher_table flag
+    """
+    return {
+        False: processing_store.get_fingerprint(pupil_path),
+        True: processing_store.get_fingerprint(teacher_path),
+    }
+
+
+def save_chapter_stores(stores, directory=param.TOTALS_STORE_DIR, fingerprints=None):
+    """Save the stores from create_chapter_stores, in a folder for each data.
+
+    Parameters
+    ----------
+    stores: dict
+        Totals store for each teacher_table flag
+    directory: Path
+        Folder to save the stores to, defaults to value in parameters.py
+    fingerprints: dict
+        Optional fingerprint for each teacher_table flag, as returned by
+        get_store_fingerprints
+    """
+    fingerprints = fingerprints or {}
+    for teacher_table, store in stores.items():
+        processing_store.save_store(
+            store,
+            Path(directory) / get_data_name(teacher_table),
+            fingerprints.get(teacher_table),
+        )
+
+
+def load_chapter_stores(directory=param.TOTALS_STORE_DIR, fingerprints=None):
+    """Load the stores saved by save_chapter_stores.
+
+    Parameters
+    ----------
+    directory: Path
+        Folder the stores were saved to, defaults to value in parameters.py
+    fingerprints: dict
+        Optional fingerprint for each teacher_table flag, as returned by
+        get_store_fingerprints, that the saved stores must match
+
+    Returns
+    -------
+    dict
+        Totals store for each teacher_table flag
+    """
+    fingerprints = fingerprints or {}
+
+    return {
+        teacher_table: processing_store.load_store(
+            Path(directory) / get_data_name(teacher_table),
+            fingerprints.get(teacher_table),
+        )
+        for teacher_table in [False, True]
+    }
+
+
+def in_chapter_stores(chapters, stores):
+    """Whether every table in a set of chapters can be created from the stores,
+    so the data isn't needed.
+
+    Parameters
+    ----------
+    chapters: list[dict]
+        Chapters as defined in chapters.get_chapters
+    stores: dict
+        Totals store for each teacher_table flag
+
+    Returns
+    -------
+    bool
+    """
+    return all(
+        in_store(task, stores.get(teacher_table))
+        for teacher_table in [False, True]
+        for task in get_chapter_tasks(chapters, teacher_table)
+    )
@@ -0,0 +1,359 @@
+"""
+Stores the weighted totals of each PSU that the tables are created from.
+
+Every count, percentage and Taylor linearised standard error in a table created by
+create_breakdown_single can be derived from the weighted total and the number of
+pupils giving each response, in each stratum, PSU and breakdown group, after the
+table filter is applied. The store computes these totals once for every group of
+tables sharing breakdowns and a filter, and saves them to Parquet. The tables can
+then be created from the store rather than the pupil data, so rebuilding them after
+a formatting or layout change doesn't need the pupil data.
+
+Each file of the store is saved with a fingerprint of the data, parameters and code
+it was created from, and loading it with a different fingerprint fails, so a store
+created from last year's data, other exclusions or other derivations isn't silently
+reused.
+
+The R survey designs need a row for each pupil, so when SE_ENGINE is "R" the tables
+with standard errors are created from the data rather than the store.
+"""
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import sdd_code.utilities.parameters as param
+from sdd_code.utilities.processing import processing
+
+# Name of the column with the number of pupils in each row of the totals
+COUNT_COL = "Count"
+
+# Key of the store metadata in the schema of each Parquet file
+METADATA_KEY = b"sdd_totals"
+
+# Parameters that change the data the totals are created from, or the tables
+# created from them
+FINGERPRINT_PARAMS = [
+    "YEAR",
+    "DROP_COLUMNS",
+    "INCLUDE_DUMMY_DRUG",
+    "INCLUDE_OUTLIERS",
+    "HIGH_CIG_QUANTITY",
+    "HIGH_ALC_QUANTITY",
+    "HIGH_ALC_DAILY",
+    "SE_ENGINE",
+]
+
+# The source files, relative to the root of the repo, that import, derive and
+# filter the data and create the totals, whose contents are part of the fingerprint
+STORE_SOURCES = [
+    "sdd_code/utilities/data_import.py",
+    "sdd_code/utilities/field_definitions/derivations.py",
+    "sdd_code/utilities/field_definitions/exclusion_flags.py",
+    "sdd_code/utilities/processing/processing.py",
+    "sdd_code/utilities/processing/processing_exclusions.py",
+    "sdd_code/utilities/processing/processing_store.py",
+]
+
+
+def get_fingerprint(data_path):
+    """Get the fingerprint of the data, parameters and code a store is created from,
+    which is the hash of the data file, the hash of the source files in
+    STORE_SOURCES, and the parameters in FINGERPRINT_PARAMS. The data file is
+    hashed rather than the imported data, so a store can be checked without
+    importing the data.
+
+    Parameters
+    ----------
+    data_path: Path
+        The file the data is imported from
+
+    Returns
+    -------
+    dict
+    """
+    data_hash = hashlib.sha1()
+    with open(data_path, "rb") as data_file:
+        for chunk in iter(lambda: data_file.read(1 << 20), b""):
+            data_hash.update(chunk)
+
+    source_hash = hashlib.sha1()
+    for source in STORE_SOURCES:
+        source_hash.update((param.LOCAL_ROOT / source).read_bytes())
+
+    return {
+        "data": data_hash.hexdigest(),
+        "code": source_hash.hexdigest(),
+        **{name: getattr(param, name) for name in FINGERPRINT_PARAMS},
+    }
+
+
+def get_totals_key(spec):
+    """Get the key of the totals a table can be created from, or None if the table
+    can't be created from the store.
+
+    Parameters
+    ----------
+    spec: dict
+        A table spec, as returned by processing_planner.get_table_spec
+
+    Returns
+    -------
+    tuple or None
+        The breakdowns and filter condition of the table
+    """
+    if spec["engine"] != "create_breakdown_single":
+        return None
+
+    # The R standard errors need the data of each pupil
+    if spec["create_SE"] and param.SE_ENGINE == "R":
+        return None
+
+    breakdowns = spec["breakdowns"] or []
+
+    # The question must not be one of the columns kept alongside it
+    id_cols = {*breakdowns, param.WEIGHTING_VAR, param.STRATA, param.PSU}
+    if spec["question"] in id_cols:
+        return None
+
+    return (tuple(breakdowns), spec["filter_condition"])
+
+
+def create_totals(df, breakdowns, questions, filter_condition):
+    """Create the weighted total and number of pupils giving each response to each
+    question, in each stratum, PSU and breakdown group, for the pupils that pass
+    the filter.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    breakdowns : list[str]
+        Columns used in the breakdowns (e.g. age, gender, etc)
+    questions: list[str]
+        Variable names of the questions (e.g. ["alevr", "dallast5"])
+    filter_condition : str
+        Optional filter as a string, as used by df.query()
+
+    Returns
+    -------
+    dict
+        The entry for the store, with the keys 'breakdowns', 'filter_condition',
+        'questions', the dtype of each question, and 'totals', the dataframe of
+        totals with a 'Question' and 'Response' column
+    """
+    logging.info(
+        f"Creating totals for questions: {questions}, with breakdowns: "
+        f"{breakdowns} and filter: {filter_condition}"
+    )
+
+    # Use dict.fromkeys() in case param.STRATA is in breakdowns, ensure uniqueness
+    id_cols = list(dict.fromkeys([param.STRATA, param.PSU, *breakdowns]))
+    filtered = processing.select_filtered(
+        df,
+        list(dict.fromkeys([*id_cols, param.WEIGHTING_VAR, *questions])),
+        filter_condition,
+    )
+
+    # Stack the valid responses to each question, then total them. Missing
+    # breakdowns are kept, as the pupils are still included in the totals
+    select = processing.stack_questions(
+        filtered, [*id_cols, param.WEIGHTING_VAR], questions
+    )
+    totals = (
+        select.groupby(
+            [*id_cols, "Question", "Response"],
+            sort=False,
+            observed=True,
+            dropna=False,
+        )
+        .agg(**{
+            param.WEIGHTING_VAR: (param.WEIGHTING_VAR, "sum"),
+            COUNT_COL: (param.WEIGHTING_VAR, "count"),
+        })
+        .reset_index()
+    )
+
+    return {
+        "breakdowns": list(breakdowns),
+        "filter_condition": filter_condition,
+        "questions": {question: str(filtered[question].dtype) for question in questions},
+        "totals": totals,
+    }
+
+
+def create_store(specs, df):
+    """Create the totals needed by every table that can be created from the store.
+
+    Parameters
+    ----------
+    specs: list[dict]
+        Table specs, as returned by processing_planner.get_table_spec
+    df : pandas.DataFrame
+        The data to create the totals from
+
+    Returns
+    -------
+    dict
+        The store entry, see create_totals, for each key from get_totals_key
+    """
+    key_questions = {}
+    for spec in specs:
+        key = get_totals_key(spec)
+        if key is not None:
+            key_questions.setdefault(key, {})[spec["question"]] = None
+
+    return {
+        key: create_totals(df, list(key[0]), list(questions), key[1])
+        for key, questions in key_questions.items()
+    }
+
+
+def in_store(store, spec):
+    """Whether a table can be created from the store.
+
+    Parameters
+    ----------
+    store: dict
+        As returned by create_store or load_store
+    spec: dict
+        A table spec, as returned by processing_planner.get_table_spec
+
+    Returns
+    -------
+    bool
+    """
+    key = get_totals_key(spec)
+
+    return key in store and spec["question"] in store[key]["questions"]
+
+
+def create_table_from_store(store, spec):
+    """Create a table from the store, with the same output as
+    create_breakdown_single using the pupil data.
+
+    Parameters
+    ----------
+    store: dict
+        As returned by create_store or load_store
+    spec: dict
+        A table spec, as returned by processing_planner.get_table_spec, for a
+        table in the store
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    entry = store[get_totals_key(spec)]
+    question = spec["question"]
+    totals = entry["totals"]
+
+    logging.debug(
+        f"Creating table for question: {question} from the store, with breakdowns:"
+        f" {entry['breakdowns']}, subgroup: {spec['subgroup']} and filter:"
+        f" {entry['filter_condition']}"
+    )
+
+    select = (
+        totals.loc[
+            (totals["Question"] == question).to_numpy(),
+            [column for column in totals.columns if column != "Question"],
+        ]
+        .rename(columns={"Response": question})
+        .astype({question: entry["questions"][question]})
+    )
+
+    return processing.summarise_single(
+        select,
+        list(entry["breakdowns"]),
+        question,
+        spec["subgroup"],
+        spec["create_SE"],
+        counts=COUNT_COL,
+    )
+
+
+def get_store_path(directory, key):
+    """Get the Parquet file used to save the totals of a key.
+
+    Parameters
+    ----------
+    directory: Path
+    key: tuple
+        As returned by get_totals_key
+
+    Returns
+    -------
+    Path
+    """
+    key_hash = hashlib.sha1(json.dumps(key).encode()).hexdigest()[:16]
+
+    return Path(directory) / f"totals_{key_hash}.parquet"
+
+
+def save_store(store, directory, fingerprint=None):
+    """Save the store to a Parquet file for each key, with the breakdowns, filter
+    and questions of the key, and the fingerprint, saved in the file's metadata.
+
+    Parameters
+    ----------
+    store: dict
+        As returned by create_store
+    directory: Path
+        Folder to save the files to, which is created if needed
+    fingerprint: dict
+        Optional fingerprint of the data and parameters, as returned by
+        get_fingerprint
+    """
+    logging.info(f"Saving totals store to {directory}")
+    Path(directory).mkdir(parents=True, exist_ok=True)
+
+    for key, entry in store.items():
+        table = pa.Table.from_pandas(entry["totals"], preserve_index=False)
+        metadata = {name: value for name, value in entry.items() if name != "totals"}
+        metadata["fingerprint"] = fingerprint
+        table = table.replace_schema_metadata({
+            **table.schema.metadata,
+            METADATA_KEY: json.dumps(metadata).encode(),
+        })
+        pq.write_table(table, get_store_path(directory, key))
+
+
+def load_store(directory, fingerprint=None):
+    """Load a store saved by save_store.
+
+    Parameters
+    ----------
+    directory: Path
+    fingerprint: dict
+        Optional fingerprint of the current data and parameters, as returned by
+        get_fingerprint, which must match the one the store was saved with
+
+    Returns
+    -------
+    dict
+        As returned by create_store
+    """
+    logging.info(f"Loading totals store from {directory}")
+
+    # Compare as saved, e.g. with any tuples as lists
+    if fingerprint is not None:
+        fingerprint = json.loads(json.dumps(fingerprint))
+
+    store = {}
+    for path in sorted(Path(directory).glob("totals_*.parquet")):
+        table = pq.read_table(path)
+        entry = json.loads(table.schema.metadata[METADATA_KEY])
+        if fingerprint is not None and entry.pop("fingerprint", None) != fingerprint:
+            raise ValueError(
+                f"Totals store {path} was created from different data or "
+                "parameters, create it again with TOTALS_STORE set to 'create'"
+            )
+        entry.pop("fingerprint", None)
+        entry["totals"] = table.to_pandas()
+
+        store[(tuple(entry["breakdowns"]), entry["filter_condition"])] = entry
+
+    return store
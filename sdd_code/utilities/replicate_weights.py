@@ -0,0 +1,391 @@
+"""
+Replicate weight standard errors of weighted percentages.
+
+A replicate design estimates each percentage again with a set of replicate
+weights, and its variance is the spread of these replicate estimates around the
+full sample estimate. The replicate weights of a pupil are their weight times a
+factor of their PSU, so the weights are stored as a (PSUs x replicates) matrix of
+factors. Multiplying the weighted totals of each PSU by this matrix gives the
+totals of every cell of a table under every replicate in a single product, the
+same as multiplying the indicator columns by the (rows x replicates) matrix of
+replicate weights.
+
+Two methods are supported, both stratified by STRATA with PSUs nested in strata:
+    "JKn": a delete one PSU jackknife, with a replicate for each PSU in a stratum
+        with more than one PSU, as JKn in the R survey package
+    "bootstrap": the Rao-Wu rescaled bootstrap, sampling n - 1 of the n PSUs in
+        each stratum with replacement for each replicate
+Single PSU strata are certainty units, and don't contribute to the variance, as
+in the Taylor linearised standard errors in stats.py.
+
+The factors are created once from each of the filtered pupil and teacher data, as
+the teacher data has its own schools, and saved with the data asset so every table,
+and every worker process, uses the same replicates. The tables created inside
+teacher_data use the teacher factors, and other tables the pupil factors.
+"""
+import json
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from scipy import sparse
+
+import sdd_code.utilities.parameters as param
+from sdd_code.utilities import stats
+
+# Key of the replicate metadata in the schema of the Parquet file
+METADATA_KEY = b"sdd_replicates"
+
+# Replicate factors loaded by load_replicate_factors, with the modified time of
+# their file, by path
+_LOADED = {}
+
+# Whether the tables being created use the teacher data, set by teacher_data
+_TEACHER_TABLE = False
+
+
+@contextmanager
+def teacher_data(teacher_table=True):
+    """Context manager that sets whether the tables created inside it use the
+    teacher data, and so the teacher replicate factors.
+
+    Parameters
+    ----------
+    teacher_table: bool
+    """
+    global _TEACHER_TABLE
+
+    previous = _TEACHER_TABLE
+    _TEACHER_TABLE = teacher_table
+    try:
+        yield
+    finally:
+        _TEACHER_TABLE = previous
+
+
+def get_replicate_weights_file(teacher_table=None):
+    """Get the file of the replicate factors of the pupil or teacher data.
+
+    Parameters
+    ----------
+    teacher_table: bool
+        Whether to get the file of the teacher data, defaults to the data set by
+        teacher_data
+
+    Returns
+    -------
+    Path
+        The file set in parameters.py
+    """
+    if teacher_table is None:
+        teacher_table = _TEACHER_TABLE
+
+    if teacher_table:
+        return param.TEACHER_REPLICATE_WEIGHTS_FILE
+    return param.REPLICATE_WEIGHTS_FILE
+
+
+def create_replicate_factors(
+    df,
+    method=param.REPLICATE_METHOD,
+    n_replicates=param.REPLICATES,
+    seed=param.REPLICATE_SEED,
+    psu=param.PSU,
+    strata=param.STRATA,
+):
+    """Create the replicate factors of each PSU of a stratified cluster sample.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    method: str
+        "JKn" or "bootstrap", defaults to value in parameters.py
+    n_replicates: int
+        The number of bootstrap replicates, defaults to value in parameters.py.
+        The jackknife has a replicate for each PSU in a stratum with more than one
+    seed: int
+        Seed of the bootstrap samples, defaults to value in parameters.py
+    psu: str
+        The name of the column containing PSUs
+    strata: str
+        The name of the column containing strata
+
+    Returns
+    -------
+    dict
+        The strata and PSU of each row of the factors ('design'), the
+        (PSUs x replicates) factors ('factors'), the multiplier of each
+        replicate's squared deviation in the variance ('scale'), and the method
+    """
+    design = (
+        df[[strata, psu]]
+        .drop_duplicates()
+        .sort_values([strata, psu])
+        .reset_index(drop=True)
+    )
+    psu_strata = pd.factorize(design[strata], sort=True)[0]
+
+    columns = []
+    scale = []
+    if method == "JKn":
+        for stratum in range(psu_strata.max() + 1):
+            stratum_psus = np.flatnonzero(psu_strata == stratum)
+            n_psus = len(stratum_psus)
+            if n_psus < 2:
+                continue
+            for dropped in stratum_psus:
+                column = np.ones(len(design))
+                column[stratum_psus] = n_psus / (n_psus - 1)
+                column[dropped] = 0
+                columns.append(column)
+                scale.append((n_psus - 1) / n_psus)
+        factors = np.column_stack(columns) if columns else np.ones((len(design), 0))
+        scale = np.asarray(scale)
+    elif method == "bootstrap":
+        rng = np.random.default_rng(seed)
+        factors = np.ones((len(design), n_replicates))
+        for stratum in range(psu_strata.max() + 1):
+            stratum_psus = np.flatnonzero(psu_strata == stratum)
+            n_psus = len(stratum_psus)
+            if n_psus < 2:
+                continue
+            # The number of times each PSU is sampled, in each replicate
+            draws = rng.integers(0, n_psus, size=(n_replicates, n_psus - 1))
+            sampled = (draws[:, :, None] == np.arange(n_psus)).sum(axis=1)
+            factors[stratum_psus] = sampled.T * n_psus / (n_psus - 1)
+        scale = np.full(n_replicates, 1 / n_replicates)
+    else:
+        raise ValueError(f"Unknown replicate method: {method}")
+
+    logging.info(
+        f"Created {factors.shape[1]} {method} replicates of {len(design)} PSUs"
+    )
+
+    return {"design": design, "factors": factors, "scale": scale, "method": method}
+
+
+def get_psu_index(df, replicates, psu=param.PSU, strata=param.STRATA):
+    """Get the row of the replicate factors of each row's PSU.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    replicates: dict
+        As returned by create_replicate_factors
+    psu: str
+    strata: str
+
+    Returns
+    -------
+    np.ndarray
+    """
+    design = replicates["design"]
+    index = pd.MultiIndex.from_frame(design).get_indexer(
+        pd.MultiIndex.from_arrays(
+            [df[strata].to_numpy(), df[psu].to_numpy()], names=list(design.columns)
+        )
+    )
+    if (index < 0).any():
+        raise ValueError("Data has PSUs that aren't in the replicate factors")
+
+    return index
+
+
+def create_replicate_weights(
+    df, replicates, weights=param.WEIGHTING_VAR, psu=param.PSU, strata=param.STRATA
+):
+    """Create the (rows x replicates) matrix of replicate weights of the data, e.g.
+    to use the replicates in other software.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    replicates: dict
+        As returned by create_replicate_factors
+    weights : str
+    psu: str
+    strata: str
+
+    Returns
+    -------
+    np.ndarray
+    """
+    row_factors = replicates["factors"][get_psu_index(df, replicates, psu, strata)]
+
+    return df[weights].to_numpy(dtype=float)[:, None] * row_factors
+
+
+def save_replicate_factors(replicates, path=None):
+    """Save the replicate factors to a Parquet file, with a column for each
+    replicate after the strata and PSU, and the method and scale in the file's
+    metadata.
+
+    Parameters
+    ----------
+    replicates: dict
+        As returned by create_replicate_factors
+    path: Path
+        Defaults to the file from get_replicate_weights_file
+    """
+    if path is None:
+        path = get_replicate_weights_file()
+    logging.info(f"Saving replicate factors to {path}")
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+    factors = pd.DataFrame(
+        replicates["factors"],
+        columns=[f"rep_{i + 1}" for i in range(replicates["factors"].shape[1])],
+    )
+    table = pa.Table.from_pandas(
+        pd.concat([replicates["design"], factors], axis=1), preserve_index=False
+    )
+    metadata = {
+        "method": replicates["method"],
+        "scale": replicates["scale"].tolist(),
+        "design_columns": list(replicates["design"].columns),
+    }
+    table = table.replace_schema_metadata({
+        **table.schema.metadata,
+        METADATA_KEY: json.dumps(metadata).encode(),
+    })
+    pq.write_table(table, path)
+
+
+def load_replicate_factors(path=None):
+    """Load the replicate factors saved by save_replicate_factors. They are only
+    read once in each process, unless the file changes.
+
+    Parameters
+    ----------
+    path: Path
+        Defaults to the file from get_replicate_weights_file
+
+    Returns
+    -------
+    dict
+        As returned by create_replicate_factors
+    """
+    if path is None:
+        path = get_replicate_weights_file()
+
+    modified = Path(path).stat().st_mtime_ns
+    loaded = _LOADED.get(str(path))
+    if loaded is None or loaded[0] != modified:
+        logging.info(f"Loading replicate factors from {path}")
+        table = pq.read_table(path)
+        metadata = json.loads(table.schema.metadata[METADATA_KEY])
+        df = table.to_pandas()
+
+        design_columns = metadata["design_columns"]
+        _LOADED[str(path)] = (modified, {
+            "design": df[design_columns],
+            "factors": df.drop(columns=design_columns).to_numpy(dtype=float),
+            "scale": np.asarray(metadata["scale"], dtype=float),
+            "method": metadata["method"],
+        })
+
+    return _LOADED[str(path)][1]
+
+
+def survey_perc_proportions(
+    df,
+    question,
+    by,
+    psu=param.PSU,
+    strata=param.STRATA,
+    weights=param.WEIGHTING_VAR,
+    keys=None,
+    subgroup=None,
+    domains=None,
+    counts=None,
+    replicates=None,
+):
+    """
+    Calculate a weighted percentage of a variable, with replicate weight standard
+    errors. Gives the same output as stats.survey_perc_proportions, which uses
+    Taylor linearisation.
+
+    The replicate totals of every cell and domain are the product of their
+    weighted totals in each PSU with the replicate factors, and the variance of
+    each proportion is the scaled sum of the squared differences between its
+    replicate estimates and the full sample estimate. The confidence intervals use
+    the same design degrees of freedom as the Taylor standard errors.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    question : str
+    by: list[str]
+    psu: str
+    strata: str
+    weights : str
+    keys: list[str]
+    subgroup: dictionary
+    domains: pd.DataFrame
+    counts: str
+        See stats.survey_perc_proportions
+    replicates: dict
+        Optional replicate factors, as returned by create_replicate_factors,
+        defaults to those saved for the pupil or teacher data, see teacher_data
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+    keys = list(keys or [])
+    columns = [*keys, *by, question, "R_Percentage", "std_err", "lower_ci",
+               "upper_ci", "deff"]
+    if replicates is None:
+        replicates = load_replicate_factors()
+
+    cells = stats.create_proportion_cells(df, question, by, keys, subgroup, domains)
+    if cells is None:
+        return pd.DataFrame(columns=columns)
+
+    n_rows = len(df)
+    n_cells = cells["n_cells"]
+    row_weights = df[weights].to_numpy(dtype=float)
+
+    # Weighted totals of every cell and domain in each PSU
+    design = stats.create_psu_design(df, cells["key_codes"], cells["n_keys"], psu, strata)
+    n_psus = len(design["psu_first"])
+    psu_weights = sparse.csr_matrix(
+        (row_weights, (design["psu_codes"], np.arange(n_rows))), shape=(n_psus, n_rows)
+    )
+    psu_totals = (psu_weights @ cells["indicators"]).tocsc()
+
+    totals = np.asarray(psu_totals.sum(axis=0)).ravel()
+    proportion = totals[:n_cells] / totals[n_cells:][cells["cell_domains"]]
+
+    # Totals under every replicate, as (cells and domains x replicates)
+    psu_factors = replicates["factors"][
+        get_psu_index(df.iloc[design["psu_first"]], replicates, psu, strata)
+    ]
+    replicate_totals = np.asarray(psu_totals.T @ psu_factors)
+
+    # A replicate that drops every PSU of a domain has no estimate for it, so uses
+    # the full sample estimate, as in the R survey package
+    replicate_denominator = replicate_totals[n_cells:][cells["cell_domains"]]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        replicate_proportion = np.where(
+            replicate_denominator == 0,
+            proportion[:, None],
+            replicate_totals[:n_cells] / replicate_denominator,
+        )
+    variance = (replicate_proportion - proportion[:, None]) ** 2 @ replicates["scale"]
+    std_err = np.sqrt(variance)
+
+    if counts is None:
+        row_counts = (row_weights != 0).astype(float)
+    else:
+        row_counts = df[counts].to_numpy(dtype=float)
+
+    output = stats.format_proportions(
+        cells, proportion, std_err, design["degrees_freedom"], row_counts
+    )
+
+    return output[columns]
@@ -1,5 +1,11 @@
 """Statistical functions"""
+from itertools import chain, combinations
+from typing import List
+
+import numpy as np
 import pandas as pd
+from scipy import sparse
+from scipy import stats as scipy_stats
 
 # Samplics code is not longer used, so samplics is not required as a dependency
 # so if importing it fails, then just create a dummy class. If this class is
@@ -224,3 +230,568 @@ def weighted_variances(
     )
 
     return variance_estimator
+
+
+def get_breakdown_combinations(breakdowns: List[str]) -> chain:
+    """Get a chain of all breakdown combinations for a list of breakdowns
+
+    Parameters
+    ----------
+        breakdowns: list[str]
+            A list of breakdowns
+
+    Returns
+    -------
+        chain
+    """
+    n_replacements = len(breakdowns) + 1
+    breakdown_combinations = [combinations(breakdowns, n) for n in range(n_replacements)]
+    breakdown_combinations = chain.from_iterable(breakdown_combinations)
+
+    return breakdown_combinations
+
+
+def ci_cutoff(df, lower_ci="lower_ci", upper_ci="upper_ci"):
+    """Fix confidence intervals that go above 100 or below 0.
+
+    Due to the underlying method, a wald confidence interval equal to mu +/- 1.96 * se,
+    some confidence intervals can be outside of what should be statistically possible.
+    This function corrects those.
+
+    Parameters
+    ----------
+        df: pd.DataFrame
+        lower_ci: str
+        upper_ci: str
+
+    Returns
+    -------
+        pd.DataFrame
+    """
+
+    df.loc[df[lower_ci] < 0, lower_ci] = 0
+    df.loc[df[upper_ci] > 100, upper_ci] = 100
+
+    return df
+
+
+def add_domain_flags(df, by, domains=None, keys=()):
+    """Add a column to df for each combination of the breakdowns (in the order of
+    get_breakdown_combinations), flagging the rows in the domains to estimate for
+    that combination. These are passed to the R functions as estimate, or used
+    by survey_perc_proportions, so that the other domains are skipped.
+
+    Parameters
+    ----------
+        df: pd.DataFrame
+        by: list[str]
+            The subpopulations to group statistics by
+        domains: pd.DataFrame
+            The domains to estimate, with the keys and by columns, where a by
+            column equal to param.TOT_CODE is totalled. If None, all domains are
+            estimated
+        keys: list[str]
+            Optional columns that are never totalled
+
+    Returns
+    -------
+        list
+            The name of the flag column for each combination of the breakdowns,
+            or None for each if all domains are estimated
+    """
+    by_combinations = list(get_breakdown_combinations(by))
+    if domains is None:
+        return [None] * len(by_combinations)
+
+    flag_cols = []
+    for i, by_subset in enumerate(by_combinations):
+        not_in_subset = [col for col in by if col not in by_subset]
+        in_subset = (
+            (domains[not_in_subset] == param.TOT_CODE).all(axis=1)
+            & (domains[list(by_subset)] != param.TOT_CODE).all(axis=1)
+        )
+
+        domain_cols = [*keys, *by_subset]
+        flag_col = f"estimate_{i}"
+        if domain_cols:
+            df[flag_col] = pd.MultiIndex.from_frame(df[domain_cols]).isin(
+                pd.MultiIndex.from_frame(domains.loc[in_subset, domain_cols])
+            )
+        else:
+            df[flag_col] = np.full(len(df), in_subset.any())
+
+        flag_cols.append(flag_col)
+
+    return flag_cols
+
+
+def _factorize_arrays(arrays, n_rows, sort=False):
+    """Code each distinct combination of values in the arrays, with a single code
+    if there are no arrays.
+
+    Parameters
+    ----------
+        arrays: list[np.ndarray]
+            Arrays of equal length n_rows
+        n_rows: int
+        sort: bool
+            If True the codes are in the sorted order of the combinations, else
+            in order of first appearance
+
+    Returns
+    -------
+        np.ndarray, np.ndarray
+            The code of each row, and the first row of each code
+    """
+    # Combine the codes of each array, which keeps the sorted order
+    codes = np.zeros(n_rows, dtype=np.int64)
+    for array in arrays:
+        array_codes, uniques = pd.factorize(array, sort=sort)
+        codes = codes * len(uniques) + array_codes
+
+    codes = pd.factorize(codes, sort=sort)[0]
+    first = np.flatnonzero(~pd.Series(codes).duplicated().to_numpy())
+    first = first[np.argsort(codes[first])]
+
+    return codes, first
+
+
+def create_proportion_cells(df, question, by, keys=(), subgroup=None, domains=None):
+    """Create the cells of a table of weighted percentages, a cell for each response
+    (and subgroup) in each domain of every key and combination of breakdowns, and
+    a sparse indicator matrix of the cells and domains of each row.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    question : str
+    by: list[str]
+    keys: list[str]
+    subgroup: dictionary
+    domains: pd.DataFrame
+        See survey_perc_proportions
+
+    Returns
+    -------
+    dict or None
+        The indicators of each row's cells followed by its domains ('indicators'),
+        the number of cells ('n_cells'), the domain and key of each cell
+        ('cell_domains', 'cell_keys'), the key of each row and number of keys
+        ('key_codes', 'n_keys'), the rows and domain of each row in a domain
+        ('domain_rows', 'domain_codes'), and the labels of each cell ('output').
+        None if there are no domains to estimate
+    """
+    keys = list(keys)
+    subgroup = subgroup or {}
+
+    # Flag the domains to estimate for each combination of breakdowns
+    flag_cols = add_domain_flags(df, by, domains, keys)
+
+    n_rows = len(df)
+    values = df[question].to_numpy()
+
+    # Each key has its own design, and its own responses in ascending order
+    key_codes, key_first = _factorize_arrays(
+        [df[key].to_numpy() for key in keys], n_rows
+    )
+    level_codes, level_first = _factorize_arrays([key_codes, values], n_rows, sort=True)
+    level_keys = key_codes[level_first]
+    level_values = values[level_first].astype(float)
+    level_start = np.searchsorted(level_keys, np.arange(len(key_first)))
+    n_levels = np.bincount(level_keys, minlength=len(key_first))
+    row_levels = level_codes - level_start[key_codes]
+
+    # Code the domains of every combination of breakdowns, only including the
+    # rows of the domains to estimate
+    domain_rows = []
+    domain_codes = []
+    domain_keys = []
+    domain_labels = []
+    n_domains = 0
+    for by_subset, flag_col in zip(get_breakdown_combinations(by), flag_cols):
+        if flag_col is None:
+            rows = np.arange(n_rows)
+        else:
+            rows = np.flatnonzero(df[flag_col].to_numpy())
+        if not len(rows):
+            continue
+
+        codes, first = _factorize_arrays(
+            [key_codes[rows], *(df[col].to_numpy()[rows] for col in by_subset)],
+            len(rows)
+        )
+        labels = df[[*keys, *by]].iloc[rows[first]].reset_index(drop=True)
+        labels[[col for col in by if col not in by_subset]] = param.TOT_CODE
+
+        domain_rows.append(rows)
+        domain_codes.append(codes + n_domains)
+        domain_keys.append(key_codes[rows[first]])
+        domain_labels.append(labels)
+        n_domains += len(first)
+
+    if not n_domains:
+        return None
+
+    domain_rows = np.concatenate(domain_rows)
+    domain_codes = np.concatenate(domain_codes)
+    domain_keys = np.concatenate(domain_keys)
+
+    # Each domain has a cell for every response to its key, then the subgroups
+    cells_per_domain = n_levels[domain_keys] + len(subgroup)
+    cell_offset = np.concatenate([[0], np.cumsum(cells_per_domain)])
+    n_cells = cell_offset[-1]
+    cell_domains = np.repeat(np.arange(n_domains), cells_per_domain)
+
+    # Indicator of each row's cells, with the domains after the cells to give the
+    # denominators
+    indicator_rows = [domain_rows]
+    indicator_cols = [cell_offset[domain_codes] + row_levels[domain_rows]]
+    for i, subgroup_values in enumerate(subgroup.values()):
+        in_subgroup = np.isin(values[domain_rows], subgroup_values)
+        subgroup_domains = domain_codes[in_subgroup]
+        indicator_rows.append(domain_rows[in_subgroup])
+        indicator_cols.append(
+            cell_offset[subgroup_domains] + n_levels[domain_keys[subgroup_domains]] + i
+        )
+    indicator_rows.append(domain_rows)
+    indicator_cols.append(n_cells + domain_codes)
+
+    indicator_rows = np.concatenate(indicator_rows)
+    indicators = sparse.csr_matrix(
+        (
+            np.ones(len(indicator_rows)),
+            (indicator_rows, np.concatenate(indicator_cols)),
+        ),
+        shape=(n_rows, n_cells + n_domains),
+    )
+
+    # Label each cell with its domain and response, the responses to the
+    # domain's key followed by the subgroup codes
+    subgroup_codes = np.asarray(list(subgroup), dtype=float)
+    key_cell_values = [
+        np.concatenate([level_values[level_keys == key], subgroup_codes])
+        for key in range(len(key_first))
+    ]
+    cell_values = np.concatenate([key_cell_values[key] for key in domain_keys])
+
+    output = pd.concat(domain_labels, ignore_index=True).iloc[cell_domains]
+    output = output.reset_index(drop=True)
+    output[question] = cell_values
+
+    return {
+        "indicators": indicators,
+        "n_cells": n_cells,
+        "cell_domains": cell_domains,
+        "cell_keys": domain_keys[cell_domains],
+        "key_codes": key_codes,
+        "n_keys": len(key_first),
+        "domain_rows": domain_rows,
+        "domain_codes": domain_codes,
+        "output": output,
+    }
+
+
+def create_psu_design(df, key_codes, n_keys, psu=param.PSU, strata=param.STRATA):
+    """Code the PSUs and strata of a stratified cluster sample, with PSUs nested in
+    strata, and count the PSUs in each stratum of each key's design.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    key_codes: np.ndarray
+        The key of each row, from create_proportion_cells
+    n_keys: int
+    psu: str
+        The name of the column containing PSUs
+    strata: str
+        The name of the column containing strata
+
+    Returns
+    -------
+    dict
+        The PSU of each row and its first row ('psu_codes', 'psu_first'), the
+        stratum of each PSU ('psu_strata'), the number of PSUs in each stratum of
+        each key ('design_psus'), and the degrees of freedom of each key's design
+        ('degrees_freedom')
+    """
+    n_rows = len(df)
+    psu_codes, psu_first = _factorize_arrays(
+        [df[strata].to_numpy(), df[psu].to_numpy()], n_rows
+    )
+    strata_codes, strata_first = _factorize_arrays([df[strata].to_numpy()], n_rows)
+    n_psus = len(psu_first)
+    psu_strata = strata_codes[psu_first]
+
+    # The PSUs in each stratum of each key's design
+    key_psus = np.unique(key_codes * n_psus + psu_codes)
+    design_psus = np.bincount(
+        psu_strata[key_psus % n_psus] * n_keys + key_psus // n_psus,
+        minlength=len(strata_first) * n_keys,
+    ).reshape(len(strata_first), n_keys)
+
+    return {
+        "psu_codes": psu_codes,
+        "psu_first": psu_first,
+        "psu_strata": psu_strata,
+        "design_psus": design_psus,
+        "degrees_freedom": design_psus.sum(axis=0) - (design_psus > 0).sum(axis=0),
+    }
+
+
+def format_proportions(cells, proportion, std_err, degrees_freedom, row_counts):
+    """Add the percentages, standard errors, confidence intervals and design
+    effects to the cells of a table of weighted percentages.
+
+    Parameters
+    ----------
+    cells: dict
+        As returned by create_proportion_cells
+    proportion: np.ndarray
+        The proportion of each cell
+    std_err: np.ndarray
+        The standard error of each proportion
+    degrees_freedom: np.ndarray
+        The degrees of freedom of each key's design
+    row_counts: np.ndarray
+        The number of pupils in each row
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+    cell_domains = cells["cell_domains"]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Design effect against simple random sampling of the domain's pupils
+        n_obs = np.bincount(
+            cells["domain_codes"],
+            weights=row_counts[cells["domain_rows"]],
+            minlength=cell_domains[-1] + 1,
+        )[cell_domains]
+        srs_variance = proportion * (1 - proportion) / (n_obs - 1)
+        deff = std_err / np.sqrt(srs_variance)
+
+    t_value = scipy_stats.t.ppf(0.975, degrees_freedom[cells["cell_keys"]])
+
+    output = cells["output"].copy()
+    output["R_Percentage"] = proportion
+    output["std_err"] = std_err
+    output["lower_ci"] = proportion - t_value * std_err
+    output["upper_ci"] = proportion + t_value * std_err
+    output["deff"] = deff
+
+    # Convert proportions to percentages
+    perc_cols = [
+        "std_err",
+        "R_Percentage",
+        "lower_ci",
+        "upper_ci",
+    ]
+    output[perc_cols] = output[perc_cols] * 100
+
+    return ci_cutoff(output)
+
+
+def survey_perc_proportions(
+    df,
+    question,
+    by,
+    psu=param.PSU,
+    strata=param.STRATA,
+    weights=param.WEIGHTING_VAR,
+    keys=None,
+    subgroup=None,
+    domains=None,
+    counts=None,
+):
+    """
+    Calculate a weighted percentage of a variable, i.e. how often each value
+    of the variable occurs as a percentage of the total, with Taylor linearised
+    standard errors. Gives the same output as stats_R.survey_perc_proportions,
+    without using R.
+
+    Each proportion is a ratio of weighted totals, so its linearised variance
+    only needs the weighted totals of each PSU. A sparse indicator matrix, with
+    a column for each response (and subgroup) in each domain of every key and
+    combination of breakdowns, is multiplied once by the weighted PSU membership
+    of the rows. This gives the PSU totals for every cell of the output in a
+    single sparse product, however many questions and domains there are.
+
+    As in the R survey package, the design is a stratified cluster sample with
+    PSUs nested in strata, single PSU strata are treated as certainty units, and
+    each key has its own design. Design effects are returned as DEft, and the
+    confidence intervals use a t distribution with the design degrees of
+    freedom, to match the R functions.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    question : str
+        Single variable name that defines the question to be analysed
+        (e.g. dallast5, alevr)
+    by: list[str]
+        The subpopulations to group statistics by
+    psu: str
+        The name of the column containing PSUs
+    strata: str
+        The name of the column containing strata
+    weights : str
+        The name of the column containing weights
+    keys: list[str]
+        Optional columns that split the data into separate calculations, each
+        with its own survey design, and that are never totalled (e.g. the
+        question column of stacked questions)
+    subgroup: dictionary
+        Optional new response codes, and the response values that form each
+        group e.g. {10: [1, 2, 3]}. The percentage of each group is returned as
+        an extra value of the question
+    domains: pd.DataFrame
+        Optional domains to estimate, with the keys and by columns, where
+        param.TOT_CODE is a total. Other domains are skipped and not included in
+        the output
+    counts: str
+        Optional column with the number of pupils in each row, if the rows are
+        totals of several pupils within a PSU. The standard errors only need the
+        PSU totals, so are the same, and the counts give the sample size used by
+        the design effects
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+    keys = list(keys or [])
+    columns = [*keys, *by, question, "R_Percentage", "std_err", "lower_ci",
+               "upper_ci", "deff"]
+
+    cells = create_proportion_cells(df, question, by, keys, subgroup, domains)
+    if cells is None:
+        return pd.DataFrame(columns=columns)
+
+    n_rows = len(df)
+    n_cells = cells["n_cells"]
+    cell_domains = cells["cell_domains"]
+    cell_keys = cells["cell_keys"]
+    row_weights = df[weights].to_numpy(dtype=float)
+
+    # Weighted membership of the PSUs, which are nested in strata
+    design = create_psu_design(df, cells["key_codes"], cells["n_keys"], psu, strata)
+    n_psus = len(design["psu_first"])
+    psu_weights = sparse.csr_matrix(
+        (row_weights, (design["psu_codes"], np.arange(n_rows))), shape=(n_psus, n_rows)
+    )
+
+    # Weighted totals of every cell and domain in each PSU, in one product
+    psu_totals = (psu_weights @ cells["indicators"]).tocsc()
+    cell_totals = psu_totals[:, :n_cells]
+    domain_totals = psu_totals[:, n_cells:][:, cell_domains]
+
+    numerator = np.asarray(cell_totals.sum(axis=0)).ravel()
+    denominator = np.asarray(domain_totals.sum(axis=0)).ravel()
+    proportion = numerator / denominator
+
+    # Linearised scores of each PSU, then the variance between the PSUs in each
+    # stratum, as sum((z - mean(z))^2) * n / (n - 1) for n PSUs in the stratum
+    scores = (
+        (cell_totals - domain_totals.multiply(proportion)).multiply(1 / denominator)
+    ).tocsr()
+    design_psus = design["design_psus"]
+    strata_membership = sparse.csr_matrix(
+        (np.ones(n_psus), (design["psu_strata"], np.arange(n_psus))),
+        shape=(len(design_psus), n_psus),
+    )
+    strata_squares = (strata_membership @ scores.power(2)).toarray()
+    strata_sums = (strata_membership @ scores).toarray()
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scale = np.where(design_psus > 1, design_psus / (design_psus - 1), 0)
+        centre = np.where(design_psus > 1, 1 / (design_psus - 1), 0)
+
+        variance = (
+            (scale[:, cell_keys] * strata_squares).sum(axis=0)
+            - (centre[:, cell_keys] * strata_sums ** 2).sum(axis=0)
+        )
+        std_err = np.sqrt(np.maximum(variance, 0))
+
+    if counts is None:
+        row_counts = (row_weights != 0).astype(float)
+    else:
+        row_counts = df[counts].to_numpy(dtype=float)
+
+    output = format_proportions(
+        cells, proportion, std_err, design["degrees_freedom"], row_counts
+    )
+
+    return output[columns]
+
+
+def c_statistics(response, predicted, weights=None):
+    """The c statistic, or area under the ROC curve, of each column of predicted
+    probabilities. This is the proportion of pairs of rows with different responses
+    where the row with the outcome has the higher probability, counting ties as a
+    half, the same as ModelMetrics::auc. With weights, each pair counts as the
+    product of the weights of its rows.
+
+    Each column is sorted once, then the weight of the rows without the outcome
+    below each group of tied probabilities is a cumulative sum, so this takes
+    O(n log n) time for n rows rather than comparing every pair. All the columns
+    are calculated together.
+
+    Parameters
+    ----------
+        response: np.ndarray
+            1 for rows with the outcome, else 0
+        predicted: np.ndarray
+            The predicted probabilities, one column for each model
+        weights: np.ndarray
+            Optional weight of each row, if None each row has a weight of 1
+
+    Returns
+    -------
+        np.ndarray
+            The c statistic of each column, or a float if predicted is 1D
+    """
+    predicted = np.asarray(predicted, dtype=float)
+    single = predicted.ndim == 1
+    if single:
+        predicted = predicted[:, None]
+    n_rows, n_models = predicted.shape
+
+    response = np.asarray(response) == 1
+    weights = np.ones(n_rows) if weights is None else np.asarray(weights, dtype=float)
+    positive_weights = np.where(response, weights, 0)
+    negative_weights = np.where(response, 0, weights)
+
+    order = np.argsort(predicted, axis=0, kind="stable")
+    ranked = np.take_along_axis(predicted, order, axis=0)
+
+    # Code each group of tied probabilities, in ascending order within each model
+    new_group = np.ones(ranked.shape, dtype=bool)
+    new_group[1:] = ranked[1:] != ranked[:-1]
+    groups = (np.cumsum(new_group.ravel(order="F")) - 1).reshape(
+        (n_rows, n_models), order="F"
+    )
+    n_groups = groups[-1, -1] + 1
+
+    group_positive = np.bincount(
+        groups.ravel(), positive_weights[order].ravel(), minlength=n_groups
+    )
+    group_negative = np.bincount(
+        groups.ravel(), negative_weights[order].ravel(), minlength=n_groups
+    )
+    # The first group of each model is in the first row
+    group_models = np.repeat(
+        np.arange(n_models), np.diff(np.append(groups[0], n_groups))
+    )
+
+    # Weight of the rows without the outcome below each group, in the same model
+    negative_below = np.cumsum(group_negative) - group_negative
+    negative_below -= negative_below[groups[0]][group_models]
+
+    concordant = np.bincount(
+        group_models,
+        group_positive * (negative_below + group_negative / 2),
+        minlength=n_models,
+    )
+    c_stats = concordant / (positive_weights.sum() * negative_weights.sum())
+
+    return c_stats[0] if single else c_stats
@@ -1,54 +1,13 @@
-from itertools import chain, combinations
-from typing import List
-
 import pandas as pd
 import rpy2.robjects as robjects
 
 import sdd_code.utilities.parameters as param
 from sdd_code.models.r_integration import r_to_py, py_to_r
-
-
-def get_breakdown_combinations(breakdowns: List[str]) -> chain:
-    """Get a chain of all breakdown combinations for a list of breakdowns
-
-    Parameters
-    ----------
-        breakdowns: list[str]
-            A list of breakdowns
-
-    Returns
-    -------
-        chain
-    """
-    n_replacements = len(breakdowns) + 1
-    breakdown_combinations = [combinations(breakdowns, n) for n in range(n_replacements)]
-    breakdown_combinations = chain.from_iterable(breakdown_combinations)
-
-    return breakdown_combinations
-
-
-def ci_cutoff(df, lower_ci="lower_ci", upper_ci="upper_ci"):
-    """Fix confidence intervals that go above 100 or below 0.
-
-    Due to the underlying method, a wald confidence interval equal to mu +/- 1.96 * se,
-    some confidence intervals can be outside of what should be statistically possible.
-    This function corrects those.
-
-    Parameters
-    ----------
-        df: pd.DataFrame
-        lower_ci: str
-        upper_ci: str
-
-    Returns
-    -------
-        pd.DataFrame
-    """
-
-    df.loc[df[lower_ci] < 0, lower_ci] = 0
-    df.loc[df[upper_ci] > 100, upper_ci] = 100
-
-    return df
+from sdd_code.utilities.stats import (
+    add_domain_flags,
+    ci_cutoff,
+    get_breakdown_combinations,
+)
 
 
 def survey_stats(
@@ -142,6 +101,7 @@ def survey_perc_ratios(
     psu=param.PSU,
     strata=param.STRATA,
     weights=param.WEIGHTING_VAR,
+    domains=None,
 ):
     """
     Calculate a weighted ratio of one variable against another, as well as
@@ -161,6 +121,9 @@ def survey_perc_ratios(
         The name of the column containing strata
     weight : str
         The name of the column containing weights
+    domains: pd.DataFrame
+        Optional domains to estimate, with the by columns, where param.TOT_CODE
+        is a total. Other domains are skipped and not included in the output
 
     Returns
     -------
@@ -174,12 +137,20 @@ def survey_perc_ratios(
     # Allow for no breakdowns
     df["const"] = 1
 
+    # Flag the domains to estimate for each combination of breakdowns
+    flag_cols = add_domain_flags(df, by, domains)
+
     # Convert inputs into R formats
     df_r = py_to_r(df)
 
     output_list = []
     by_combinations = get_breakdown_combinations(by)
-    for by_subset in by_combinations:
+    for by_subset, flag_col in zip(by_combinations, flag_cols):
+        # Skip combinations of breakdowns with no domains to estimate
+        if flag_col is not None and not df[flag_col].any():
+            continue
+        estimate = {} if flag_col is None else {"estimate": flag_col}
+
         # Allow for no breakdowns
         if not by_subset:
             by_subset = ["const"]
@@ -196,6 +167,7 @@ def survey_perc_ratios(
             psu=psu,
             strata=strata,
             weights=weights,
+            **estimate,
         )
 
         # Convert R dataframe to python
@@ -206,6 +178,12 @@ def survey_perc_ratios(
 
         output_list.append(output)
 
+    # Columns of the R output, if there are no domains to estimate
+    if not output_list:
+        output_list.append(pd.DataFrame(columns=[
+            *by, f"{question}/{base}", f"se.{question}/{base}", "DEff", "lower_ci",
+            "upper_ci"
+        ]))
     output = pd.concat(output_list)
 
     # Format the output
@@ -233,7 +211,15 @@ def survey_perc_ratios(
 
 
 def survey_perc_proportions(
-    df, question, by, psu=param.PSU, strata=param.STRATA, weights=param.WEIGHTING_VAR
+    df,
+    question,
+    by,
+    psu=param.PSU,
+    strata=param.STRATA,
+    weights=param.WEIGHTING_VAR,
+    keys=None,
+    subgroup=None,
+    domains=None,
 ):
     """
     Calculate a weighted percentage of a variable, i.e. how often each value
@@ -253,6 +239,19 @@ def survey_perc_proportions(
         The name of the column containing strata
     weights : str
         The name of the column containing weights
+    keys: list[str]
+        Optional columns that split the data into separate calculations, each
+        with its own survey design, and that are never totalled (e.g. the
+        question column of stacked questions)
+    subgroup: dictionary
+        Optional new response codes, and the response values that form each
+        group e.g. {10: [1, 2, 3]}. The percentage of each group is calculated
+        in the same pass, from an indicator of its responses, and returned as
+        an extra value of the question
+    domains: pd.DataFrame
+        Optional domains to estimate, with the keys and by columns, where
+        param.TOT_CODE is a total. Other domains are skipped and not included in
+        the output
 
     Returns
     -------
@@ -266,26 +265,59 @@ def survey_perc_proportions(
     # Allow for no breakdowns
     df["const"] = 1
 
+    # Add an indicator of the responses in each subgroup, named as the question
+    # followed by the subgroup code as expected by the R functions
+    subgroup = subgroup or {}
+    for subgroup_code, subgroup_values in subgroup.items():
+        df[f"{question}{subgroup_code}"] = (
+            df[question].isin(subgroup_values).astype(int)
+        )
+    subgroup_codes = [str(subgroup_code) for subgroup_code in subgroup]
+
+    # Flag the domains to estimate for each combination of breakdowns
+    flag_cols = add_domain_flags(df, by, domains, keys or [])
+
     # Convert inputs into R formats
     df_r = py_to_r(df)
 
     output_list = []
     by_combinations = get_breakdown_combinations(by)
-    for by_subset in by_combinations:
+    for by_subset, flag_col in zip(by_combinations, flag_cols):
+        # Skip combinations of breakdowns with no domains to estimate
+        if flag_col is not None and not df[flag_col].any():
+            continue
+        estimate = {} if flag_col is None else {"estimate": flag_col}
+
         # Allow for no breakdowns
         if not by_subset:
             by_subset = ["const"]
 
         not_in_subset = [col for col in by if col not in by_subset]
 
-        output_r = r.survey_proportion(
-            df_r,
-            question,
-            by=list(by_subset),
-            psu=psu,
-            strata=strata,
-            weights=weights,
-        )
+        if keys:
+            # Each key is calculated with its own survey design, in one R call
+            output_r = r.survey_proportion_by_keys(
+                df_r,
+                question,
+                by=list(by_subset),
+                keys=list(keys),
+                psu=psu,
+                strata=strata,
+                weights=weights,
+                subgroups=subgroup_codes,
+                **estimate,
+            )
+        else:
+            output_r = r.survey_proportion(
+                df_r,
+                question,
+                by=list(by_subset),
+                psu=psu,
+                strata=strata,
+                weights=weights,
+                subgroups=subgroup_codes,
+                **estimate,
+            )
 
         # Convert R dataframe to python
         output = r_to_py(output_r)
@@ -295,6 +327,12 @@ def survey_perc_proportions(
 
         output_list.append(output)
 
+    # Columns of the R output, if there are no domains to estimate
+    if not output_list:
+        output_list.append(pd.DataFrame(columns=[
+            *(keys or []), *by, question, "proportion", "se", "2.5 %", "97.5 %",
+            "DEff"
+        ]))
     output = pd.concat(output_list)
 
     # Format the output
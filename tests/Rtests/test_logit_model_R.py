@@ -1,3 +1,5 @@
+from concurrent.futures import ProcessPoolExecutor
+
 import pytest
 import pandas as pd
 import numpy as np
@@ -6,7 +8,7 @@ import sdd_code.utilities.parameters as param
 # If rpy2/R aren't installed then skip these tests
 try:
     import rpy2
-    from sdd_code.models.logit_model_R import logit_model
+    from sdd_code.models.logit_model_R import RModelServer, logit_model
 except ImportError:
     rpy2 = None
 
@@ -122,7 +124,7 @@ def test_logit_model():
         {
             "pairs": [25, 25, 25],
             "bubble_factor": [8, 8, 8],
-            "effect": [np.nan, "eff1", "eff2"],
+            "effect": ["", "eff1", "eff2"],
             "c_statistic": [0.74, 0.7, 0.6],
             "incorrect_guesses": [6.5, 7.50, 10.0],
             "add_incorrect_guesses": [np.nan, 1.0, 3.5],
@@ -154,3 +156,106 @@ def test_logit_model():
     pd.testing.assert_frame_equal(
         actual_effect, expected_effects, check_exact=False, rtol=1e-3
     )
+
+
+@pytest.mark.slow
+@pytest.mark.skipif(
+    rpy2 is None, reason="Skipping R integration tests if rpy2 is not installed"
+)
+def test_logit_model_server():
+    """Several models should be fitted by the same R process"""
+    input_df = pd.DataFrame(
+        {
+            "resp": [1, 1, 1, 0, 0, 1, 1, 0, 0, 0],
+            "eff1": [1, 1, 0, 0, 1, 1, 0, 0, 1, 0],
+            "eff2": [0, 1, 1, 0, 0, 1, 0, 0, 0, 1],
+            "psu": [1, 2, 1, 2, 3, 3, 4, 4, 5, 5],
+            "strata": [1, 1, 1, 1, 2, 2, 2, 2, 2, 2],
+            "weight": [1, 1, 1, 1, 0.5, 1.5, 1, 1, 1, 1],
+        }
+    )
+    factor_ref = pd.DataFrame(
+        {"factors": ["resp", "eff1", "eff2"], "refs": ["0", "0", "0"]}
+    )
+    kwargs = {
+        "model_response": "resp",
+        "factor_ref": factor_ref,
+        "weight": "weight",
+        "strata": "strata",
+        "psu": "psu",
+        "bubble_factor": 8,
+    }
+
+    server = RModelServer()
+    try:
+        first = logit_model(input_df, model_effects=["eff1", "eff2"], server=server, **kwargs)
+        pid = server.process.pid
+        second = logit_model(input_df, model_effects=["eff2", "eff1"], server=server, **kwargs)
+
+        assert server.process.pid == pid
+        pd.testing.assert_frame_equal(first["Model"], second["Model"])
+
+        # Errors in R are raised, and the server can still be used after them
+        bad_ref = pd.DataFrame({"factors": ["resp", "eff1"], "refs": ["0", "5"]})
+        with pytest.raises(RuntimeError):
+            logit_model(
+                input_df,
+                model_effects=["eff1", "eff2"],
+                server=server,
+                **{**kwargs, "factor_ref": bad_ref},
+            )
+        third = logit_model(input_df, model_effects=["eff1", "eff2"], server=server, **kwargs)
+
+        assert server.process.pid == pid
+        pd.testing.assert_frame_equal(first["Model"], third["Model"])
+    finally:
+        server.stop()
+
+
+@pytest.mark.slow
+@pytest.mark.skipif(
+    rpy2 is None, reason="Skipping R integration tests if rpy2 is not installed"
+)
+def test_logit_model_concurrent(tmp_path):
+    """Models fitted at the same time by several processes, sharing a temporary
+    folder, should match those fitted one after another"""
+    input_df = pd.DataFrame(
+        {
+            "resp": [1, 1, 1, 0, 0, 1, 1, 0, 0, 0],
+            "eff1": [1, 1, 0, 0, 1, 1, 0, 0, 1, 0],
+            "eff2": [0, 1, 1, 0, 0, 1, 0, 0, 0, 1],
+            "psu": [1, 2, 1, 2, 3, 3, 4, 4, 5, 5],
+            "strata": [1, 1, 1, 1, 2, 2, 2, 2, 2, 2],
+            "weight": [1, 1, 1, 1, 0.5, 1.5, 1, 1, 1, 1],
+        }
+    )
+    factor_ref = pd.DataFrame(
+        {"factors": ["resp", "eff1", "eff2"], "refs": ["0", "0", "0"]}
+    )
+    kwargs = {
+        "model_response": "resp",
+        "factor_ref": factor_ref,
+        "weight": "weight",
+        "strata": "strata",
+        "psu": "psu",
+        "bubble_factor": 8,
+        "temp_data_loc": tmp_path,
+    }
+    all_effects = [["eff1", "eff2"], ["eff1"], ["eff2"], ["eff2", "eff1"]] * 2
+
+    expected = [logit_model(input_df, model_effects=effects, **kwargs)
+                for effects in all_effects]
+
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        futures = [
+            executor.submit(logit_model, input_df, model_effects=effects, **kwargs)
+            for effects in all_effects
+        ]
+        actual = [future.result() for future in futures]
+
+    for actual_model, expected_model in zip(actual, expected):
+        for sheet in expected_model:
+            pd.testing.assert_frame_equal(actual_model[sheet], expected_model[sheet])
+
+    # Each model removes only its own temporary files
+    assert list(tmp_path.iterdir()) == []
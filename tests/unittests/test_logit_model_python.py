@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import sdd_code.utilities.parameters as param
+from sdd_code.models import logit_model_python
+
+
+@pytest.fixture()
+def model_input():
+    df = pd.DataFrame(
+        {
+            "resp": [1, 1, 1, 0, 0, 1, 1, 0, 0, 0],
+            "eff1": [1, 1, 0, 0, 1, 1, 0, 0, 1, 0],
+            "eff2": [0, 1, 1, 0, 0, 1, 0, 0, 0, 1],
+            "psu": [1, 2, 1, 2, 3, 3, 4, 4, 5, 5],
+            "strata": [1, 1, 1, 1, 2, 2, 2, 2, 2, 2],
+            "weight": [1, 1, 1, 1, 0.5, 1.5, 1, 1, 1, 1],
+        }
+    )
+    return df
+
+
+@pytest.fixture()
+def factor_ref():
+    return pd.DataFrame(
+        {"factors": ["resp", "eff1", "eff2"], "refs": ["0", "0", "0"]}
+    )
+
+
+def test_logit_model(model_input, factor_ref):
+    """The python model should give the same output as the R model, see
+    tests/Rtests/test_logit_model_rpy2.py for the R code used to get these values
+    """
+    expected_model = pd.DataFrame(
+        {
+            "Variable": ["eff1", "eff1", "eff2", "eff2", None],
+            "Measure": ["eff10", "eff11", "eff20", "eff21", "(Intercept)"],
+            "N": [5.0, 5.0, 6.0, 4.0, np.nan],
+            "coefficient": [np.nan, 1.3080, np.nan, 1.8536, -1.2102],
+            "odds_ratio": [np.nan, 3.6986, np.nan, 6.3828, 0.2981],
+            "prob_gt_t": [np.nan, 0.3079, np.nan, 0.3305, 0.5439],
+            "stderror": [np.nan, 0.6871, np.nan, 1.0591, 1.3898],
+            "lower_ci": [np.nan, 0.0, np.nan, 0.0, 0.0],
+            "upper_ci": [np.nan, np.inf, np.nan, np.inf, np.inf],
+            "ProbF": [0.3080, 0.3080, 0.3305, 0.3305, np.nan],
+            "Year": [param.YEAR] * 5,
+        }
+    )
+
+    expected_effects = pd.DataFrame(
+        {
+            "pairs": [25, 25, 25],
+            "bubble_factor": [8, 8, 8],
+            "effect": ["", "eff2", "eff1"],
+            "c_statistic": [0.74, 0.6, 0.7],
+            "incorrect_guesses": [6.5, 10.0, 7.50],
+            "add_incorrect_guesses": [np.nan, 3.5, 1.0],
+            "guess_reduction": [1, 0.35, 0.1333],
+            "bubble_diam": [np.nan, 5.3405, 3.2962],
+        }
+    )
+
+    actual = logit_model_python.logit_model(
+        model_input,
+        model_response="resp",
+        model_effects=["eff1", "eff2"],
+        factor_ref=factor_ref,
+        weight="weight",
+        strata="strata",
+        psu="psu",
+        bubble_factor=8
+    )
+
+    pd.testing.assert_frame_equal(
+        actual["Model"], expected_model, check_exact=False, rtol=1e-3
+    )
+    pd.testing.assert_frame_equal(
+        actual["Effect_Contributions"], expected_effects, check_exact=False, rtol=1e-3
+    )
+
+
+def test_create_design_matrix(model_input, factor_ref):
+    """Factors should be coded against their reference level, with interactions
+    named and ordered as in R"""
+    factor_ref = pd.DataFrame({"factors": ["eff1", "eff2"], "refs": ["1", "0"]})
+
+    design, names, terms, factors = logit_model_python.create_design_matrix(
+        model_input, ["eff1*eff2"], factor_ref
+    )
+
+    assert names == ["(Intercept)", "eff10", "eff21", "eff10:eff21"]
+    assert terms == {"eff1": [1], "eff2": [2], "eff1:eff2": [3]}
+    assert factors["eff1"]["labels"] == ["1", "0"]
+
+    eff1 = model_input["eff1"].eq(0).to_numpy(dtype=float)
+    eff2 = model_input["eff2"].eq(1).to_numpy(dtype=float)
+    np.testing.assert_array_equal(
+        design, np.column_stack([np.ones(10), eff1, eff2, eff1 * eff2])
+    )
+
+
+def test_logit_model_workers(model_input, factor_ref):
+    """Refitting the model without each effect concurrently should give the same
+    effect contributions as refitting them one after another"""
+    model_input = pd.concat([model_input] * 5, ignore_index=True)
+    model_input["eff3"] = [1, 2, 3, 1, 2, 3, 1] * 7 + [1]
+    factor_ref = pd.concat(
+        [factor_ref, pd.DataFrame({"factors": ["eff3"], "refs": ["1"]})]
+    )
+
+    kwargs = {
+        "model_response": "resp",
+        "model_effects": ["eff1", "eff2", "eff3"],
+        "factor_ref": factor_ref,
+        "weight": "weight",
+        "strata": "strata",
+        "psu": "psu",
+        "bubble_factor": 8,
+    }
+    expected = logit_model_python.logit_model(model_input, workers=1, **kwargs)
+    actual = logit_model_python.logit_model(model_input, workers=3, **kwargs)
+
+    pd.testing.assert_frame_equal(
+        actual["Effect_Contributions"], expected["Effect_Contributions"]
+    )
@@ -0,0 +1,81 @@
+import pandas as pd
+import pytest
+
+from sdd_code.models import logit_model_python, model_cache
+from sdd_code.utilities import parameters as param
+
+
+@pytest.fixture()
+def model_input():
+    df = pd.DataFrame(
+        {
+            "resp": [1, 1, 1, 0, 0, 1, 1, 0, 0, 0],
+            "eff1": [1, 1, 0, 0, 1, 1, 0, 0, 1, 0],
+            "eff2": [0, 1, 1, 0, 0, 1, 0, 0, 0, 1],
+            "psu": [1, 2, 1, 2, 3, 3, 4, 4, 5, 5],
+            "strata": [1, 1, 1, 1, 2, 2, 2, 2, 2, 2],
+            "weight": [1, 1, 1, 1, 0.5, 1.5, 1, 1, 1, 1],
+        }
+    )
+    return df
+
+
+@pytest.fixture()
+def model_kwargs():
+    return {
+        "model_response": "resp",
+        "model_effects": ["eff1", "eff2"],
+        "bubble_factor": 8,
+        "factor_ref": pd.DataFrame(
+            {"factors": ["resp", "eff1", "eff2"], "refs": ["0", "0", "0"]}
+        ),
+        "weight": "weight",
+        "strata": "strata",
+        "psu": "psu",
+    }
+
+
+def test_cached_logit_model(model_input, model_kwargs, tmp_path):
+    """An unchanged model should be loaded from the cache rather than refitted"""
+    fits = []
+
+    def engine_model(df, **kwargs):
+        fits.append(kwargs["model_effects"])
+        return logit_model_python.logit_model(df, **kwargs)
+
+    expected = model_cache.cached_logit_model(
+        engine_model, model_input, "python", tmp_path, **model_kwargs
+    )
+    # Other columns and the number of workers aren't part of the key
+    model_input["other"] = 1
+    actual = model_cache.cached_logit_model(
+        engine_model, model_input, "python", tmp_path, workers=2, **model_kwargs
+    )
+
+    assert fits == [["eff1", "eff2"]]
+    assert list(actual) == ["Model", "Effect_Contributions"]
+    for sheet in expected:
+        pd.testing.assert_frame_equal(actual[sheet], expected[sheet])
+
+
+def test_get_model_key(monkeypatch, model_input, model_kwargs):
+    """The key should change with the model's data, formula, bubble factor, engine
+    and year"""
+    expected = model_cache.get_model_key(model_input, "python", **model_kwargs)
+
+    changed_data = model_input.assign(eff1=model_input["eff1"].iloc[::-1].to_numpy())
+    changed_formula = {**model_kwargs, "model_effects": ["eff1*eff2"]}
+    changed_bubble = {**model_kwargs, "bubble_factor": 4}
+
+    keys = [
+        model_cache.get_model_key(changed_data, "python", **model_kwargs),
+        model_cache.get_model_key(model_input, "python", **changed_formula),
+        model_cache.get_model_key(model_input, "python", **changed_bubble),
+        model_cache.get_model_key(model_input, "R", **model_kwargs),
+    ]
+    assert expected == model_cache.get_model_key(model_input, "python", **model_kwargs)
+
+    monkeypatch.setattr(param, "YEAR", str(int(param.YEAR) + 1))
+    keys.append(model_cache.get_model_key(model_input, "python", **model_kwargs))
+
+    assert len({expected["key"], *[key["key"] for key in keys]}) == 6
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sdd_code.models import logit_model_python, model_data
+
+
+@pytest.fixture()
+def pupil_data():
+    df = pd.DataFrame(
+        {
+            "resp": [1, 1, 1, 0, 0, 1, 1, 0, 0, 0, -9, 1],
+            "eff1": [1, 1, 0, 0, 1, 1, 0, 0, 1, 0, 1, 1],
+            "eff2": [0, 1, 2, 0, 0, 1, 0, 2, 0, 1, 3, 3],
+            "age1315": [13, 14, 15, 13, 14, 15, 13, 14, 15, 13, 14, 12],
+            "volunsch": [0] * 12,
+            "dflagdummydrug": [0] * 12,
+            "dflagalcoutlier": [0] * 12,
+            "dflagcigoutlier": [0] * 12,
+            "psu": [1, 2, 1, 2, 3, 3, 4, 4, 5, 5, 5, 5],
+            "strata": [1, 1, 1, 1, 2, 2, 2, 2, 2, 2, 2, 2],
+            "weight": [1, 1, 1, 1, 0.5, 1.5, 1, 1, 1, 1, 1, 1],
+        }
+    )
+    return df
+
+
+@pytest.fixture()
+def factor_ref():
+    return pd.DataFrame(
+        {"factors": ["resp", "eff1", "eff2"], "refs": ["0", "1", "2"]}
+    )
+
+
+def test_select_model_data(pupil_data, factor_ref):
+    """The shared coding should give the same design matrix as coding the factors
+    from the model's rows, where level 3 of eff2 has no rows"""
+    data = model_data.create_model_data(pupil_data, factor_ref)
+
+    df, encoded = model_data.select_model_data(
+        data, "resp", ["eff1*eff2"], factor_ref,
+        weight="weight", strata="strata", psu="psu"
+    )
+
+    expected_df = pupil_data.iloc[:10][["resp", "eff1", "eff2", "strata", "psu", "weight"]]
+    pd.testing.assert_frame_equal(df, expected_df)
+
+    expected = logit_model_python.create_design_matrix(df, ["eff1*eff2"], factor_ref)
+    design, names, terms, factors = encoded
+    np.testing.assert_array_equal(design, expected[0])
+    assert names == expected[1]
+    assert terms == expected[2]
+    assert factors["eff2"]["labels"] == expected[3]["eff2"]["labels"] == ["2", "0", "1"]
+    np.testing.assert_array_equal(factors["eff2"]["codes"], expected[3]["eff2"]["codes"])
+
+
+def test_logit_model_encoded(pupil_data, factor_ref):
+    """A model using the shared coding should match one coding its own factors"""
+    pupil_data = pd.concat([pupil_data] * 3, ignore_index=True)
+    pupil_data["psu"] = pupil_data.index % 6
+    pupil_data["strata"] = pupil_data.index % 2
+    data = model_data.create_model_data(pupil_data, factor_ref)
+
+    kwargs = {
+        "model_response": "resp",
+        "model_effects": ["eff1", "eff2"],
+        "factor_ref": factor_ref,
+        "weight": "weight",
+        "strata": "strata",
+        "psu": "psu",
+        "bubble_factor": 8,
+    }
+    df, encoded = model_data.select_model_data(
+        data, kwargs["model_response"], kwargs["model_effects"], factor_ref,
+        weight="weight", strata="strata", psu="psu"
+    )
+    expected = logit_model_python.logit_model(df, **kwargs)
+    actual = logit_model_python.logit_model(df, encoded=encoded, **kwargs)
+
+    for name in expected:
+        pd.testing.assert_frame_equal(actual[name], expected[name])
@@ -0,0 +1,39 @@
+import pandas as pd
+
+from sdd_code.models import model_runner
+
+
+def _model_counts(df):
+    return {"Model": df.groupby("resp", as_index=False)["weight"].sum()}
+
+
+def _model_means(df):
+    return {"Model": df.groupby("eff1", as_index=False)["resp"].mean()}
+
+
+def test_run_models_workers():
+    """Models fitted by a pool of workers should match those fitted serially"""
+    df = pd.DataFrame(
+        {
+            "resp": [1, 1, 1, 0, 0, 1, 1, 0, 0, 0],
+            "eff1": [1, 1, 0, 0, 1, 1, 0, 0, 1, 0],
+            "weight": [1, 1, 1, 1, 0.5, 1.5, 1, 1, 1, 1],
+        }
+    )
+    models = [
+        {"name": "Counts", "content": _model_counts},
+        {"name": "Means", "content": _model_means},
+    ]
+
+    expected = {
+        model["name"]: model_data
+        for model, model_data in model_runner.run_models(models, df, workers=1)
+    }
+    actual = {
+        model["name"]: model_data
+        for model, model_data in model_runner.run_models(models, df, workers=2)
+    }
+
+    assert sorted(actual) == list(expected) == ["Counts", "Means"]
+    for name in expected:
+        pd.testing.assert_frame_equal(actual[name]["Model"], expected[name]["Model"])
@@ -0,0 +1,82 @@
+import pandas as pd
+import pytest
+
+from sdd_code.models import logit_model_python, model_sweep
+
+
+@pytest.fixture()
+def model_input():
+    df = pd.DataFrame(
+        {
+            "resp": [1, 1, 1, 0, 0, 1, 1, 0, 0, 0],
+            "eff1": [1, 1, 0, 0, 1, 1, 0, 0, 1, 0],
+            "eff2": [0, 1, 1, 0, 0, 1, 0, 0, 0, 1],
+            "psu": [1, 2, 1, 2, 3, 3, 4, 4, 5, 5],
+            "strata": [1, 1, 1, 1, 2, 2, 2, 2, 2, 2],
+            "weight": [1, 1, 1, 1, 0.5, 1.5, 1, 1, 1, 1],
+        }
+    )
+    return df
+
+
+def test_get_specifications():
+    """Every subset in the size range should include the required effects"""
+    actual = model_sweep.get_specifications(
+        ["a", "b", "c", "d"], min_effects=2, max_effects=3, required_effects=["c"]
+    )
+
+    assert actual == [
+        ["a", "c"], ["b", "c"], ["c", "d"], ["a", "b", "c"], ["a", "c", "d"], ["b", "c", "d"]
+    ]
+
+
+def test_sweep_models(model_input, monkeypatch):
+    """Each specification should have the c statistic of the model with its effects,
+    and cached specifications shouldn't be refitted"""
+    kwargs = {
+        "model_response": "resp",
+        "candidate_effects": ["eff1", "eff2"],
+        "factor_ref": pd.DataFrame(
+            {"factors": ["resp", "eff1", "eff2"], "refs": ["0", "0", "0"]}
+        ),
+        "weight": "weight",
+        "strata": "strata",
+        "psu": "psu",
+    }
+    cache = {}
+
+    actual = model_sweep.sweep_models(model_input, cache=cache, **kwargs)
+
+    # The c statistics of the full model and without each effect, see
+    # test_logit_model_python.test_logit_model. The deviance, eff_p and AIC are
+    # those of AIC() of each model in R:
+    #   design <- survey::svydesign(
+    #       ids = ~psu, strata = ~strata, weights = ~weight, data = df
+    #   )
+    #   model <- survey::svyglm(
+    #       resp ~ eff1 + eff2, design = design, family = quasibinomial()
+    #   )
+    #   AIC(model)
+    # here from an independent implementation of survey's extractAIC.svyglm
+    assert list(actual["formula"]) == ["resp ~eff1+eff2", "resp ~eff1", "resp ~eff2"]
+    assert actual["c_statistic"].tolist() == pytest.approx([0.74, 0.6, 0.7])
+    assert actual["deviance"].tolist() == pytest.approx(
+        [11.1469, 12.8388, 11.9777], rel=1e-4
+    )
+    assert actual["eff_p"].tolist() == pytest.approx(
+        [0.6547, 0.4673, 0.9064], rel=1e-3
+    )
+    assert actual["AIC"].tolist() == pytest.approx(
+        [12.4563, 13.7734, 13.7905], rel=1e-4
+    )
+    assert len(cache) == 3
+
+    def fail_fit(*args, **kwargs):
+        raise AssertionError("Cached specifications shouldn't be refitted")
+
+    monkeypatch.setattr(logit_model_python, "fit_logit", fail_fit)
+    cached = model_sweep.sweep_models(model_input, cache=cache, max_effects=1, **kwargs)
+
+    pd.testing.assert_frame_equal(
+        cached, actual.iloc[1:].reset_index(drop=True)
+    )
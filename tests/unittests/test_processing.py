@@ -1,8 +1,10 @@
+import tracemalloc
 import pytest
 import pandas as pd
 import numpy as np
 from sdd_code.utilities.processing import processing
 from sdd_code.utilities import parameters as param
+from sdd_code.utilities import stats
 from sdd_code.utilities.parameters import TOT_CODE as T
 
 
@@ -88,6 +90,37 @@ def test_add_response_subgroup(input_df):
     pd.testing.assert_frame_equal(actual, expected)
 
 
+def test_add_response_subgroup_nested():
+    """Nested subgroups should each include all of their responses, in the
+    order given, and subgroups with no responses are not added"""
+    input_df = pd.DataFrame(
+        {
+            "sex": [1, 1, 2, 2],
+            "alevr": [1, 2, 2, 3],
+            "NumerW": [0.5, 1.0, 1.5, 2.0],
+            "NumerU": [1, 2, 3, 4],
+        }
+    )
+
+    actual = processing.add_response_subgroup(
+        input_df,
+        breakdowns=["sex"],
+        question="alevr",
+        subgroup={6: [1, 2], 7: [9], 8: [1, 2, 3]},
+    )
+
+    expected = pd.DataFrame(
+        {
+            "sex": [1, 1, 2, 2, 1, 2, 1, 2],
+            "alevr": [1, 2, 2, 3, 6, 6, 8, 8],
+            "NumerW": [0.5, 1.0, 1.5, 2.0, 1.5, 1.5, 1.5, 3.5],
+            "NumerU": [1, 2, 3, 4, 3, 3, 3, 7],
+        }
+    )
+
+    pd.testing.assert_frame_equal(actual, expected)
+
+
 def test_transpose_multi(input_df):
     """Tests transpose_multi, which will transpose every
     column that isn't in breakdowns + pupilwt.
@@ -149,6 +182,244 @@ def test_suppress_column_round_dp():
     pd.testing.assert_series_equal(actual, expected)
 
 
+def test_suppress_column_unsuppressed():
+    """A column with nothing to suppress or round keeps its numeric type"""
+    input_df = pd.DataFrame(
+        {
+            "to_suppress": [10.59, 0, 50.167],
+            "base": [50, 90, 120],
+        }
+    )
+
+    actual = processing.suppress_column(input_df["to_suppress"], input_df["base"])
+
+    pd.testing.assert_series_equal(actual, input_df["to_suppress"])
+    assert actual.dtype == np.float64
+
+
+def test_published_domains():
+    """Domains that are suppressed or have unknown breakdowns are not published"""
+    input_df = pd.DataFrame(
+        {
+            "question": [1, 1, 2, 2, 1, 2],
+            "sex": [1, 2, 1, -1, 9999, 9999],
+            "DenomW": [29.9, 30, 100, 100, 35, 10],
+        }
+    )
+
+    actual = processing.published_domains(input_df, ["sex"], keys=["question"])
+
+    expected = pd.DataFrame({"question": [1, 2, 1], "sex": [2, 1, 9999]},
+                            index=[1, 2, 4])
+
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+@pytest.mark.parametrize("round_to_dp", [None, 0, 1, 2])
+def test_format_rounded(round_to_dp):
+    """Bulk formatting should match formatting each value with round()"""
+    values = np.concatenate(
+        [
+            np.random.default_rng(0).random(1000) * 120,
+            np.arange(0, 10, 0.05),
+            [0.5, 2.5, 1.15, 2.675, 69.65, -0.04, 1e-9, 100.0],
+        ]
+    )
+
+    actual = processing.format_rounded(values, round_to_dp)
+
+    expected = [f"[{round(value, round_to_dp)}]" for value in values.tolist()]
+
+    assert actual.tolist() == expected
+    assert processing.format_rounded(np.array([]), round_to_dp).tolist() == []
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        [3, -9, 9999, 3, 1],
+        [3, -9, 2 ** 40, 3, 1],
+        [2.5, np.nan, 1.0, 2.5],
+        ["b", "a", "b"],
+    ],
+)
+def test_factorize_sorted(values):
+    """Should match pd.factorize, with or without the lookup table"""
+    column = pd.Series(values)
+
+    actual_codes, actual_uniques = processing.factorize_sorted(column)
+    expected_codes, expected_uniques = pd.factorize(
+        column, sort=True, use_na_sentinel=False
+    )
+
+    np.testing.assert_array_equal(actual_codes, expected_codes)
+    pd.testing.assert_index_equal(actual_uniques, expected_uniques)
+
+
+def test_encode_domain():
+    """Domain keys should sort like the domains, and decode to the same values"""
+    input_df = pd.DataFrame(
+        {
+            "sex": [2, 1, 2, 1, -9],
+            "region": ["b", "c", "a", "c", "a"],
+            "age": [11.0, 12.0, 11.0, 15.0, 12.0],
+        }
+    )
+    domains = ["sex", "region", "age"]
+
+    keys, levels = processing.encode_domain(input_df, domains)
+
+    assert keys.dtype == np.int64
+    assert list(np.argsort(keys)) == list(
+        input_df.sort_values(domains).index
+    )
+    pd.testing.assert_frame_equal(
+        processing.decode_domain(keys, domains, levels), input_df
+    )
+
+
+def test_create_domain():
+    input_df = pd.DataFrame(
+        {
+            "sex": [2, 1, 2, 1],
+            "region": ["b", "c", "b", "c"],
+            "age": [11.0, 12.0, 11.0, 15.0],
+        }
+    )
+
+    actual = processing.create_domain(input_df, ["sex", "region", "age"])
+
+    expected = pd.Series(
+        ["2_b_11.0", "1_c_12.0", "2_b_11.0", "1_c_15.0"], dtype=pd.StringDtype()
+    )
+
+    pd.testing.assert_series_equal(actual, expected)
+
+
+def test_bincount_agg():
+    """Should match groupby, including missing weights and missing groups"""
+    input_df = pd.DataFrame(
+        {
+            "sex": [2, 1, 2, 1, 2, 1, 1],
+            "region": ["b", "c", "b", "c", "a", None, "c"],
+            "alevr": [1, 2, 1, 2, 2, 1, 1],
+            "weight": [0.5, 1.0, np.nan, 2.0, 1.5, 1.0, 0.25],
+        }
+    )
+    aggregations = {
+        "NumerW": ("weight", "sum"),
+        "NumerU": ("weight", "count"),
+        "AlevrSum": ("alevr", "sum"),
+    }
+
+    actual = processing.bincount_agg(input_df, ["sex", "region"], **aggregations)
+
+    expected = (
+        input_df.groupby(["sex", "region"]).agg(**aggregations).reset_index()
+    )
+
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+def test_weighted_stats_by_group():
+    """Should match applying create_weighted_stats to each group, including
+    missing values and medians on the cutoff"""
+    rng = np.random.default_rng(0)
+    input_df = pd.DataFrame(
+        {
+            "sex": rng.integers(1, 3, 500),
+            "age": rng.integers(11, 16, 500),
+            "nal7ut": rng.integers(0, 10, 500).astype(float),
+            param.WEIGHTING_VAR: rng.choice([0.5, 1.0, 1.5], 500),
+        }
+    )
+    input_df.loc[::17, "nal7ut"] = np.nan
+
+    actual = processing.weighted_stats_by_group(input_df, ["sex", "age"], "nal7ut")
+
+    expected = (
+        input_df.groupby(["sex", "age"])
+        .apply(stats.create_weighted_stats, "nal7ut")
+        .reset_index()
+    )
+
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+def test_bincount_agg_groups():
+    """Should match groupby on many groups, with missing groups, zero weights and
+    missing weights"""
+    rng = np.random.default_rng(0)
+    n_rows = 5000
+    input_df = pd.DataFrame(
+        {
+            "dgender": rng.integers(1, 3, n_rows),
+            "age1115": rng.integers(11, 16, n_rows),
+            "region": rng.integers(1, 10, n_rows).astype(float),
+            "dallast5": rng.integers(1, 6, n_rows),
+            param.WEIGHTING_VAR: rng.choice([0, 0.5, 1.0, 1.5], n_rows),
+        }
+    )
+    input_df.loc[::13, "region"] = np.nan
+    input_df.loc[::17, param.WEIGHTING_VAR] = np.nan
+    # A group with only zero weights
+    input_df.loc[input_df["dallast5"] == 5, param.WEIGHTING_VAR] = 0
+    by = ["dgender", "age1115", "region", "dallast5"]
+    aggregations = {
+        "NumerW": (param.WEIGHTING_VAR, "sum"),
+        "NumerU": (param.WEIGHTING_VAR, "count"),
+        "Responses": ("dallast5", "sum"),
+    }
+
+    actual = processing.bincount_agg(input_df, by, **aggregations)
+
+    expected = input_df.groupby(by).agg(**aggregations).reset_index()
+
+    assert not actual["region"].isna().any()
+    assert (actual.loc[actual["dallast5"] == 5, "NumerW"] == 0).all()
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+@pytest.mark.parametrize("by_column", [False, True])
+def test_melt_columns(by_column):
+    """Should match stacking the columns through the index, in the same order and
+    with the same types, dropping missing values and all missing columns"""
+    rng = np.random.default_rng(0)
+    n_rows = 500
+    drugs = [f"ddrug{i}" for i in range(5)]
+    input_df = pd.DataFrame(
+        {
+            "dgender": rng.integers(1, 3, n_rows),
+            "age1115": rng.integers(11, 16, n_rows),
+            param.WEIGHTING_VAR: rng.random(n_rows),
+            **{drug: rng.integers(0, 2, n_rows).astype(float) for drug in drugs},
+        }
+    )
+    input_df.loc[::7, "ddrug1"] = np.nan
+    input_df["ddrug3"] = np.nan
+    id_cols = ["dgender", "age1115", param.WEIGHTING_VAR]
+
+    actual = processing.melt_columns(
+        input_df, id_cols, drugs, "drug", by_column=by_column
+    )
+
+    expected = (
+        input_df.set_index(id_cols)
+        .stack()
+        .rename_axis(index={None: "drug"})
+        .rename("Value")
+        .reset_index()
+    )
+    if by_column:
+        # Stable sort, so the rows stay in order within each column
+        expected = expected.sort_values(
+            "drug", key=lambda drug: drug.map(drugs.index), kind="stable"
+        ).reset_index(drop=True)
+
+    assert "ddrug3" not in set(actual["drug"])
+    pd.testing.assert_frame_equal(actual, expected)
+
+
 def test_add_percentage():
     """
     Tests add_percentage, should calculate a percentage of two columns and
@@ -399,7 +670,7 @@ class TestCreateBreakdownSingle:
                 "NumerW": float,
                 "DenomW": float,
                 "DenomU": np.int64,
-                "Percentage": np.dtype("O"),
+                "Percentage": float,
             }
         )
 
@@ -515,7 +786,7 @@ class TestCreateBreakdownSingle:
                 "NumerW": float,
                 "DenomW": float,
                 "DenomU": np.int64,
-                "Percentage": np.dtype("O"),
+                "Percentage": float,
             }
         )
 
@@ -726,12 +997,23 @@ class TestCreateBreakdownSingle:
                 "NumerW": float,
                 "DenomW": float,
                 "DenomU": np.int64,
-                "Percentage": np.dtype("O"),
+                "Percentage": float,
             }
         )
 
         pd.testing.assert_frame_equal(actual, expected)
 
+    def test_none_breakdowns(self, single_breakdown_df):
+        """Breakdowns of None use the default grouping, the same as no breakdowns"""
+        actual = processing.create_breakdown_single(
+            single_breakdown_df, None, "q", None, None, create_SE=False
+        )
+        expected = processing.create_breakdown_single(
+            single_breakdown_df, [], "q", None, None, create_SE=False
+        )
+
+        pd.testing.assert_frame_equal(actual, expected)
+
     def test_create_se(self, single_breakdown_df):
         """Testing create_SE=True"""
         breakdowns = ["sex"]
@@ -1002,6 +1284,99 @@ class TestCreateBreakdownSingle:
         pd.testing.assert_frame_equal(actual, expected, check_exact=False, rtol=1e-3)
 
 
+class TestCreateBreakdownSingleBatch:
+    @pytest.mark.parametrize(
+        "breakdowns, filter_condition, subgroup",
+        [
+            (["sex"], None, None),
+            ([], None, None),
+            (None, None, None),
+            (["sex"], "y7smok == 1", None),
+            (["sex"], "{question} != 6", {10: [1, 5]}),
+            ([], "(sex == 2) & ({question} != 1)", {7: [2, 6], 8: [5, 6]}),
+        ]
+    )
+    def test_matches_single(
+        self, single_breakdown_df_combined, breakdowns, filter_condition, subgroup
+    ):
+        """Each batched output should equal the output of create_breakdown_single"""
+        questions = ["y7smok", "y8smok"]
+
+        actual = processing.create_breakdown_single_batch(
+            single_breakdown_df_combined,
+            breakdowns,
+            questions,
+            filter_condition,
+            create_SE=False,
+            subgroup=subgroup,
+        )
+
+        assert list(actual) == questions
+        for question in questions:
+            expected = processing.create_breakdown_single(
+                single_breakdown_df_combined,
+                breakdowns,
+                question,
+                None if filter_condition is None
+                else filter_condition.format(question=question),
+                subgroup,
+                create_SE=False,
+            )
+
+            pd.testing.assert_frame_equal(actual[question], expected)
+
+    @pytest.mark.parametrize("engine", ["R", "python"])
+    @pytest.mark.parametrize("breakdowns", [["sex"], []])
+    def test_matches_single_standard_errors(self, monkeypatch, engine, breakdowns):
+        """The batched standard errors, CIs and design effects should equal those
+        of create_breakdown_single, when a question has no valid responses in
+        some PSUs"""
+        monkeypatch.setattr(param, "SE_ENGINE", engine)
+        rng = np.random.default_rng(3)
+        n_rows = 2000
+        df = pd.DataFrame(
+            {
+                "sex": rng.integers(1, 3, n_rows),
+                "y7smok": rng.integers(1, 3, n_rows),
+                "y8smok": rng.integers(5, 7, n_rows),
+                param.WEIGHTING_VAR: rng.uniform(0.5, 2, n_rows),
+                param.STRATA: rng.integers(1, 4, n_rows),
+            }
+        )
+        df[param.PSU] = df[param.STRATA] * 10 + rng.integers(0, 4, n_rows)
+        df.loc[df[param.PSU] % 10 == 0, "y8smok"] = -9
+        questions = ["y7smok", "y8smok"]
+
+        actual = processing.create_breakdown_single_batch(
+            df, breakdowns, questions, None, create_SE=True
+        )
+
+        for question in questions:
+            expected = processing.create_breakdown_single(
+                df, breakdowns, question, None, None, create_SE=True
+            )
+
+            pd.testing.assert_frame_equal(actual[question], expected)
+
+    def test_invalid_responses(self, single_breakdown_df_combined):
+        """Negative responses are only removed for the question they belong to"""
+        single_breakdown_df_combined["y8smok"] = (
+            single_breakdown_df_combined["y8smok"].replace({6: -9})
+        )
+
+        actual = processing.create_breakdown_single_batch(
+            single_breakdown_df_combined,
+            ["sex"],
+            ["y7smok", "y8smok"],
+            None,
+            create_SE=False,
+        )
+
+        assert actual["y7smok"]["DenomU"].tolist() == [270, 270, 360, 360, 630, 630]
+        assert actual["y8smok"]["y8smok"].tolist() == [5, 5, 5]
+        assert actual["y8smok"]["DenomU"].tolist() == [180, 90, 270]
+
+
 class TestCreateBreakdownSingleCombined:
     def test_basic_combined(self, single_breakdown_df_combined):
         """Tests a very simple example of create_breakdown_single_combined"""
@@ -1176,7 +1551,7 @@ class TestCreateBreakdownSingleCombined:
                 "NumerW": float,
                 "DenomW": float,
                 "DenomU": np.int64,
-                "Percentage": np.dtype("O"),
+                "Percentage": float,
             }
         )
 
@@ -1184,6 +1559,26 @@ class TestCreateBreakdownSingleCombined:
             actual.reset_index(drop=True), expected.reset_index(drop=True)
         )
 
+    def test_none_breakdowns(self, single_breakdown_df_combined):
+        """Breakdowns of None should give the output of create_breakdown_single for
+        each question, with the question column renamed to Response"""
+        questions = ["y7smok", "y8smok"]
+
+        actual = processing.create_breakdown_single_combine(
+            single_breakdown_df_combined, None, questions, None, None, create_SE=False
+        )
+
+        expected = []
+        for question in questions:
+            expected_q = processing.create_breakdown_single(
+                single_breakdown_df_combined, None, question, None, None,
+                create_SE=False
+            ).rename(columns={question: "Response"})
+            expected_q.insert(2, "Question", question)
+            expected.append(expected_q)
+
+        pd.testing.assert_frame_equal(actual, pd.concat(expected))
+
     def test_combined_filter(self, single_breakdown_df_combined):
         """Tests an example of create_breakdown_single_combined
         with a filter"""
@@ -1733,6 +2128,65 @@ class TestCreateBreakdownSingleCombined:
         )
 
 
+def test_breakdown_group_index():
+    """The groups should be numbered in sorted order, in the row order of
+    add_breakdown_groups, skipping missing breakdowns"""
+    input_df = pd.DataFrame(
+        {
+            "sex": [2, 1, np.nan],
+            "age": [12, 11, 11],
+        }
+    )
+
+    groups, group_values = processing.breakdown_group_index(input_df, ["sex", "age"])
+
+    # Rows with no totals, sex totals, age totals, then both totals
+    np.testing.assert_array_equal(groups, [2, 0, -1, 5, 4, 4, 3, 1, -1, 6, 6, 6])
+
+    expected = pd.DataFrame(
+        {
+            "sex": [1.0, 1.0, 2.0, 2.0, 9999.0, 9999.0, 9999.0],
+            "age": [11, 9999, 12, 9999, 11, 12, 9999],
+        }
+    )
+
+    pd.testing.assert_frame_equal(group_values, expected)
+
+
+def test_stack_responses():
+    """Each response should only keep pupils with a valid base, dropping missing
+    responses"""
+    input_df = pd.DataFrame(
+        {
+            "sex": [1, 2, 1],
+            "resp1": [1, 0, 1],
+            "resp2": [0, np.nan, 1],
+            "base1": [1, -1, 1],
+            "base2": [-9, 1, 1],
+            param.WEIGHTING_VAR: [0.5, 1.0, 1.5],
+        }
+    )
+
+    actual = processing.stack_responses(
+        input_df,
+        ["sex", param.WEIGHTING_VAR],
+        ["resp1", "resp2"],
+        ["base1", "base2"],
+        "drug",
+    )
+
+    expected = pd.DataFrame(
+        {
+            "sex": [1, 1, 1],
+            param.WEIGHTING_VAR: [0.5, 1.5, 1.5],
+            "drug": ["resp1", "resp1", "resp2"],
+            "Value": [1.0, 1.0, 1.0],
+        }
+    )
+
+    pd.testing.assert_frame_equal(actual, expected)
+
+
 class TestCreateBreakdownMultiple:
     def test_discrete_response(self):
 
@@ -1975,3 +2429,53 @@ class TestAddBreakdownGroups(object):
             ],
         )
         pd.testing.assert_frame_equal(actual, expected)
+
+
+@pytest.mark.parametrize(
+    "create_table",
+    [
+        lambda df: processing.create_breakdown_single(
+            df, ["sex", "age"], "alevr", "dallast5 > 1", None, create_SE=False
+        ),
+        lambda df: processing.create_breakdown_single_batch(
+            df, ["sex"], ["alevr", "dallast5"], "dallast5 > 1", create_SE=False
+        ),
+        lambda df: processing.create_breakdown_multiple_discrete(
+            df, ["sex"], ["dlotr1", "dlotr2"], "dlotr", ["alevr"], "dallast5 > 1",
+            create_SE=False
+        ),
+        lambda df: processing.create_breakdown_multiple_cont(
+            df, ["sex"], ["dlotr1", "dlotr2"], "dlotr", "alevr", "dallast5 > 1",
+            create_SE=False
+        ),
+    ],
+)
+def test_tables_copy_only_needed_columns(create_table):
+    """The peak memory used to create a table from a wide dataset should be a
+    fraction of the dataset, as only the columns needed are copied"""
+    rng = np.random.default_rng(0)
+    n_rows = 20_000
+    input_df = pd.DataFrame(
+        {
+            **{f"other{i}": rng.random(n_rows) for i in range(300)},
+            "sex": rng.integers(1, 3, n_rows),
+            "age": rng.integers(11, 16, n_rows),
+            "alevr": rng.integers(-1, 3, n_rows),
+            "dallast5": rng.integers(1, 6, n_rows),
+            "dlotr1": rng.integers(0, 2, n_rows),
+            "dlotr2": rng.integers(0, 2, n_rows),
+            param.WEIGHTING_VAR: rng.random(n_rows),
+            param.STRATA: rng.integers(1, 5, n_rows),
+            param.PSU: rng.integers(1, 50, n_rows),
+        }
+    )
+    data_size = input_df.memory_usage().sum()
+
+    tracemalloc.start()
+    try:
+        create_table(input_df)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    assert peak < 0.5 * data_size
@@ -0,0 +1,324 @@
+import pandas as pd
+import pytest
+
+from sdd_code.utilities import parameters as param
+from sdd_code.utilities import replicate_weights
+from sdd_code.utilities import tables
+from sdd_code.utilities.processing import processing, processing_planner
+
+
+def test_get_table_spec():
+    """Recording a table should return its arguments without creating it"""
+    actual = processing_planner.get_table_spec(tables.create_breakdown_dgender_dagedrank)
+
+    expected = {
+        "engine": "create_breakdown_single",
+        "breakdowns": ["dgender"],
+        "question": "dagedrank",
+        "filter_condition": "(alevr == 1)  & (age1115 == 15)",
+        "subgroup": None,
+        "create_SE": param.CREATE_SE,
+    }
+
+    assert actual == expected
+
+    # The engines used by the tables should be restored after recording
+    assert tables.create_breakdown_single is processing.create_breakdown_single
+
+
+def test_plan_tables():
+    """Tables sharing breakdowns and filter are batched, others are left alone"""
+    all_tables = [
+        tables.create_breakdown_dgender_age1115_region_ethnicgp5_alevr,
+        tables.create_breakdown_dgender_age1315_daysdrank,
+        tables.create_breakdown_dgender_age1115_region_ethnicgp5_dallast5,
+        # Has a subgroup, so can't be batched
+        tables.create_breakdown_dgender_age1115_dalfrq7,
+        # Duplicates are only planned once
+        tables.create_breakdown_dgender_age1115_region_ethnicgp5_alevr,
+    ]
+
+    actual = processing_planner.plan_tables(all_tables)
+
+    assert [task["tables"] for task in actual] == [
+        [
+            tables.create_breakdown_dgender_age1115_region_ethnicgp5_alevr,
+            tables.create_breakdown_dgender_age1115_region_ethnicgp5_dallast5,
+        ],
+        [tables.create_breakdown_dgender_age1315_daysdrank],
+        [tables.create_breakdown_dgender_age1115_dalfrq7],
+    ]
+    assert [task["questions"] for task in actual] == [
+        ["alevr", "dallast5"], None, None
+    ]
+
+
+def test_run_task():
+    """A batched task should return the output of each table in the batch"""
+    df = pd.DataFrame(
+        {
+            "dgender": [1, 1, 2, 1, 2, 2, 2] * 10,
+            "alevr": [1, 1, 1, 2, 2, 2, -9] * 10,
+            "dallast5": [5, 5, 5, 6, 6, 6, 6] * 10,
+            param.WEIGHTING_VAR: [0.25, 0.5, 0.5, 1, 1.25, 1.5, 1.75] * 10,
+            param.STRATA: [1, 1, 1, 2, 2, 2, 2] * 10,
+            param.PSU: [1, 1, 2, 3, 3, 3, 4] * 10,
+        }
+    )
+    task = {
+        "tables": ["table_alevr", "table_dallast5"],
+        "questions": ["alevr", "dallast5"],
+        "key": (("dgender",), None, False),
+    }
+
+    actual = processing_planner.run_task(task, df)
+
+    for table, question in zip(task["tables"], task["questions"]):
+        expected = processing.create_breakdown_single(
+            df, ["dgender"], question, None, None, create_SE=False
+        )
+        pd.testing.assert_frame_equal(actual[table], expected)
+
+
+def test_get_task_columns():
+    """A task should only use the columns named by its tables and the design"""
+    task = {"tables": [tables.create_breakdown_dgender_dagedrank], "questions": None}
+    columns = [
+        "dgender", "alevr", "dallast5", "dagedrank", "age1115",
+        param.WEIGHTING_VAR, param.STRATA, param.PSU,
+    ]
+
+    actual = processing_planner.get_task_columns(task, columns)
+
+    assert actual == [
+        "dgender", "alevr", "dagedrank", "age1115",
+        param.WEIGHTING_VAR, param.STRATA, param.PSU,
+    ]
+
+    # Tables from outside tables.py can't be recorded, so use all the columns
+    assert processing_planner.get_task_columns({"tables": [_table_alevr]}, columns) is None
+
+
+def _table_alevr(df):
+    return processing.create_breakdown_single(
+        df, ["dgender"], "alevr", None, None, create_SE=False
+    )
+
+
+def _table_dallast5(df):
+    return processing.create_breakdown_single(
+        df, [], "dallast5", "alevr == 1", None, create_SE=False
+    )
+
+
+def test_create_chapter_tables_workers(monkeypatch, tmp_path):
+    """Tables created by a pool of workers should match those created serially"""
+    monkeypatch.setattr(param, "FUSE_TABLES", False)
+
+    df = pd.DataFrame(
+        {
+            "dgender": [1, 1, 2, 1, 2, 2, 2] * 10,
+            "alevr": [1, 1, 1, 2, 2, 2, -9] * 10,
+            "dallast5": [5, 5, 5, 6, 6, 6, 6] * 10,
+            param.WEIGHTING_VAR: [0.25, 0.5, 0.5, 1, 1.25, 1.5, 1.75] * 10,
+            param.STRATA: [1, 1, 1, 2, 2, 2, 2] * 10,
+            param.PSU: [1, 1, 2, 3, 3, 3, 4] * 10,
+        }
+    )
+    chapters = [
+        {
+            "sheets": [
+                {"name": "Ever_Drank", "content": [_table_alevr]},
+                {"name": "Last_Drank", "content": [_table_dallast5, _table_alevr]},
+                {"name": "Teacher", "content": [_table_alevr], "teacher_table": True},
+            ]
+        }
+    ]
+
+    timings_path = tmp_path / "timings.json"
+    expected = processing_planner.create_chapter_tables(
+        chapters, df, df, workers=1, timings_path=timings_path
+    )
+    actual = processing_planner.create_chapter_tables(
+        chapters, df, df, workers=2, timings_path=timings_path
+    )
+
+    assert list(actual) == list(expected) == [
+        (False, _table_alevr), (False, _table_dallast5), (True, _table_alevr)
+    ]
+    for key in expected:
+        pd.testing.assert_frame_equal(actual[key], expected[key])
+
+    # The time taken by each task should be saved for the next run
+    timings = processing_planner.load_timings(timings_path)
+    assert sorted(timings) == [
+        "pupil:_table_alevr", "pupil:_table_dallast5", "teacher:_table_alevr"
+    ]
+
+    # Without teacher sheets the teacher data isn't needed
+    pupil_chapters = [{"sheets": chapters[0]["sheets"][:2]}]
+    actual = processing_planner.create_chapter_tables(
+        pupil_chapters, df, None, workers=2, timings_path=timings_path
+    )
+
+    assert list(actual) == [(False, _table_alevr), (False, _table_dallast5)]
+    for key in actual:
+        pd.testing.assert_frame_equal(actual[key], expected[key])
+
+
+def _store_table_alevr(df):
+    # Uses the engine from tables, so the planner can record its arguments
+    return tables.create_breakdown_single(
+        df, ["dgender"], "alevr", None, None, create_SE=True
+    )
+
+
+def _store_table_dallast5(df):
+    return tables.create_breakdown_single(
+        df, [], "dallast5", "alevr == 1", {10: [5, 6]}, create_SE=True
+    )
+
+
+def test_create_chapter_tables_stores(monkeypatch, tmp_path):
+    """Tables in the stores are created without the data, others from the data"""
+    monkeypatch.setattr(param, "SE_ENGINE", "python")
+
+    df = pd.DataFrame(
+        {
+            "dgender": [1, 1, 2, 1, 2, 2, 2] * 10,
+            "alevr": [1, 1, 1, 2, 2, 2, -9] * 10,
+            "dallast5": [5, 5, 5, 6, 6, 6, 6] * 10,
+            param.WEIGHTING_VAR: [0.25, 0.5, 0.5, 1, 1.25, 1.5, 1.75] * 10,
+            param.STRATA: [1, 1, 1, 2, 2, 2, 2] * 10,
+            param.PSU: [1, 1, 2, 3, 3, 3, 4] * 10,
+        }
+    )
+    chapters = [
+        {
+            "sheets": [
+                {"name": "Ever_Drank", "content": [_store_table_alevr]},
+                {"name": "Last_Drank", "content": [_store_table_dallast5]},
+            ]
+        }
+    ]
+
+    timings_path = tmp_path / "timings.json"
+    expected = processing_planner.create_chapter_tables(
+        chapters, df, df, workers=1, timings_path=timings_path
+    )
+
+    stores = processing_planner.create_chapter_stores(chapters, df, df)
+    processing_planner.save_chapter_stores(stores, tmp_path / "stores")
+    stores = processing_planner.load_chapter_stores(tmp_path / "stores")
+
+    actual = processing_planner.create_chapter_tables(
+        chapters, None, None, workers=2, timings_path=timings_path, stores=stores
+    )
+
+    assert list(actual) == list(expected)
+    for key in expected:
+        pd.testing.assert_frame_equal(actual[key], expected[key])
+
+    # Only the teacher store is given, so the pupil tables use the data
+    teacher_chapters = [
+        {
+            "sheets": [
+                *chapters[0]["sheets"],
+                {
+                    "name": "Teacher",
+                    "content": [_store_table_alevr],
+                    "teacher_table": True,
+                },
+            ]
+        }
+    ]
+    teacher_store = processing_planner.create_chapter_stores(
+        teacher_chapters, df, df
+    )[True]
+    actual = processing_planner.create_chapter_tables(
+        teacher_chapters, df, None, workers=2, timings_path=timings_path,
+        stores={True: teacher_store}
+    )
+
+    assert list(actual) == [*expected, (True, _store_table_alevr)]
+    for key in expected:
+        pd.testing.assert_frame_equal(actual[key], expected[key])
+    pd.testing.assert_frame_equal(
+        actual[(True, _store_table_alevr)], expected[(False, _store_table_alevr)]
+    )
+
+    # A table not in the stores needs the data
+    assert processing_planner.in_chapter_stores(chapters, stores)
+    chapters[0]["sheets"].append(
+        {"name": "Other", "content": [tables.create_breakdown_dgender_dagedrank]}
+    )
+    assert not processing_planner.in_chapter_stores(chapters, stores)
+    with pytest.raises(ValueError):
+        processing_planner.create_chapter_tables(
+            chapters, None, None, timings_path=timings_path, stores=stores
+        )
+
+
+def _se_table_alevr(df):
+    return processing.create_breakdown_single(
+        df, ["dgender"], "alevr", None, None, create_SE=True
+    )
+
+
+def test_create_chapter_tables_replicates(monkeypatch, tmp_path):
+    """Teacher tables should use the replicate factors of the teacher data"""
+    monkeypatch.setattr(param, "FUSE_TABLES", False)
+    monkeypatch.setattr(param, "SE_ENGINE", "replicate")
+    monkeypatch.setattr(param, "REPLICATE_WEIGHTS_FILE", tmp_path / "pupil.parquet")
+    monkeypatch.setattr(
+        param, "TEACHER_REPLICATE_WEIGHTS_FILE", tmp_path / "teacher.parquet"
+    )
+
+    df = pd.DataFrame(
+        {
+            "dgender": [1, 1, 2, 1, 2, 2, 2] * 10,
+            "alevr": [1, 1, 1, 2, 2, 2, -9] * 10,
+            param.WEIGHTING_VAR: [0.25, 0.5, 0.5, 1, 1.25, 1.5, 1.75] * 10,
+            param.STRATA: [1, 1, 1, 2, 2, 2, 2] * 10,
+            param.PSU: [1, 1, 2, 3, 3, 3, 4] * 10,
+        }
+    )
+    # The teacher data has other schools
+    df_teacher = df.assign(**{param.PSU: df[param.PSU] + 100, param.WEIGHTING_VAR: 1})
+    for teacher_table, data_df in [(False, df), (True, df_teacher)]:
+        replicate_weights.save_replicate_factors(
+            replicate_weights.create_replicate_factors(data_df),
+            replicate_weights.get_replicate_weights_file(teacher_table),
+        )
+    chapters = [
+        {
+            "sheets": [
+                {"name": "Ever_Drank", "content": [_se_table_alevr]},
+                {
+                    "name": "Teacher",
+                    "content": [_se_table_alevr],
+                    "teacher_table": True,
+                },
+            ]
+        }
+    ]
+
+    for workers in [1, 2]:
+        actual = processing_planner.create_chapter_tables(
+            chapters, df, df_teacher, workers=workers,
+            timings_path=tmp_path / "timings.json"
+        )
+
+        with replicate_weights.teacher_data():
+            expected = _se_table_alevr(df_teacher)
+        pd.testing.assert_frame_equal(actual[(True, _se_table_alevr)], expected)
+
+
+def test_estimate_costs():
+    """Known tasks use their previous timing, unknown tasks the mean of these"""
+    timings = {"pupil:a": 10.0, "pupil:b": 2.0, "pupil:unused": 100.0}
+
+    actual = processing_planner.estimate_costs(["pupil:a", "pupil:b", "pupil:c"], timings)
+
+    assert actual == [10.0, 2.0, 6.0]
+    assert processing_planner.estimate_costs(["pupil:a"], {}) == [1.0]
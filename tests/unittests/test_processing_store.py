@@ -0,0 +1,129 @@
+import pandas as pd
+import pytest
+
+from sdd_code.utilities import parameters as param
+from sdd_code.utilities.processing import processing, processing_store
+
+
+@pytest.fixture()
+def store_df():
+    """Pupil data with several pupils in each PSU and breakdown group"""
+    df = pd.DataFrame(
+        {
+            "dgender": [1, 1, 2, 1, 2, 2, 2, -9],
+            "alevr": [1, 1, 1, 2, 2, 2, -9, 1],
+            "dallast5": [5, 5, 5, 6, 6, 6, 6, 5],
+            param.WEIGHTING_VAR: [0.25, 0.5, 0.5, 1, 1.25, 1.5, 1.75, 1],
+            param.STRATA: [1, 1, 1, 2, 2, 2, 2, 1],
+            param.PSU: [1, 1, 2, 3, 3, 3, 4, 2],
+        }
+    )
+    return pd.concat([df] * 10, ignore_index=True)
+
+
+def _spec(breakdowns, question, filter_condition=None, subgroup=None):
+    return {
+        "engine": "create_breakdown_single",
+        "breakdowns": breakdowns,
+        "question": question,
+        "filter_condition": filter_condition,
+        "subgroup": subgroup,
+        "create_SE": True,
+    }
+
+
+@pytest.mark.parametrize(
+    "spec",
+    [
+        _spec(["dgender"], "alevr"),
+        _spec(["dgender"], "dallast5"),
+        _spec([], "dallast5", "alevr == 1", {10: [5, 6]}),
+    ],
+)
+def test_create_table_from_store(monkeypatch, tmp_path, store_df, spec):
+    """Tables created from a saved store should match those created from the data"""
+    monkeypatch.setattr(param, "SE_ENGINE", "python")
+    specs = [
+        _spec(["dgender"], "alevr"),
+        _spec(["dgender"], "dallast5"),
+        _spec([], "dallast5", "alevr == 1", {10: [5, 6]}),
+    ]
+
+    processing_store.save_store(processing_store.create_store(specs, store_df), tmp_path)
+    store = processing_store.load_store(tmp_path)
+
+    actual = processing_store.create_table_from_store(store, spec)
+
+    expected = processing.create_breakdown_single(
+        store_df,
+        spec["breakdowns"],
+        spec["question"],
+        spec["filter_condition"],
+        spec["subgroup"],
+        create_SE=True,
+    )
+
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+def test_in_store(monkeypatch, store_df):
+    """Only the questions of single tables with totals are in the store"""
+    monkeypatch.setattr(param, "SE_ENGINE", "python")
+    store = processing_store.create_store([_spec(["dgender"], "alevr")], store_df)
+
+    assert processing_store.in_store(store, _spec(["dgender"], "alevr"))
+    assert not processing_store.in_store(store, _spec(["dgender"], "dallast5"))
+    assert not processing_store.in_store(store, _spec([], "alevr"))
+    assert not processing_store.in_store(
+        store, {**_spec(["dgender"], "alevr"), "engine": "create_breakdown_statistics"}
+    )
+
+
+@pytest.mark.parametrize(
+    "name, value",
+    [
+        ("INCLUDE_OUTLIERS", True),
+        ("DROP_COLUMNS", ["dallast5"]),
+        ("SE_ENGINE", "R"),
+        ("STORE_SOURCES", processing_store.STORE_SOURCES[:-1]),
+    ],
+)
+def test_load_store_fingerprint(monkeypatch, tmp_path, store_df, name, value):
+    """A store should only load with the fingerprint it was saved with, which
+    changes with the data, parameters and code"""
+    monkeypatch.setattr(param, "SE_ENGINE", "python")
+    data_path = tmp_path / "pupils.sav"
+    data_path.write_bytes(b"pupil data")
+    fingerprint = processing_store.get_fingerprint(data_path)
+    store = processing_store.create_store([_spec(["dgender"], "alevr")], store_df)
+    processing_store.save_store(store, tmp_path / "store", fingerprint)
+
+    actual = processing_store.load_store(tmp_path / "store", fingerprint)
+    assert list(actual) == list(store)
+
+    with monkeypatch.context() as changed:
+        changed.setattr(
+            processing_store if name == "STORE_SOURCES" else param, name, value
+        )
+        with pytest.raises(ValueError):
+            processing_store.load_store(
+                tmp_path / "store", processing_store.get_fingerprint(data_path)
+            )
+
+    data_path.write_bytes(b"new pupil data")
+    with pytest.raises(ValueError):
+        processing_store.load_store(
+            tmp_path / "store", processing_store.get_fingerprint(data_path)
+        )
+
+
+def test_in_store_r_engine(monkeypatch, store_df):
+    """Tables with R standard errors need the data, so aren't in the store"""
+    monkeypatch.setattr(param, "SE_ENGINE", "python")
+    spec = _spec(["dgender"], "alevr")
+    store = processing_store.create_store([spec], store_df)
+
+    monkeypatch.setattr(param, "SE_ENGINE", "R")
+
+    assert not processing_store.in_store(store, spec)
+    assert processing_store.in_store(store, {**spec, "create_SE": False})
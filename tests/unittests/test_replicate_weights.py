@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sdd_code.utilities import parameters as param
+from sdd_code.utilities import replicate_weights, stats
+
+
+@pytest.fixture()
+def survey_input():
+    """Pupils in 20 strata of 2 to 4 PSUs, with one single PSU stratum"""
+    rng = np.random.default_rng(1)
+    psu_strata = np.concatenate([np.repeat(np.arange(20), [2, 3, 4, 3] * 5), [20]])
+    row_psu = rng.integers(0, len(psu_strata), 4000)
+    df = pd.DataFrame(
+        {
+            "sex": rng.integers(1, 3, len(row_psu)),
+            "q": rng.integers(1, 4, len(row_psu)),
+            "weight": rng.uniform(0.5, 2, len(row_psu)),
+            "strata": psu_strata[row_psu],
+            "psu": row_psu,
+        }
+    )
+    return df
+
+
+def test_create_replicate_factors_jkn():
+    """Each jackknife replicate drops a PSU and reweights the rest of its stratum"""
+    df = pd.DataFrame({"strata": [1, 1, 1, 2, 2, 3], "psu": [1, 2, 3, 4, 5, 6]})
+
+    actual = replicate_weights.create_replicate_factors(
+        df, method="JKn", psu="psu", strata="strata"
+    )
+
+    expected = np.array(
+        [
+            [0, 1.5, 1.5, 1, 1],
+            [1.5, 0, 1.5, 1, 1],
+            [1.5, 1.5, 0, 1, 1],
+            [1, 1, 1, 0, 2],
+            [1, 1, 1, 2, 0],
+            [1, 1, 1, 1, 1],
+        ]
+    )
+    np.testing.assert_array_equal(actual["factors"], expected)
+    np.testing.assert_allclose(actual["scale"], [2 / 3] * 3 + [0.5] * 2)
+
+
+@pytest.mark.parametrize("method, rtol", [("JKn", 0.01), ("bootstrap", 0.15)])
+def test_survey_perc_proportions(survey_input, method, rtol):
+    """Replicate standard errors should agree with Taylor linearisation"""
+    kwargs = {"psu": "psu", "strata": "strata", "weights": "weight"}
+    replicates = replicate_weights.create_replicate_factors(
+        survey_input, method=method, n_replicates=1000, seed=1,
+        psu="psu", strata="strata"
+    )
+
+    expected = stats.survey_perc_proportions(survey_input.copy(), "q", ["sex"], **kwargs)
+    actual = replicate_weights.survey_perc_proportions(
+        survey_input.copy(), "q", ["sex"], replicates=replicates, **kwargs
+    )
+
+    pd.testing.assert_frame_equal(
+        actual[["sex", "q", "R_Percentage"]], expected[["sex", "q", "R_Percentage"]]
+    )
+    np.testing.assert_allclose(actual["std_err"], expected["std_err"], rtol=rtol)
+
+
+def test_save_replicate_factors(survey_input, tmp_path):
+    """Saved replicate factors should load unchanged, and give the replicate weights"""
+    replicates = replicate_weights.create_replicate_factors(
+        survey_input, method="bootstrap", n_replicates=10, psu="psu", strata="strata"
+    )
+    path = tmp_path / "replicates.parquet"
+
+    replicate_weights.save_replicate_factors(replicates, path)
+    actual = replicate_weights.load_replicate_factors(path)
+
+    pd.testing.assert_frame_equal(actual["design"], replicates["design"])
+    np.testing.assert_array_equal(actual["factors"], replicates["factors"])
+    np.testing.assert_array_equal(actual["scale"], replicates["scale"])
+
+    weights = replicate_weights.create_replicate_weights(
+        survey_input, actual, weights="weight", psu="psu", strata="strata"
+    )
+    assert weights.shape == (len(survey_input), 10)
+    np.testing.assert_allclose(
+        weights[0], survey_input["weight"][0] * actual["factors"][survey_input["psu"][0]]
+    )
+
+
+def test_teacher_data(monkeypatch, survey_input, tmp_path):
+    """Teacher tables should use the replicate factors of the teacher data, which
+    has its own schools"""
+    rng = np.random.default_rng(2)
+    teacher_df = pd.DataFrame(
+        {
+            "schlessons": rng.integers(1, 4, 300),
+            "weight": 1,
+            "strata": np.repeat(np.arange(10), 30),
+            "psu": 1000 + np.arange(300) // 3,
+        }
+    )
+    kwargs = {"psu": "psu", "strata": "strata", "weights": "weight"}
+    monkeypatch.setattr(param, "REPLICATE_WEIGHTS_FILE", tmp_path / "pupil.parquet")
+    monkeypatch.setattr(
+        param, "TEACHER_REPLICATE_WEIGHTS_FILE", tmp_path / "teacher.parquet"
+    )
+
+    for teacher_table, data_df in [(False, survey_input), (True, teacher_df)]:
+        replicate_weights.save_replicate_factors(
+            replicate_weights.create_replicate_factors(
+                data_df, psu="psu", strata="strata"
+            ),
+            replicate_weights.get_replicate_weights_file(teacher_table),
+        )
+
+    expected = stats.survey_perc_proportions(
+        teacher_df.copy(), "schlessons", [], **kwargs
+    )
+    with replicate_weights.teacher_data():
+        actual = replicate_weights.survey_perc_proportions(
+            teacher_df.copy(), "schlessons", [], **kwargs
+        )
+
+    np.testing.assert_allclose(actual["R_Percentage"], expected["R_Percentage"])
+    np.testing.assert_allclose(actual["std_err"], expected["std_err"], rtol=0.01)
+
+    # The teacher schools aren't in the pupil factors, used outside teacher_data
+    with pytest.raises(ValueError):
+        replicate_weights.survey_perc_proportions(
+            teacher_df.copy(), "schlessons", [], **kwargs
+        )
+
+
+def test_survey_perc_proportions_one_psu_domain(survey_input):
+    """A domain with all of its rows in one PSU has no estimate in the replicate
+    dropping that PSU, which should use the full sample estimate rather than give
+    a missing standard error"""
+    survey_input.loc[survey_input["psu"] == 0, "sex"] = 3
+    kwargs = {"psu": "psu", "strata": "strata", "weights": "weight"}
+    replicates = replicate_weights.create_replicate_factors(
+        survey_input, method="JKn", psu="psu", strata="strata"
+    )
+
+    actual = replicate_weights.survey_perc_proportions(
+        survey_input.copy(), "q", ["sex"], replicates=replicates, **kwargs
+    )
+    expected = stats.survey_perc_proportions(
+        survey_input.copy(), "q", ["sex"], **kwargs
+    )
+
+    assert (actual["sex"] == 3).any()
+    assert np.isfinite(actual[["std_err", "lower_ci", "upper_ci"]].to_numpy()).all()
+    np.testing.assert_allclose(actual["std_err"], expected["std_err"], rtol=0.01)
@@ -1,8 +1,10 @@
 import math
 
+import numpy as np
 import pytest
 import pandas as pd
 
+from sdd_code.utilities import parameters as param
 from sdd_code.utilities import stats
 
 try:
@@ -258,3 +260,120 @@ class TestCreateWeightedStats:
             mean_input, "value", "weight"
         )
         pd.testing.assert_series_equal(actual, expected, check_exact=False, rtol=1e-4)
+
+
+@pytest.fixture()
+def proportion_input():
+    """Data with standard errors calculated in R, see test_processing test_create_se"""
+    df = pd.DataFrame(
+        {
+            "sex": [1, 1, 1, 2, 2, 2],
+            "q": [1, 2, 3, 1, 2, 3],
+            "weight": [0.5, 0.5, 1, 1, 0.5, 1.5],
+            "strata": [1, 1, 1, 2, 2, 2],
+            "psu": [1, 1, 2, 3, 3, 3],
+        }
+    )
+    extra = pd.DataFrame(
+        {"sex": [2], "q": [1], "weight": [1], "strata": [2], "psu": [4]}
+    )
+    return pd.concat([df, extra] * 30, ignore_index=True)
+
+
+class TestSurveyPercProportions:
+    def test_matches_r(self, proportion_input):
+        """Percentages, standard errors and design effects match the R survey package"""
+        actual = stats.survey_perc_proportions(
+            proportion_input, "q", ["sex"], psu="psu", strata="strata", weights="weight"
+        )
+
+        T = param.TOT_CODE
+        expected = pd.DataFrame(
+            {
+                "sex": [1, 1, 1, 2, 2, 2, T, T, T],
+                "q": [1.0, 2.0, 3.0, 1.0, 2.0, 3.0, 1.0, 2.0, 3.0],
+                "R_Percentage": [25.0, 25.0, 50.0, 50.0, 12.5, 37.5, 41.6667,
+                                 16.6667, 41.6667],
+                "std_err": [25.0, 25.0, 50.0, 25.0, 6.25, 18.75, 16.1971, 8.7841,
+                            20.0308],
+                "lower_ci": [0.0] * 9,
+                "upper_ci": [100.0, 100.0, 100.0, 100.0, 39.3916, 100.0, 100.0,
+                             54.4616, 100.0],
+                "deff": [5.4467, 5.4467, 9.434, 5.4544, 2.0616, 4.2249, 4.7496,
+                         3.4075, 5.8738],
+            }
+        )
+
+        actual = actual.sort_values(["sex", "q"])
+        pd.testing.assert_frame_equal(
+            actual.reset_index(drop=True), expected, check_exact=False, rtol=1e-4
+        )
+
+    def test_subgroup(self, proportion_input):
+        """A subgroup matches recoding its responses"""
+        kwargs = {"psu": "psu", "strata": "strata", "weights": "weight"}
+        actual = stats.survey_perc_proportions(
+            proportion_input.copy(), "q", ["sex"], subgroup={10: [1, 2]}, **kwargs
+        )
+
+        recoded = proportion_input.assign(q=proportion_input["q"].replace({1: 10, 2: 10}))
+        expected = stats.survey_perc_proportions(recoded, "q", ["sex"], **kwargs)
+
+        pd.testing.assert_frame_equal(
+            actual[actual["q"] == 10].reset_index(drop=True),
+            expected[expected["q"] == 10].reset_index(drop=True),
+        )
+
+    def test_keys_and_domains(self, proportion_input):
+        """Each key has its own design, and only the domains given are estimated"""
+        kwargs = {"psu": "psu", "strata": "strata", "weights": "weight"}
+        df = pd.concat(
+            [
+                proportion_input.assign(key="a"),
+                proportion_input[proportion_input["psu"] != 4].assign(key="b"),
+            ],
+            ignore_index=True,
+        )
+        domains = pd.DataFrame({"key": ["a", "b"], "sex": [1, param.TOT_CODE]})
+
+        actual = stats.survey_perc_proportions(
+            df.copy(), "q", ["sex"], keys=["key"], domains=domains, **kwargs
+        )
+
+        for key, sex in zip(domains["key"], domains["sex"]):
+            expected = stats.survey_perc_proportions(
+                df[df["key"] == key].copy(), "q", ["sex"], **kwargs
+            )
+            expected = expected[expected["sex"] == sex].reset_index(drop=True)
+
+            key_actual = actual[actual["key"] == key].drop(columns="key")
+            pd.testing.assert_frame_equal(key_actual.reset_index(drop=True), expected)
+
+        assert len(actual) == 6
+        assert np.isfinite(actual["std_err"]).all()
+
+
+class TestCStatistics:
+    response = np.array([1, 0, 1, 0, 1])
+    predicted = np.array(
+        [[0.9, 0.1], [0.9, 0.2], [0.2, 0.3], [0.1, 0.4], [0.5, 0.5]]
+    )
+
+    def test_unweighted(self):
+        """Ties count as half a correctly ordered pair"""
+        actual = stats.c_statistics(self.response, self.predicted)
+
+        np.testing.assert_allclose(actual, [3.5 / 6, 3 / 6])
+
+    def test_weighted(self):
+        """Each pair counts as the product of the weights of its rows"""
+        actual = stats.c_statistics(
+            self.response, self.predicted, weights=[2, 1, 1, 1, 1]
+        )
+
+        np.testing.assert_allclose(actual, [5 / 8, 3 / 8])
+
+    def test_single_model(self):
+        actual = stats.c_statistics(self.response, self.predicted[:, 0])
+
+        assert actual == pytest.approx(3.5 / 6)